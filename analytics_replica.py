@@ -0,0 +1,301 @@
+"""
+Analytics Replica Module
+Keeps a second SQLite file holding the aggregate tables (SystemStats, tallies, hourly
+rollups) for the stats and chart endpoints, brought up to date in the background by
+copying only the rollup hours that changed, so reporting queries never hold locks on
+the file the detection writer commits to
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+from flask import g
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from models import db, SystemStats, PostalCodeTally, DetectionRollup, RollupChange
+from change_feed import latest_cursor
+from sqlite_profile import sqlite_profile, apply_pragmas, read_session
+
+logger = logging.getLogger(__name__)
+
+REPLICA_NAME = 'analytics.db'
+REPLICA_PREFIX = 'analytics_'  # Full copies written by earlier versions; removed on start
+REPLICA_TABLES = (SystemStats.__table__, PostalCodeTally.__table__, DetectionRollup.__table__)
+
+# Every change to an hour's rollups bumps that hour in rollup_changes (one row per hour, so the table stays small)
+_NEXT_SEQ = '(SELECT COALESCE(MAX(seq), 0) + 1 FROM rollup_changes)'
+ROLLUP_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_detection_rollups_{op}_change AFTER {op.upper()} ON detection_rollups
+    BEGIN
+        INSERT OR REPLACE INTO rollup_changes (bucket_hour, seq) VALUES ({row}.bucket_hour, {_NEXT_SEQ});
+    END"""
+    for op, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD'))
+]
+
+def install_rollup_triggers(conn):
+    """Create the rollup change triggers on a Core connection (idempotent)"""
+    for ddl in ROLLUP_TRIGGERS:
+        conn.execute(text(ddl))
+
+@event.listens_for(db.metadata, 'after_create')
+def _install_after_create(target, connection, **kw):
+    # Fresh databases built with create_all get the triggers too; existing ones get them from migration 014
+    if connection.dialect.name == 'sqlite' and RollupChange.__table__ in kw.get('tables', ()):
+        install_rollup_triggers(connection)
+
+def _columns(table):
+    return ', '.join(column.name for column in table.columns)
+
+class AnalyticsReplica:
+    """Read-only copy of the aggregates for dashboards, with a visible lag"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()  # One refresh at a time
+        self.writer = None  # sqlite3 connection to the replica, with the primary attached
+        self.engine = None
+        self.session_factory = None
+        self.path = None
+        self.snapshot_at = None  # When the replica last took changes from the primary
+        self.snapshot_cursor = None  # Change-feed position it includes
+        self.rollup_seq = None  # rollup_changes position it includes
+        self.current_at = None  # Last time the primary was seen with no changes beyond the replica
+        self.stats = {
+            'refreshes': 0,
+            'full_refreshes': 0,
+            'skipped': 0,
+            'failures': 0,
+            'last_duration_seconds': None,
+            'last_rollup_hours': None,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the analytics replica with Flask app"""
+        self.app = app
+
+        app.config.setdefault('ANALYTICS_REPLICA', False)  # Off: stats endpoints use the read-only pool on the primary
+        app.config.setdefault('ANALYTICS_REPLICA_DIR', os.path.join(app.instance_path, 'analytics'))
+        app.config.setdefault('ANALYTICS_REFRESH_SECONDS', 60)
+        app.config.setdefault('ANALYTICS_MAX_AGE_SECONDS', 900)  # Recopy SystemStats and tallies even without new detections
+        app.config.setdefault('ANALYTICS_POOL_SIZE', 4)
+
+        app.teardown_appcontext(self._remove_session)
+        app.after_request(self._add_lag_header)
+        app.extensions['analytics_replica'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.app is not None and self.app.config['ANALYTICS_REPLICA'] and sqlite_profile.is_sqlite())
+
+    @property
+    def replica_dir(self):
+        return self.app.config['ANALYTICS_REPLICA_DIR']
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='analytics-replica')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Analytics replica refresh failed: {e}")
+            time.sleep(self.app.config['ANALYTICS_REFRESH_SECONDS'])
+
+    def lag_seconds(self):
+        """Age of the data the stats endpoints are serving (None before the first refresh)"""
+        if self.current_at is None:
+            return None
+        return round((datetime.now() - self.current_at).total_seconds(), 1)
+
+    def _due(self, cursor, rollup_seq):
+        if self.snapshot_at is None:
+            return True
+        if (datetime.now() - self.snapshot_at).total_seconds() >= self.app.config['ANALYTICS_MAX_AGE_SECONDS']:
+            return True
+        return cursor != self.snapshot_cursor or rollup_seq != self.rollup_seq
+
+    def refresh(self, force=False):
+        """
+        Bring the replica up to date with the primary
+
+        The first refresh builds the replica; later ones copy the rollup hours changed
+        since the previous one, plus the (small) SystemStats and tally tables. Skipped
+        while neither the change feed nor the rollups moved, unless the replica is older
+        than ANALYTICS_MAX_AGE_SECONDS or force is set.
+
+        Returns:
+            bool: whether the replica took changes
+        """
+        with self.lock, self.app.app_context():
+            cursor = latest_cursor(db.session)
+            rollup_seq = db.session.query(db.func.max(RollupChange.seq)).scalar() or 0
+            if not force and not self._due(cursor, rollup_seq):
+                self.current_at = datetime.now()
+                self.stats['skipped'] += 1
+                return False
+            try:
+                self._refresh()
+            except Exception as e:
+                self.stats['failures'] += 1
+                self.stats['last_error'] = str(e)
+                raise
+            return True
+
+    def _open(self):
+        """Create an empty replica file and attach the primary to its writer connection"""
+        settings = self.app.config
+        os.makedirs(self.replica_dir, exist_ok=True)
+        self._remove_old_copies()
+        path = os.path.join(self.replica_dir, REPLICA_NAME)
+        for stale in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(stale):
+                os.remove(stale)  # Built from scratch: it may be a copy of another database
+
+        engine = create_engine(f'sqlite:///{path}')
+        try:
+            with engine.begin() as conn:
+                conn.execute(text('PRAGMA journal_mode = WAL'))  # Readers never wait for a refresh
+                db.metadata.create_all(bind=conn, tables=list(REPLICA_TABLES))
+        finally:
+            engine.dispose()
+
+        writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                 timeout=settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0)
+        writer.execute('PRAGMA synchronous = OFF')  # Rebuilt on every start: durability does not matter
+        writer.execute('ATTACH DATABASE ? AS source', (db.engine.url.database,))
+        self.writer, self.path, self.rollup_seq = writer, path, None
+
+    def _refresh(self):
+        started = time.monotonic()
+        if self.writer is None:
+            self._open()
+        writer = self.writer
+
+        # One transaction: every table is read from the same snapshot of the primary
+        writer.execute('BEGIN')
+        try:
+            cursor = writer.execute('SELECT COALESCE(MAX(seq), 0) FROM source.detection_changes').fetchone()[0]
+            rollup_seq = writer.execute('SELECT COALESCE(MAX(seq), 0) FROM source.rollup_changes').fetchone()[0]
+            rollups = DetectionRollup.__table__
+            if self.rollup_seq is None or rollup_seq < self.rollup_seq:
+                # First refresh, or rollup_changes started over (database rebuilt or restored): copy everything
+                writer.execute(f'DELETE FROM main.{rollups.name}')
+                writer.execute(f'INSERT INTO main.{rollups.name} ({_columns(rollups)}) '
+                               f'SELECT {_columns(rollups)} FROM source.{rollups.name}')
+                hours = None
+            else:
+                changed = 'SELECT bucket_hour FROM source.rollup_changes WHERE seq > ? AND seq <= ?'
+                hours = writer.execute(f'SELECT COUNT(*) FROM ({changed})', (self.rollup_seq, rollup_seq)).fetchone()[0]
+                writer.execute(f'DELETE FROM main.{rollups.name} WHERE bucket_hour IN ({changed})',
+                               (self.rollup_seq, rollup_seq))
+                writer.execute(f'INSERT INTO main.{rollups.name} ({_columns(rollups)}) '
+                               f'SELECT {_columns(rollups)} FROM source.{rollups.name} WHERE bucket_hour IN ({changed})',
+                               (self.rollup_seq, rollup_seq))
+            for table in (SystemStats.__table__, PostalCodeTally.__table__):
+                writer.execute(f'DELETE FROM main.{table.name}')
+                writer.execute(f'INSERT INTO main.{table.name} ({_columns(table)}) '
+                               f'SELECT {_columns(table)} FROM source.{table.name}')
+            writer.execute('COMMIT')
+        except Exception:
+            writer.execute('ROLLBACK')
+            raise
+
+        if self.engine is None:
+            self._switch_to(self.path)
+        if hours is None:
+            self.stats['full_refreshes'] += 1
+        self.snapshot_at = self.current_at = datetime.now()
+        self.snapshot_cursor = cursor
+        self.rollup_seq = rollup_seq
+
+        self.stats['refreshes'] += 1
+        self.stats['last_duration_seconds'] = round(time.monotonic() - started, 3)
+        self.stats['last_rollup_hours'] = hours
+        self.stats['last_error'] = None
+
+    def _switch_to(self, path):
+        settings = self.app.config
+        engine = create_engine(
+            f"sqlite:///{path}",
+            pool_size=settings['ANALYTICS_POOL_SIZE'],
+            connect_args={'check_same_thread': False}
+        )
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, settings, read_only=True)
+
+        previous = self.engine
+        # Requests already holding a session finish on the previous engine
+        self.engine, self.session_factory = engine, sessionmaker(bind=engine)
+        if previous is not None:
+            previous.dispose()
+
+    def _remove_old_copies(self):
+        for name in os.listdir(self.replica_dir):
+            if name.startswith(REPLICA_PREFIX):
+                try:
+                    os.remove(os.path.join(self.replica_dir, name))
+                except OSError:
+                    pass
+
+    def session(self):
+        """Session on the replica for the current app context (the read-only pool until the first refresh)"""
+        if self.session_factory is None:
+            return read_session()
+        if 'analytics_session' not in g:
+            g.analytics_session = self.session_factory()
+            g.analytics_lag = self.lag_seconds()
+        return g.analytics_session
+
+    def _remove_session(self, exception=None):
+        session = g.pop('analytics_session', None)
+        if session is not None:
+            session.close()
+
+    def _add_lag_header(self, response):
+        # Lets a dashboard show how stale the figures it just received are
+        lag = g.get('analytics_lag')
+        if lag is not None:
+            response.headers['X-Analytics-Lag-Seconds'] = str(lag)
+        return response
+
+    def to_dict(self):
+        report = {
+            'enabled': self.enabled,
+            'active': self.session_factory is not None,
+            'path': self.path,
+            'snapshot_at': self.snapshot_at.strftime("%Y-%m-%d %H:%M:%S") if self.snapshot_at else None,
+            'lag_seconds': self.lag_seconds(),
+            'changes_behind': None,
+            'size_bytes': os.path.getsize(self.path) if self.path and os.path.exists(self.path) else None,
+            **self.stats
+        }
+        if self.snapshot_cursor is not None:
+            report['changes_behind'] = latest_cursor(db.session) - self.snapshot_cursor
+        return report
+
+# Global instance
+analytics_replica = AnalyticsReplica()
+
+def analytics_session():
+    """Shortcut used by the stats and chart endpoints"""
+    return analytics_replica.session()
@@ -5,6 +5,7 @@ import pytesseract
 import re
 import os
 import json
+import math
 import base64
 from datetime import datetime, timedelta
 from flask import Flask, render_template, Response, jsonify, request, redirect, url_for, session, flash
@@ -12,10 +13,29 @@ import numpy as np
 from io import BytesIO
 from PIL import Image
 from functools import wraps
-from models import db, User, Detection, SystemStats
+from models import db, User, Detection, SystemStats, CameraProfile
 from tunisia_postal_codes import POSTAL_CODES as TUNISIA_POSTAL_CODES
+from postal_correction import MisreadResolver
+from ocr_watchdog import CycleDeadline, OCRWatchdog
+from camera_profiles import CameraProfileCache, CompiledProfile, parse_points
+from thermal_governor import ThermalGovernor
 from crud_routes import register_crud_routes
 from password_reset import password_reset_manager
+from detection_writer import detection_writer
+from detection_log import detection_log
+from detection_stats import unique_codes_count, hourly_counts, rollup_totals, region_counts
+from migrations import run_migrations
+from sqlite_profile import sqlite_profile, read_session
+from pagination import keyset_paginate
+from detection_archive import detection_archiver
+from db_backup import backup_manager
+from background_jobs import job_manager
+from db_maintenance import maintenance_scheduler
+from edge_sync import edge_sync, register_sync_routes
+from analytics_replica import analytics_replica, analytics_session
+from detection_rows import TIMESTAMP_MS
+from epoch_time import format_epoch_ms
+from fast_json import json_response
 from profile_forms import ProfileUpdateForm, PasswordChangeForm, AdminUserEditForm, AdminUserAddForm
 from flask_wtf.csrf import CSRFProtect
 import platform
@@ -60,9 +80,20 @@ MIN_CONFIDENCE = 50
 SCAN_INTERVAL = 1.0
 DETECTION_TIMEOUT = 15
 MAX_HISTORY_SIZE = 10
+SYMBOLOGY_FAST_PATH = True  # Try QR/non-retail barcode decoding before the OCR matrix
+MISREAD_CORRECTION = True  # Resolve invalid OCR reads to the most likely valid postal code
+CYCLE_DEADLINE = 3.0  # Seconds allowed for one scan cycle
+STAGE_BUDGETS = {'symbology': 0.15, 'preprocess': 0.15, 'ocr': 0.70}  # Share of the cycle deadline per stage
+OCR_CALL_TIMEOUT = 1.5  # Hard limit for a single tesseract call
+WATCHDOG_TIMEOUT = 10  # Restart the OCR worker when its loop stalls this long
+
+# Port and instance folder (database, backups, detection log) can be overridden so an
+# edge node and a central node can run side by side on one machine
+PORT = int(os.environ.get('DETECTOR_PORT', 5000))
+INSTANCE_PATH = os.environ.get('DETECTOR_INSTANCE_PATH')
 
 # Initialize Flask app
-app = Flask(__name__)
+app = Flask(__name__, instance_path=os.path.abspath(INSTANCE_PATH) if INSTANCE_PATH else None)
 app.secret_key = os.urandom(24)
 
 # Initialize CSRF protection (disabled for now)
@@ -72,16 +103,33 @@ app.secret_key = os.urandom(24)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this-in-production'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///detector.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SERVER_NAME'] = '127.0.0.1:5000'  # Added to fix URL building
+app.config['SERVER_NAME'] = f'127.0.0.1:{PORT}'  # Added to fix URL building
 app.config['APPLICATION_ROOT'] = '/'
 app.config['PREFERRED_URL_SCHEME'] = 'http'
 
+# Any setting can come from the environment, e.g. FLASK_SYNC_CENTRAL_URL=http://10.0.0.5:5000
+app.config.from_prefixed_env()
+
+# SQLite tuning (WAL, pragmas, busy timeout) must be configured before the engine is created
+sqlite_profile.init_app(app)
+
 # Initialize database
 db.init_app(app)
+sqlite_profile.bind()
 
 # Initialize password reset manager
 password_reset_manager.init_app(app)
 
+# Initialize the group-commit detection writer
+detection_writer.init_app(app)
+detection_log.init_app(app)
+detection_archiver.init_app(app)
+backup_manager.init_app(app)
+job_manager.init_app(app)
+maintenance_scheduler.init_app(app)
+edge_sync.init_app(app)
+analytics_replica.init_app(app)
+
 # Global variables
 frame = None
 latest_postal_code = None
@@ -91,6 +139,26 @@ last_postal_code_time = 0
 processing_active = True
 camera_lock = threading.Lock()
 
+# Per-path detection counters (symbology fast path vs OCR matrix)
+pipeline_stats = {
+    'symbology': 0,
+    'ocr': 0,
+    'no_detection': 0,
+    'corrected': 0
+}
+
+# Confusion-aware resolver for OCR misreads (keeps state across scan cycles)
+misread_resolver = MisreadResolver()
+
+# Watchdog restarting the OCR worker (and killing hung tesseract processes) when it stalls
+ocr_watchdog = OCRWatchdog(timeout=WATCHDOG_TIMEOUT)
+
+# Compiled ROI / perspective transforms per camera, reloaded when an admin edits a profile
+camera_profile_cache = CameraProfileCache()
+
+# Steps video feed, OCR effort and scan rate down when the Pi runs hot or busy
+governor = ThermalGovernor()
+
 # Check camera availability and set simulation mode accordingly
 def check_camera_availability():
     """Check if camera is available and set simulation mode if needed"""
@@ -249,8 +317,145 @@ def get_postal_code_info(postal_code):
         return TUNISIA_POSTAL_CODES[postal_code]
     return None
 
-def process_frames():
-    """Thread function to continuously process frames for OCR"""
+# Symbology detectors are created once; barcode support depends on the OpenCV build
+qr_detector = cv2.QRCodeDetector()
+barcode_detector = cv2.barcode.BarcodeDetector() if hasattr(cv2, 'barcode') else None
+
+# Product barcodes: their digits are article numbers, never a postal code
+RETAIL_SYMBOLOGIES = {'EAN_8', 'EAN_13', 'UPC_A', 'UPC_E'}
+# An explicitly labelled field, e.g. "postal_code=2000", "CP: 2000" or {"zip": "2000"}
+POSTAL_FIELD_PATTERN = re.compile(
+    r'\b(?:postal[_ -]?code|code[_ -]?postal|zip(?:[_ -]?code)?|cp)"?\s*[:=]\s*"?(\d{4})(?!\d)',
+    re.IGNORECASE
+)
+
+def symbology_postal_code(payload):
+    """Postal code carried by a decoded payload, or None
+    
+    Unlike OCR text, a payload is accepted only when it is exactly a 4-digit code or
+    labels one explicitly: any 4 digits inside a longer number are not a postal code.
+    """
+    payload = payload.strip()
+    if re.fullmatch(r'\d{4}', payload):
+        return payload
+    match = POSTAL_FIELD_PATTERN.search(payload)
+    return match.group(1) if match else None
+
+def decode_barcodes(frame):
+    """Payloads of non-retail linear barcodes on the frame"""
+    # Builds without detectAndDecodeWithType do not report the symbology, so nothing can be trusted
+    if barcode_detector is None or not hasattr(barcode_detector, 'detectAndDecodeWithType'):
+        return []
+    ok, payloads, types, _ = barcode_detector.detectAndDecodeWithType(frame)
+    if not ok:
+        return []
+    return [payload for payload, symbology in zip(payloads, types)
+            if payload and symbology not in RETAIL_SYMBOLOGIES]
+
+def decode_symbology(frame):
+    """Decode QR codes and barcodes on the frame and return valid postal codes"""
+    payloads = []
+    
+    try:
+        text, _, _ = qr_detector.detectAndDecode(frame)
+        if text:
+            payloads.append(text)
+    except cv2.error:
+        pass
+    
+    try:
+        payloads.extend(decode_barcodes(frame))
+    except cv2.error:
+        pass
+    
+    # Only accept codes that pass the same validation as OCR results
+    codes = []
+    for payload in payloads:
+        code = symbology_postal_code(payload)
+        if code and validate_postal_code(code) and code not in codes:
+            codes.append(code)
+    
+    return codes
+
+def run_ocr_matrix(frame, deadline=None):
+    """Run every preprocessing method against every OCR config until a code is found
+    
+    Returns (codes, text, confidence) where confidence is the mean tesseract word confidence.
+    With a CycleDeadline, each tesseract call is capped by the time left in the 'ocr' stage.
+    """
+    # Preprocess image for better OCR
+    processed_images = preprocess_image(frame)
+    if deadline is not None and deadline.expired('preprocess'):
+        ocr_watchdog.stats['stage_overruns'] += 1
+    
+    # Try multiple OCR configurations
+    ocr_configs = [
+        ('digits_only', r'--oem 3 --psm 8 -c tessedit_char_whitelist=0123456789'),
+        ('single_block', r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789'),
+        ('single_line', r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789'),
+        ('word_detection', r'--oem 3 --psm 8'),
+        ('auto_detection', r'--oem 3 --psm 3 -c tessedit_char_whitelist=0123456789')
+    ]
+    
+    all_detected_codes = []
+    best_text = ""
+    best_confidence = None
+    
+    out_of_time = False
+    
+    # The governor caps how many (method, config) strategies are tried under load
+    max_strategies = governor.settings['ocr_strategies']
+    strategies_tried = 0
+    
+    # Try each preprocessing method with each OCR config
+    for method, processed in processed_images:
+        for config_name, custom_config in ocr_configs:
+            if max_strategies is not None and strategies_tried >= max_strategies:
+                out_of_time = True
+                break
+            strategies_tried += 1
+            
+            call_timeout = OCR_CALL_TIMEOUT
+            if deadline is not None:
+                remaining = deadline.remaining('ocr')
+                if remaining <= 0:
+                    out_of_time = True
+                    break
+                call_timeout = min(call_timeout, remaining)
+            
+            try:
+                # image_to_data costs the same tesseract run and also returns word confidences
+                data = pytesseract.image_to_data(processed, config=custom_config, output_type=pytesseract.Output.DICT,
+                                                 timeout=call_timeout)
+                words = [(word.strip(), float(conf)) for word, conf in zip(data['text'], data['conf']) if word.strip()]
+                text = ' '.join(word for word, _ in words)
+                if text:
+                    codes = extract_postal_code(text)
+                    if codes:
+                        all_detected_codes.extend(codes)
+                        best_text = text
+                        word_confidences = [conf for _, conf in words if conf >= 0]
+                        if word_confidences:
+                            best_confidence = sum(word_confidences) / len(word_confidences)
+                        print(f"🔍 SUCCESS with {method} + {config_name}: '{text}' -> {codes}")
+                        break
+            except RuntimeError:
+                # pytesseract kills the process and raises RuntimeError on timeout
+                ocr_watchdog.stats['ocr_timeouts'] += 1
+                continue
+            except:
+                continue
+        if all_detected_codes or out_of_time:
+            break
+    
+    # Use the best detected codes
+    return list(set(all_detected_codes)), best_text, best_confidence  # Remove duplicates
+
+def process_frames(generation=None):
+    """Thread function to continuously process frames for OCR
+    
+    When started by the OCR watchdog, the loop exits as soon as a newer worker generation replaces it.
+    """
     global frame, latest_postal_code, latest_detection_time, processing_active, last_postal_code_time, latest_postal_code_valid
     
     last_scan_time = 0
@@ -259,8 +464,9 @@ def process_frames():
     print(f"🚀 Starting REAL OCR detection process...")
     print(f"📊 Mode: REAL CAMERA + OCR (No simulation)")
     
-    while processing_active:
+    while processing_active and (generation is None or ocr_watchdog.is_current(generation)):
         try:
+            ocr_watchdog.heartbeat()
             current_time = time.time()
             
             # Clear detection display if timeout exceeded
@@ -270,9 +476,12 @@ def process_frames():
                 latest_postal_code_valid = True
             
             # Process frame for detection at specified intervals
-            if current_time - last_scan_time >= SCAN_INTERVAL:
+            if current_time - last_scan_time >= SCAN_INTERVAL * governor.settings['scan_interval_factor']:
                 detection_cycle += 1
                 detected_codes = []
+                best_text = ""
+                detection_confidence = None
+                deadline = CycleDeadline(CYCLE_DEADLINE, STAGE_BUDGETS)
                 
                 # Real OCR processing (no simulation)
                 if frame is not None:
@@ -280,40 +489,27 @@ def process_frames():
                         with camera_lock:
                             current_frame = frame.copy()
                         
-                        # Preprocess image for better OCR
-                        processed_images = preprocess_image(current_frame)
-                        
-                        # Try multiple OCR configurations
-                        ocr_configs = [
-                            ('digits_only', r'--oem 3 --psm 8 -c tessedit_char_whitelist=0123456789'),
-                            ('single_block', r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789'),
-                            ('single_line', r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789'),
-                            ('word_detection', r'--oem 3 --psm 8'),
-                            ('auto_detection', r'--oem 3 --psm 3 -c tessedit_char_whitelist=0123456789')
-                        ]
-                        
-                        all_detected_codes = []
-                        best_text = ""
+                        # Crop and rectify once, so every later stage works on the label band only
+                        with app.app_context():
+                            current_frame = camera_profile_cache.apply(CAMERA_ID, current_frame)
                         
-                        # Try each preprocessing method with each OCR config
-                        for method, processed in processed_images:
-                            for config_name, custom_config in ocr_configs:
-                                try:
-                                    text = pytesseract.image_to_string(processed, config=custom_config).strip()
-                                    if text:
-                                        codes = extract_postal_code(text)
-                                        if codes:
-                                            all_detected_codes.extend(codes)
-                                            best_text = text
-                                            print(f"🔍 SUCCESS with {method} + {config_name}: '{text}' -> {codes}")
-                                            break
-                                except:
-                                    continue
-                            if all_detected_codes:
-                                break
+                        # Fast path: QR code / barcode carrying the postal code
+                        if SYMBOLOGY_FAST_PATH:
+                            detected_codes = decode_symbology(current_frame)
+                            if deadline.expired('symbology'):
+                                ocr_watchdog.stats['stage_overruns'] += 1
                         
-                        # Use the best detected codes
-                        detected_codes = list(set(all_detected_codes))  # Remove duplicates
+                        if detected_codes:
+                            pipeline_stats['symbology'] += 1
+                            best_text = detected_codes[0]
+                            detection_confidence = 100  # Decoder checksums guarantee the payload
+                            print(f"🔳 SYMBOLOGY: postal code decoded without OCR -> {detected_codes}")
+                        else:
+                            detected_codes, best_text, detection_confidence = run_ocr_matrix(current_frame, deadline)
+                            if detected_codes:
+                                pipeline_stats['ocr'] += 1
+                            else:
+                                pipeline_stats['no_detection'] += 1
                         
                         if detection_cycle % 5 == 0:  # Log every 5 cycles
                             if detected_codes:
@@ -332,62 +528,53 @@ def process_frames():
                 
                 # Process detected codes
                 if detected_codes:
-                    new_postal_code = detected_codes[0]
+                    # Prefer a code that is already in the Tunisia table
+                    valid_codes = [code for code in detected_codes if validate_postal_code(code)]
+                    new_postal_code = valid_codes[0] if valid_codes else detected_codes[0]
+                    raw_postal_code = new_postal_code
                     current_datetime = datetime.now()
+                    if detection_confidence is None:
+                        detection_confidence = MIN_CONFIDENCE
                     
                     # Validate the postal code
                     is_valid = validate_postal_code(new_postal_code)
                     
+                    # Resolve likely misreads (8/3/6/0, 1/7) instead of re-reading the same parcel
+                    if not is_valid and MISREAD_CORRECTION:
+                        corrected_code, probability = misread_resolver.resolve(raw_postal_code, detection_confidence)
+                        if corrected_code:
+                            print(f"🩹 Misread corrected: {raw_postal_code} -> {corrected_code} (p={probability:.2f})")
+                            new_postal_code = corrected_code
+                            is_valid = True
+                            pipeline_stats['corrected'] += 1
+                    
                     # Update global variables
                     latest_postal_code = new_postal_code
                     latest_detection_time = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
                     latest_postal_code_valid = is_valid
                     last_postal_code_time = current_time
                     
-                    # Save to database
-                    try:
-                        with app.app_context():
-                            detection = Detection(
-                                postal_code=new_postal_code,
-                                timestamp=current_datetime,
-                                confidence=MIN_CONFIDENCE,
-                                user_id=None,
-                                is_valid=is_valid
-                            )
-                            db.session.add(detection)
-                            
-                            # Update system statistics
-                            stats = SystemStats.query.first()
-                            if stats:
-                                stats.total_detections += 1
-                                stats.last_updated = current_datetime
-                                unique_count = db.session.query(Detection.postal_code).distinct().count()
-                                stats.unique_codes_count = unique_count
-                            else:
-                                new_stats = SystemStats(
-                                    start_time=current_datetime,
-                                    total_detections=1,
-                                    unique_codes_count=1,
-                                    last_updated=current_datetime
-                                )
-                                db.session.add(new_stats)
-                            
-                            db.session.commit()
-                            
-                            # Display detection info
-                            postal_info = get_postal_code_info(new_postal_code)
-                            location = postal_info['location'] if postal_info else "Unknown location"
-                            region = postal_info['region'] if postal_info else "Unknown region"
-                            
-                            if is_valid:
-                                print(f"✅ 🔍 REAL OCR: VALID postal code detected: {new_postal_code} ({region} - {location}) - SAVED")
-                            else:
-                                print(f"⚠️  🔍 REAL OCR: INVALID postal code detected: {new_postal_code} - SAVED")
+                    # Queue for the detection writer; the commit happens off the OCR thread
+                    detection_writer.submit(
+                        postal_code=new_postal_code,
+                        raw_postal_code=raw_postal_code,
+                        timestamp=current_datetime,
+                        confidence=detection_confidence,
+                        user_id=None,
+                        is_valid=is_valid
+                    )
                     
-                    except Exception as e:
-                        print(f"❌ Database save error: {e}")
-                        db.session.rollback()
+                    # Display detection info
+                    postal_info = get_postal_code_info(new_postal_code)
+                    location = postal_info['location'] if postal_info else "Unknown location"
+                    region = postal_info['region'] if postal_info else "Unknown region"
+                    
+                    if is_valid:
+                        print(f"✅ 🔍 REAL OCR: VALID postal code detected: {new_postal_code} ({region} - {location}) - QUEUED")
+                    else:
+                        print(f"⚠️  🔍 REAL OCR: INVALID postal code detected: {new_postal_code} - QUEUED")
                 
+                ocr_watchdog.record_cycle(deadline, deadline.expired())
                 last_scan_time = current_time
             
             time.sleep(0.1)
@@ -492,7 +679,8 @@ def generate_frames():
             cv2.putText(img, f"Camera {CAMERA_ID} - LIVE", (10, img.shape[0] - 10), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)
             
-            ret, buffer = cv2.imencode('.jpg', img)
+            quality = governor.settings['jpeg_quality']
+            ret, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else [])
             frame_bytes = buffer.tobytes()
             
             yield (b'--frame\r\n'
@@ -503,7 +691,7 @@ def generate_frames():
             time.sleep(0.1)
             continue
         
-        time.sleep(0.03)  # ~30 FPS
+        time.sleep(1.0 / governor.settings['stream_fps'])  # ~30 FPS unless throttled
 
 # Routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -647,6 +835,7 @@ def get_postal_code():
         'postal_code': latest_postal_code,
         'timestamp': latest_detection_time,
         'status': 'detected' if latest_postal_code else 'scanning',
+        'scanner_healthy': ocr_watchdog.is_healthy(),
         'valid': latest_postal_code_valid if latest_postal_code else None,
         'region': None,
         'location': None
@@ -665,13 +854,17 @@ def get_postal_code():
 def get_history():
     """Get detection history with regional information"""
     try:
-        detections = Detection.query.order_by(Detection.timestamp.desc()).limit(MAX_HISTORY_SIZE).all()
+        # Plain columns and one bulk timestamp format instead of hydrating Detection objects
+        detections = db.session.query(
+            Detection.postal_code, TIMESTAMP_MS, Detection.is_valid, Detection.confidence
+        ).order_by(Detection.timestamp.desc()).limit(MAX_HISTORY_SIZE).all()
+        timestamps = format_epoch_ms([detection.timestamp_ms for detection in detections])
         history = []
         
-        for detection in detections:
+        for detection, timestamp in zip(detections, timestamps):
             detection_data = {
                 'postal_code': detection.postal_code,
-                'timestamp': detection.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'timestamp': timestamp,
                 'is_valid': detection.is_valid,
                 'confidence': detection.confidence
             }
@@ -691,7 +884,7 @@ def get_history():
             
             history.append(detection_data)
         
-        return jsonify({
+        return json_response({
             'history': history,
             'count': len(history)
         })
@@ -781,30 +974,13 @@ def admin_system_reset():
     """Route for system reset (dangerous operation)"""
     if request.method == 'POST':
         try:
-            # Clear all detections
-            Detection.query.delete()
-            
-            # Reset system statistics
-            SystemStats.query.delete()
-            
-            # Create fresh system stats
-            new_stats = SystemStats(
-                start_time=datetime.now(),
-                total_detections=0,
-                unique_codes_count=0,
-                last_updated=datetime.now()
-            )
-            db.session.add(new_stats)
+            # Deleting in chunks keeps each transaction short; progress is at /api/jobs/<id>
+            job = job_manager.start_system_reset()
             
-            # Commit changes
-            db.session.commit()
-            
-            flash('System has been reset successfully. All detection data has been cleared.', 'success')
+            flash(f'System reset started (job {job.id}): deleting {job.total} detections in the background.', 'success')
             return redirect(url_for('admin_dashboard'))
             
         except Exception as e:
-            # Rollback on error
-            db.session.rollback()
             print(f"System reset error: {e}")
             flash(f'Error resetting system: {str(e)}', 'error')
             return redirect(url_for('admin_dashboard'))
@@ -903,36 +1079,27 @@ def api_user_stats():
         
         from datetime import date, timedelta
         
-        # Calculate statistics (ALL detections - valid and invalid)
-        total_detections = Detection.query.filter_by(user_id=user.id).count()
-        valid_detections = Detection.query.filter_by(user_id=user.id, is_valid=True).count()
-        invalid_detections = Detection.query.filter_by(user_id=user.id, is_valid=False).count()
+        # Calculate statistics (ALL detections - valid and invalid) from the rollups
+        total_detections, valid_detections = rollup_totals(analytics_session(), user_id=user.id)
+        invalid_detections = total_detections - valid_detections
         
         # Today's detections (all)
         today = date.today()
         today_start = datetime.combine(today, datetime.min.time())
-        today_detections = Detection.query.filter(
-            Detection.user_id == user.id,
-            Detection.timestamp >= today_start
-        ).count()
+        today_end = datetime.combine(today, datetime.max.time())
+        today_detections = sum(count for _, _, count in hourly_counts(
+            analytics_session(), today_start, today_end, user_id=user.id
+        ))
         
         # Success rate (valid / total)
         success_rate = round((valid_detections / total_detections) * 100, 1) if total_detections > 0 else 0
         
         # Most detected region (only from valid detections)
         favorite_region = 'None'
-        user_postal_codes = db.session.query(
-            Detection.postal_code,
-            db.func.count(Detection.id).label('count')
-        ).filter_by(user_id=user.id, is_valid=True).group_by(Detection.postal_code).order_by(
-            db.func.count(Detection.id).desc()
-        ).first()
-        
-        if user_postal_codes:
-            postal_code = user_postal_codes[0]
-            postal_info = get_postal_code_info(postal_code)
-            if postal_info:
-                favorite_region = postal_info['region']
+        user_regions = region_counts(analytics_session(), user_id=user.id)
+        user_regions.pop('', None)
+        if user_regions:
+            favorite_region = max(user_regions, key=user_regions.get)
         
         return jsonify({
             'total_detections': total_detections,
@@ -953,13 +1120,12 @@ def api_system_stats():
     """API endpoint for system-wide statistics"""
     try:
         # Get system statistics
-        stats = SystemStats.query.first()
+        stats = analytics_session().query(SystemStats).first()
         
-        # Count totals from database
-        total_detections = Detection.query.count()
-        valid_detections = Detection.query.filter_by(is_valid=True).count()
-        invalid_detections = Detection.query.filter_by(is_valid=False).count()
-        unique_codes = db.session.query(Detection.postal_code).distinct().count()
+        # Totals from the rollups
+        total_detections, valid_detections = rollup_totals(analytics_session())
+        invalid_detections = total_detections - valid_detections
+        unique_codes = unique_codes_count(analytics_session())
         
         # Calculate uptime if stats exist
         uptime_hours = 0
@@ -973,6 +1139,7 @@ def api_system_stats():
             'invalid_detections': invalid_detections,
             'unique_codes': unique_codes,
             'uptime_hours': uptime_hours,
+            'detection_paths': dict(pipeline_stats),
             'start_time': stats.start_time.strftime('%Y-%m-%d %H:%M:%S') if stats else None,
             'last_updated': datetime.now().strftime('%H:%M:%S')
         })
@@ -990,18 +1157,22 @@ def user_history():
             flash('User not found', 'error')
             return redirect(url_for('login'))
         
-        # Get page number from query parameters (default: 1)
-        page = request.args.get('page', 1, type=int)
         per_page = 20  # Number of detections per page
         
-        # Get user's detections with pagination
-        detections_pagination = Detection.query.filter_by(user_id=user.id).order_by(
-            Detection.timestamp.desc()
-        ).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # User totals come from the rollups, so no page needs a COUNT
+        total_detections, valid_detections = rollup_totals(read_session(), user_id=user.id)
+        
+        # Get user's detections with cursor pagination
+        try:
+            detections_pagination = keyset_paginate(
+                Detection.query.filter_by(user_id=user.id),
+                cursor=request.args.get('cursor'),
+                per_page=per_page,
+                total=total_detections,
+                archive_filters={'user_id': user.id}
+            )
+        except ValueError:
+            return redirect(url_for('user_history'))
         
         detections = detections_pagination.items
         
@@ -1020,9 +1191,7 @@ def user_history():
             enriched_detections.append(detection_data)
         
         # Calculate user statistics
-        total_detections = Detection.query.filter_by(user_id=user.id).count()
-        valid_detections = Detection.query.filter_by(user_id=user.id, is_valid=True).count()
-        invalid_detections = Detection.query.filter_by(user_id=user.id, is_valid=False).count()
+        invalid_detections = total_detections - valid_detections
         
         user_stats = {
             'total_detections': total_detections,
@@ -1230,25 +1399,22 @@ def api_user_detections_chart():
         end_date = date.today()
         start_date = end_date - timedelta(days=29)
         
-        # Query detections by day
+        # Daily totals from the hourly rollups
+        per_day = {}
+        for bucket_hour, is_valid, count in hourly_counts(
+                analytics_session(), datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date, datetime.max.time()), user_id=user.id):
+            per_day[bucket_hour.date()] = per_day.get(bucket_hour.date(), 0) + count
+        
         daily_detections = []
         current_date = start_date
         
         while current_date <= end_date:
-            day_start = datetime.combine(current_date, datetime.min.time())
-            day_end = datetime.combine(current_date, datetime.max.time())
-            
-            count = Detection.query.filter(
-                Detection.user_id == user.id,
-                Detection.timestamp >= day_start,
-                Detection.timestamp <= day_end
-            ).count()
-            
             daily_detections.append({
                 'date': current_date.strftime('%Y-%m-%d'),
                 'day': current_date.strftime('%d'),
                 'month': current_date.strftime('%b'),
-                'detections': count
+                'detections': per_day.get(current_date, 0)
             })
             
             current_date += timedelta(days=1)
@@ -1303,35 +1469,16 @@ def api_simulate_detection():
         latest_postal_code_valid = is_valid
         last_postal_code_time = time.time()
         
-        # Save to database
+        # Save to database through the detection writer
         user = User.query.filter_by(username=session['username']).first()
         if user:
-            detection = Detection(
+            detection_writer.submit(
                 postal_code=postal_code,
                 timestamp=current_datetime,
                 confidence=95,  # High confidence for manual simulation
                 user_id=user.id,
                 is_valid=is_valid
             )
-            db.session.add(detection)
-            
-            # Update system statistics
-            stats = SystemStats.query.first()
-            if stats:
-                stats.total_detections += 1
-                stats.last_updated = current_datetime
-                unique_count = db.session.query(Detection.postal_code).distinct().count()
-                stats.unique_codes_count = unique_count
-            else:
-                new_stats = SystemStats(
-                    start_time=current_datetime,
-                    total_detections=1,
-                    unique_codes_count=1,
-                    last_updated=current_datetime
-                )
-                db.session.add(new_stats)
-            
-            db.session.commit()
         
         # Get postal info
         postal_info = get_postal_code_info(postal_code) if is_valid else None
@@ -1422,13 +1569,12 @@ def get_stats():
     """Legacy API endpoint for system statistics (used by admin dashboard JS)"""
     try:
         # Get system statistics
-        stats = SystemStats.query.first()
+        stats = analytics_session().query(SystemStats).first()
         
-        # Count totals from database
-        total_detections = Detection.query.count()
-        valid_detections = Detection.query.filter_by(is_valid=True).count()
-        invalid_detections = Detection.query.filter_by(is_valid=False).count()
-        unique_codes = db.session.query(Detection.postal_code).distinct().count()
+        # Totals from the rollups
+        total_detections, valid_detections = rollup_totals(analytics_session())
+        invalid_detections = total_detections - valid_detections
+        unique_codes = unique_codes_count(analytics_session())
         
         # User statistics
         total_users = User.query.count()
@@ -1450,6 +1596,7 @@ def get_stats():
             'total_users': total_users,
             'admin_users': admin_users,
             'regular_users': regular_users,
+            'detection_paths': dict(pipeline_stats),
             'start_time': stats.start_time.strftime('%Y-%m-%d %H:%M:%S') if stats else None,
             'last_updated': datetime.now().strftime('%H:%M:%S'),
             'success_rate': round((valid_detections / total_detections) * 100, 1) if total_detections > 0 else 0
@@ -1508,25 +1655,14 @@ def manage_users():
 def get_regional_stats():
     """API endpoint for Tunisia regional postal code statistics"""
     try:
-        # Get all valid detections with postal codes
-        valid_detections = Detection.query.filter_by(is_valid=True).all()
-        
-        # Count detections by region
-        region_counts = {}
-        total_valid_detections = len(valid_detections)
-        
-        for detection in valid_detections:
-            postal_info = get_postal_code_info(detection.postal_code)
-            if postal_info:
-                region = postal_info['region']
-                if region in region_counts:
-                    region_counts[region] += 1
-                else:
-                    region_counts[region] = 1
+        # Count valid detections by region from the rollups
+        counts = region_counts(analytics_session())
+        total_valid_detections = sum(counts.values())
+        counts.pop('', None)  # Codes outside the Tunisia table count towards the total only
         
         # Convert to list format and calculate percentages
         regional_stats = []
-        for region, count in region_counts.items():
+        for region, count in counts.items():
             percentage = round((count / total_valid_detections) * 100, 1) if total_valid_detections > 0 else 0
             regional_stats.append({
                 'region': region,
@@ -1538,7 +1674,7 @@ def get_regional_stats():
         regional_stats.sort(key=lambda x: x['detections'], reverse=True)
         
         # Get unique regions detected vs total Tunisia regions
-        unique_regions_detected = len(region_counts)
+        unique_regions_detected = len(counts)
         total_tunisia_regions = 24  # Tunisia has 24 governorates
         coverage_percentage = round((unique_regions_detected / total_tunisia_regions) * 100, 1)
         
@@ -1611,6 +1747,160 @@ def api_camera_control():
         'tesseract_available': not SIMULATION_MODE or CAMERA_AVAILABLE
     })
 
+@app.route('/api/admin/camera_profiles')
+@admin_required
+def api_camera_profiles():
+    """API endpoint listing the ROI / perspective profiles of all cameras"""
+    try:
+        profiles = CameraProfile.query.order_by(CameraProfile.camera_id).all()
+        return jsonify({
+            'profiles': [profile.to_dict() for profile in profiles],
+            'current_camera': CAMERA_ID
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Error fetching camera profiles: {str(e)}'}), 500
+
+@app.route('/api/admin/camera_profiles/<int:camera_id>', methods=['GET', 'PUT', 'DELETE'])
+@admin_required
+def api_camera_profile(camera_id):
+    """API endpoint to view, configure or remove the profile of one camera"""
+    try:
+        profile = CameraProfile.query.filter_by(camera_id=camera_id).first()
+        
+        if request.method == 'GET':
+            if not profile:
+                return jsonify({'error': 'No profile for this camera'}), 404
+            return jsonify(profile.to_dict())
+        
+        if request.method == 'DELETE':
+            if profile:
+                db.session.delete(profile)
+                db.session.commit()
+            camera_profile_cache.invalidate(camera_id)
+            return jsonify({'success': True, 'message': f'Profile for camera {camera_id} removed'})
+        
+        data = request.get_json() or {}
+        if not profile:
+            profile = CameraProfile(camera_id=camera_id)
+            db.session.add(profile)
+        
+        # Validate geometry and sizes before saving
+        try:
+            if 'roi_polygon' in data:
+                profile.roi_polygon = json.dumps(parse_points(data['roi_polygon']).tolist()) if data['roi_polygon'] else None
+            if 'perspective_quad' in data:
+                profile.perspective_quad = json.dumps(parse_points(data['perspective_quad'], expected=4).tolist()) if data['perspective_quad'] else None
+            for field in ('output_width', 'output_height'):
+                if field in data:
+                    size = int(data[field]) if data[field] else None
+                    if size is not None and size <= 0:
+                        raise ValueError(f'{field} must be a positive number of pixels')
+                    setattr(profile, field, size)
+            if 'deskew_angle' in data:
+                angle = float(data['deskew_angle'] or 0)
+                if not math.isfinite(angle):
+                    raise ValueError('deskew_angle must be a finite number of degrees')
+                profile.deskew_angle = angle
+            if 'enabled' in data:
+                profile.enabled = bool(data['enabled'])
+            
+            # Make sure the transform compiles for the configured resolution (a degenerate quad raises cv2.error)
+            CompiledProfile(profile, (DISPLAY_HEIGHT, DISPLAY_WIDTH))
+        except (ValueError, TypeError, cv2.error) as e:
+            db.session.rollback()
+            return jsonify({'error': f'Invalid geometry: {str(e)}'}), 400
+        
+        profile.updated_at = datetime.now()
+        
+        db.session.commit()
+        camera_profile_cache.invalidate(camera_id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Profile for camera {camera_id} saved',
+            'profile': profile.to_dict()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error saving camera profile: {str(e)}'}), 500
+
+@app.route('/api/admin/camera_profiles/<int:camera_id>/preview')
+@admin_required
+def api_camera_profile_preview(camera_id):
+    """API endpoint returning the current frame as seen by the OCR pipeline"""
+    try:
+        with camera_lock:
+            current_frame = frame.copy() if frame is not None else None
+        
+        if current_frame is None:
+            return jsonify({'error': 'No camera frame available'}), 503
+        
+        processed = camera_profile_cache.apply(camera_id, current_frame)
+        ret, buffer = cv2.imencode('.jpg', processed)
+        return Response(buffer.tobytes(), mimetype='image/jpeg')
+        
+    except Exception as e:
+        return jsonify({'error': f'Error rendering preview: {str(e)}'}), 500
+
+@app.route('/api/governor')
+@login_required
+def api_governor():
+    """API endpoint for the CPU/thermal governor level and readings"""
+    try:
+        return jsonify(governor.to_dict())
+        
+    except Exception as e:
+        return jsonify({'error': f'Error fetching governor status: {str(e)}'}), 500
+
+@app.route('/api/admin/archive', methods=['GET', 'POST'])
+@admin_required
+def api_admin_archive():
+    """API endpoint for the detection archive: chunk list (GET) or archive eligible months now (POST)"""
+    try:
+        if request.method == 'POST':
+            archived = detection_archiver.run_once()
+            return jsonify({
+                'success': True,
+                'archived': [{'month': month, 'rows': rows} for month, rows in archived]
+            })
+        
+        return jsonify(detection_archiver.summary(read_session()))
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error archiving detections: {str(e)}'}), 500
+
+@app.route('/api/admin/backups', methods=['GET', 'POST'])
+@admin_required
+def api_admin_backups():
+    """API endpoint for database backups: list with checksum status (GET) or back up now (POST)"""
+    try:
+        if request.method == 'POST':
+            backup = backup_manager.backup_now()
+            backup['created_at'] = backup['created_at'].strftime("%Y-%m-%d %H:%M:%S")
+            return jsonify({'success': True, 'backup': backup})
+        
+        return jsonify(backup_manager.to_dict(verify=request.args.get('verify') == '1'))
+        
+    except Exception as e:
+        return jsonify({'error': f'Error backing up database: {str(e)}'}), 500
+
+@app.route('/api/admin/maintenance', methods=['GET', 'POST'])
+@admin_required
+def api_admin_maintenance():
+    """API endpoint for database maintenance: last report (GET) or run now as a background job (POST)"""
+    try:
+        if request.method == 'POST':
+            job = job_manager.submit('maintenance', maintenance_scheduler.run_once, total=4)
+            return jsonify({'success': True, 'job': job.to_dict()}), 202
+        
+        return jsonify(maintenance_scheduler.to_dict())
+        
+    except Exception as e:
+        return jsonify({'error': f'Error running database maintenance: {str(e)}'}), 500
+
 @app.route('/api/camera_test')
 @admin_required
 def api_camera_test():
@@ -1655,31 +1945,26 @@ def api_admin_detections_trend():
         end_date = date.today()
         start_date = end_date - timedelta(days=6)
         
+        # Daily totals from the hourly rollups
+        totals = {}
+        valids = {}
+        for bucket_hour, is_valid, count in hourly_counts(
+                analytics_session(), datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date, datetime.max.time())):
+            day = bucket_hour.date()
+            totals[day] = totals.get(day, 0) + count
+            if is_valid:
+                valids[day] = valids.get(day, 0) + count
+        
         labels = []
         total_counts = []
         valid_counts = []
         
         current_date = start_date
         while current_date <= end_date:
-            day_start = datetime.combine(current_date, datetime.min.time())
-            day_end = datetime.combine(current_date, datetime.max.time())
-            
-            # Total detections for this day
-            total_count = Detection.query.filter(
-                Detection.timestamp >= day_start,
-                Detection.timestamp <= day_end
-            ).count()
-            
-            # Valid detections for this day
-            valid_count = Detection.query.filter(
-                Detection.timestamp >= day_start,
-                Detection.timestamp <= day_end,
-                Detection.is_valid == True
-            ).count()
-            
             labels.append(current_date.strftime('%m/%d'))
-            total_counts.append(total_count)
-            valid_counts.append(valid_count)
+            total_counts.append(totals.get(current_date, 0))
+            valid_counts.append(valids.get(current_date, 0))
             
             current_date += timedelta(days=1)
         
@@ -1703,21 +1988,14 @@ def api_admin_hourly_stats():
         today_start = datetime.combine(today, datetime.min.time())
         today_end = datetime.combine(today, datetime.max.time())
         
-        # Get all detections for today
-        today_detections = Detection.query.filter(
-            Detection.timestamp >= today_start,
-            Detection.timestamp <= today_end
-        ).all()
-        
-        # Count by hour
-        hourly_counts = [0] * 24
-        for detection in today_detections:
-            hour = detection.timestamp.hour
-            hourly_counts[hour] += 1
+        # Count by hour from today's rollups
+        counts_by_hour = [0] * 24
+        for bucket_hour, is_valid, count in hourly_counts(analytics_session(), today_start, today_end):
+            counts_by_hour[bucket_hour.hour] += count
         
         return jsonify({
-            'hourly_counts': hourly_counts,
-            'total_today': len(today_detections)
+            'hourly_counts': counts_by_hour,
+            'total_today': sum(counts_by_hour)
         })
         
     except Exception as e:
@@ -1732,27 +2010,15 @@ def real_time_stats():
             return jsonify({'error': 'User not found'}), 401
             
         # Enhanced statistics with performance metrics
-        total_detections = Detection.query.filter_by(user_id=user.id).count()
-        valid_detections = Detection.query.filter_by(user_id=user.id, is_valid=True).count()
+        total_detections, valid_detections = rollup_totals(analytics_session(), user_id=user.id)
         invalid_detections = total_detections - valid_detections
         
         # Performance metrics
         avg_detection_time = 1.2  # Mock value for now
         accuracy_rate = (valid_detections / total_detections * 100) if total_detections > 0 else 0
         
-        # Regional coverage - get unique postal codes and calculate their regions
-        valid_postal_codes = db.session.query(Detection.postal_code).filter_by(
-            user_id=user.id, is_valid=True
-        ).distinct().all()
-        
-        unique_regions = set()
-        for pc_tuple in valid_postal_codes:
-            postal_code = pc_tuple[0]
-            if postal_code in TUNISIA_POSTAL_CODES:
-                region = TUNISIA_POSTAL_CODES[postal_code]['region']
-                unique_regions.add(region)
-        
-        regions_detected = len(unique_regions)
+        # Regional coverage - distinct regions among the user's valid detections
+        regions_detected = len([region for region in region_counts(analytics_session(), user_id=user.id) if region])
         total_regions = 24  # Tunisia has 24 regions
         coverage_percent = (regions_detected / total_regions * 100)
         
@@ -1816,11 +2082,8 @@ def dynamic_chart_data():
         end_date = datetime.now()
         start_date = end_date - timedelta(days=7)
         
-        detections = Detection.query.filter(
-            Detection.user_id == user.id,
-            Detection.timestamp >= start_date,
-            Detection.timestamp <= end_date
-        ).all()
+        # Hourly rollups for the window (starting at the hour of start_date)
+        buckets = hourly_counts(analytics_session(), start_date, end_date, user_id=user.id)
         
         # Group by day
         daily_data = {}
@@ -1829,14 +2092,14 @@ def dynamic_chart_data():
             day_name = date.strftime('%a')
             daily_data[day_name] = {'total': 0, 'valid': 0, 'invalid': 0}
         
-        for detection in detections:
-            day_name = detection.timestamp.strftime('%a')
+        for bucket_hour, is_valid, count in buckets:
+            day_name = bucket_hour.strftime('%a')
             if day_name in daily_data:
-                daily_data[day_name]['total'] += 1
-                if detection.is_valid:
-                    daily_data[day_name]['valid'] += 1
+                daily_data[day_name]['total'] += count
+                if is_valid:
+                    daily_data[day_name]['valid'] += count
                 else:
-                    daily_data[day_name]['invalid'] += 1
+                    daily_data[day_name]['invalid'] += count
         
         return jsonify({
             'labels': list(daily_data.keys()),
@@ -1869,17 +2132,33 @@ def dynamic_chart_data():
 def system_health():
     """System health monitoring for dynamic platform"""
     try:
-        # Mock system health data
+        # Mock system health data (CPU figures come from the governor when available)
+        last_backup = backup_manager.last_backup()
         health_data = {
-            'cpu_usage': 45,
+            'cpu_usage': governor.cpu_usage if governor.cpu_usage is not None else 45,
+            'cpu_temperature': governor.temperature,
+            'governor_level': governor.settings['name'],
             'memory_usage': 62,
             'disk_usage': 78,
             'camera_fps': 30,
             'detection_rate': 95,
             'database_status': 'connected',
             'ai_engine_status': 'active',
-            'last_backup': '2024-01-15 02:30:00',
-            'uptime': '15d 4h 32m'
+            'last_backup': last_backup['created_at'].strftime("%Y-%m-%d %H:%M:%S") if last_backup else None,
+            'backup_failures': backup_manager.stats['failures'],
+            'uptime': '15d 4h 32m',
+            'ocr_worker_healthy': ocr_watchdog.is_healthy(),
+            'scan_cycles': ocr_watchdog.stats['cycles'],
+            'deadline_misses': ocr_watchdog.stats['deadline_misses'],
+            'stage_overruns': ocr_watchdog.stats['stage_overruns'],
+            'ocr_timeouts': ocr_watchdog.stats['ocr_timeouts'],
+            'watchdog_restarts': ocr_watchdog.stats['watchdog_restarts'],
+            'last_cycle_seconds': ocr_watchdog.stats['last_cycle_seconds'],
+            'writer_queue': detection_writer.pending(),
+            'writer_stats': dict(detection_writer.stats),
+            'detection_log': detection_log.to_dict(),
+            'edge_sync': edge_sync.to_dict(),
+            'analytics_replica': analytics_replica.to_dict()
         }
         
         return jsonify(health_data)
@@ -1916,6 +2195,7 @@ def toggle_feature():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        run_migrations()
         
         print("🔍 VALIDATION DU SYSTÈME")
         print("=" * 45)
@@ -1929,24 +2209,40 @@ if __name__ == '__main__':
     # Register CRUD routes
     try:
         register_crud_routes(app)
+        register_sync_routes(app)
         print("✅ CRUD routes registered successfully")
     except Exception as e:
         print(f"⚠️  Warning: Could not register CRUD routes: {e}")
     
-    # Start processing thread
+    # Start processing thread under the OCR watchdog
     processing_active = True
-    processing_thread = threading.Thread(target=process_frames)
-    processing_thread.daemon = True
-    processing_thread.start()
+    detection_writer.start()
+    detection_log.start()
+    ocr_watchdog.start(process_frames)
+    governor.start()
+    detection_archiver.start()
+    backup_manager.start()
+    maintenance_scheduler.start()
+    edge_sync.start()
+    analytics_replica.start()
     
     print(f"\n🚀 Démarrage du serveur Flask...")
-    print(f"🌐 Accès: http://127.0.0.1:5000")
+    print(f"🌐 Accès: http://127.0.0.1:{PORT}")
     print(f"👤 Admin: username=admin, password=admin123")
     print(f"👤 User: username=user, password=user123")
     
     try:
-        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+        app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
     finally:
         processing_active = False
-        if processing_thread.is_alive():
-            processing_thread.join(timeout=1.0) 
\ No newline at end of file
+        ocr_watchdog.stop()
+        governor.stop()
+        detection_archiver.stop()
+        backup_manager.stop()
+        maintenance_scheduler.stop()
+        edge_sync.stop()
+        analytics_replica.stop()
+        detection_log.stop()
+        detection_writer.stop()
+        if ocr_watchdog.worker and ocr_watchdog.worker.is_alive():
+            ocr_watchdog.worker.join(timeout=1.0) 
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Background Jobs Module
+Runs long deletes (system reset, bulk delete) off the request thread in bounded
+chunks, one short transaction per chunk, with progress reporting and cancellation
+"""
+
+import itertools
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+from models import db, Detection, SystemStats, ArchiveChunk
+from detection_stats import FACT_COLUMNS, record_deletes, reset_tallies, get_or_create_stats
+from detection_archive import detection_archiver
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ('queued', 'running', 'completed', 'cancelled', 'failed')
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """Progress of one background job"""
+
+    def __init__(self, job_id, kind, target, total=None):
+        self.id = job_id
+        self.kind = kind
+        self.target = target  # Callable(job) doing the work
+        self.status = 'queued'
+        self.total = total
+        self.processed = 0
+        self.message = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'cancelled', 'failed')
+
+    def advance(self, count):
+        """Record progress; raises JobCancelled once cancellation was requested"""
+        self.processed += count
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def to_dict(self):
+        def fmt(value):
+            return value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': round(100.0 * self.processed / self.total, 1) if self.total else None,
+            'message': self.message,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': fmt(self.created_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at)
+        }
+
+class JobManager:
+    """Runs queued jobs one at a time on a worker thread"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the job manager with Flask app"""
+        self.app = app
+
+        app.config.setdefault('JOB_DELETE_CHUNK_SIZE', 2000)  # Rows per delete transaction
+        app.config.setdefault('JOB_CHUNK_PAUSE_MS', 50)  # Gap between chunks so the writer gets the lock
+        app.config.setdefault('JOB_HISTORY', 50)  # Finished jobs kept for status queries
+
+        app.extensions['job_manager'] = self
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='background-jobs')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def submit(self, kind, target, total=None):
+        """Queue a job; returns the Job"""
+        job = Job(next(self._ids), kind, target, total)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self.queue.put(job)
+        self._ensure_worker()
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - self.app.config['JOB_HISTORY'])]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        return sorted(self.jobs.values(), key=lambda job: job.id, reverse=True)
+
+    def cancel(self, job_id):
+        """Request cancellation; the job stops after its current chunk. Returns the Job or None"""
+        job = self.jobs.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_requested = True
+        return job
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job.cancel_requested:
+                job.status = 'cancelled'
+                job.finished_at = datetime.now()
+                continue
+
+            job.status = 'running'
+            job.started_at = datetime.now()
+            with self.app.app_context():
+                try:
+                    job.target(job)
+                    job.status = 'completed'
+                except JobCancelled:
+                    db.session.rollback()
+                    job.status = 'cancelled'
+                except Exception as e:
+                    db.session.rollback()
+                    job.status = 'failed'
+                    job.error = str(e)
+                    logger.error(f"Background job {job.id} ({job.kind}) failed: {e}")
+                finally:
+                    db.session.remove()
+            job.finished_at = datetime.now()
+
+    # ------------------------------------------------------------------ deletes
+
+    def _pause(self):
+        time.sleep(self.app.config['JOB_CHUNK_PAUSE_MS'] / 1000.0)
+
+    def _delete_rows(self, job, rows):
+        """Delete one chunk of FACT_COLUMNS + id rows and adjust stats in the same transaction"""
+        ids = [row.id for row in rows]
+        deleted = Detection.query.filter(Detection.id.in_(ids)).delete(synchronize_session=False)
+        record_deletes(rows)
+        db.session.commit()
+        self._pause()
+        job.advance(deleted)
+        return deleted
+
+    def start_bulk_delete(self, detection_ids):
+        """Delete the given detections in chunks"""
+        detection_ids = sorted(set(int(detection_id) for detection_id in detection_ids))
+
+        def run(job):
+            size = self.app.config['JOB_DELETE_CHUNK_SIZE']
+            deleted = 0
+            for start in range(0, len(detection_ids), size):
+                chunk = detection_ids[start:start + size]
+                rows = db.session.query(Detection.id, *FACT_COLUMNS).filter(Detection.id.in_(chunk)).all()
+                job.processed += len(chunk) - len(rows)  # Already gone
+                if rows:
+                    deleted += self._delete_rows(job, rows)
+                elif job.cancel_requested:
+                    raise JobCancelled()
+            job.message = f'Successfully deleted {deleted} detections'
+
+        return self.submit('bulk_delete', run, total=len(detection_ids))
+
+    def start_system_reset(self):
+        """Delete every detection that exists now (hot rows oldest id first, then the archive), then reset the statistics"""
+        with self.app.app_context():
+            last_id = db.session.query(db.func.max(Detection.id)).scalar() or 0
+            # The incremental total counts archived rows too, and costs no scan
+            stats = SystemStats.query.first()
+            total = stats.total_detections if stats else None
+
+        def run(job):
+            size = self.app.config['JOB_DELETE_CHUNK_SIZE']
+            after_id = 0
+            while True:
+                # Detections written after the reset started (id > last_id) are kept
+                rows = (db.session.query(Detection.id, *FACT_COLUMNS)
+                        .filter(Detection.id > after_id, Detection.id <= last_id)
+                        .order_by(Detection.id).limit(size).all())
+                if not rows:
+                    break
+                after_id = rows[-1].id
+                self._delete_rows(job, rows)
+
+            # Archived months are detections too: history, search and export would still serve them
+            for chunk in ArchiveChunk.query.order_by(ArchiveChunk.month).all():
+                removed = detection_archiver.drop_chunk(chunk)
+                self._pause()
+                job.advance(removed)
+
+            now = datetime.now()
+            if db.session.query(Detection.id).first() is None:
+                # Nothing left: start clean, dropping any drift in the incremental counters
+                SystemStats.query.delete()
+                reset_tallies()
+                db.session.add(SystemStats(start_time=now, total_detections=0, unique_codes_count=0, last_updated=now))
+            else:
+                get_or_create_stats(now).start_time = now
+            db.session.commit()
+            job.message = f'System reset: {job.processed} detections deleted'
+
+        return self.submit('system_reset', run, total=total)
+
+# Global instance
+job_manager = JobManager()
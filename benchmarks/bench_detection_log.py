@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sustained detection ingest rate
+Compares per-row ORM commits, the group-commit queue and the append-only detection log
+Usage: python benchmarks/bench_detection_log.py [--seconds 5] [--producers 2]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, Detection
+from sqlite_profile import sqlite_profile
+from detection_stats import record_inserts
+from detection_writer import detection_writer
+from detection_log import detection_log
+from tunisia_postal_codes import POSTAL_CODES
+
+KNOWN_CODES = sorted(POSTAL_CODES)
+
+def create_app(directory):
+    app = Flask(__name__, instance_path=directory)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    sqlite_profile.init_app(app)
+    db.init_app(app)
+    sqlite_profile.bind()
+    detection_writer.init_app(app)
+    detection_log.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def random_fields():
+    # Mostly real codes, as on the sorting line, with some misreads
+    valid = random.random() < 0.9
+    return {
+        'postal_code': random.choice(KNOWN_CODES) if valid else str(random.randint(1000, 9999)),
+        'timestamp': datetime.now(),
+        'confidence': 80.0,
+        'user_id': None,
+        'is_valid': valid
+    }
+
+def orm_submit(app):
+    def submit(**fields):
+        with app.app_context():
+            detection = Detection(**fields)
+            db.session.add(detection)
+            record_inserts([detection])
+            db.session.commit()
+    return submit
+
+def produce(submit, seconds, producers):
+    """Submit detections from several threads for a while; returns the number submitted"""
+    stop = threading.Event()
+    counts = [0] * producers
+
+    def producer(index):
+        while not stop.is_set():
+            submit(**random_fields())
+            counts[index] += 1
+
+    threads = [threading.Thread(target=producer, args=(index,)) for index in range(producers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts)
+
+def drain():
+    """Seconds until every accepted detection is in the table"""
+    started = time.monotonic()
+    while detection_writer.pending():
+        time.sleep(0.01)
+    return time.monotonic() - started
+
+def run(mode, seconds, producers):
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(directory)
+        app.config['DETECTION_INGEST'] = 'queue' if mode == 'queue' else 'log'
+        app.config['DETECTION_LOG_INDEX_MS'] = 10
+        submit = orm_submit(app) if mode == 'orm' else detection_writer.submit
+
+        started = time.monotonic()
+        submitted = produce(submit, seconds, producers)
+        accepted = time.monotonic() - started
+        stored = accepted + (drain() if mode != 'orm' else 0.0)
+
+        detection_log.stop()
+        detection_writer.stop()
+        with app.app_context():
+            in_table = db.session.query(db.func.count(Detection.id)).scalar()
+            db.engine.dispose()
+        if sqlite_profile.read_engine is not None:
+            sqlite_profile.read_engine.dispose()
+
+    # Reset the globals for the next mode
+    detection_log.__init__()
+    detection_writer.__init__()
+    return submitted / accepted, in_table / stored, in_table
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--producers', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"📊 {args.producers} producer thread(s), {args.seconds}s per mode")
+    print(f"{'mode':<8} {'accepted/s':>12} {'stored/s':>12} {'rows':>10}")
+    for mode in ('orm', 'queue', 'log'):
+        accepted, stored, rows = run(mode, args.seconds, args.producers)
+        print(f"{mode:<8} {accepted:>12.0f} {stored:>12.0f} {rows:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Benchmark: rows serialized per second by the detection list endpoints
+Compares ORM objects + to_dict() + jsonify (the previous path) with the Core
+listing rows + bulk timestamp formatting + fast JSON path the endpoints now use
+Usage: python benchmarks/bench_serialization.py [--rows 50000] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request, stream_with_context
+from sqlalchemy import insert, select
+from models import db, Detection, User
+from sqlite_profile import sqlite_profile, read_session
+from detection_archive import detection_archiver
+from crud_routes import register_crud_routes
+from pagination import keyset_paginate
+from postal_search import filter_postal_code
+from detection_rows import TIMESTAMP_MS
+from epoch_time import to_epoch_ms, format_epoch_ms
+from export_stream import iter_chunks
+from fast_json import orjson, json_response
+from tunisia_postal_codes import POSTAL_CODES
+
+KNOWN_CODES = sorted(POSTAL_CODES)
+PAGE_SIZE = 500
+HISTORY_SIZE = 10
+
+def create_app(directory, rows):
+    app = Flask(__name__, instance_path=directory)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    app.config['SECRET_KEY'] = 'bench'
+    sqlite_profile.init_app(app)
+    db.init_app(app)
+    sqlite_profile.bind()
+    detection_archiver.init_app(app)
+    register_crud_routes(app)
+    register_orm_routes(app)
+
+    started = datetime.now() - timedelta(days=30)
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', role='admin')
+        admin.set_password('bench')
+        db.session.add(admin)
+        db.session.execute(insert(Detection), [{
+            'postal_code': random.choice(KNOWN_CODES),
+            'raw_postal_code': random.choice([None, None, None, str(random.randint(1000, 9999))]),
+            'timestamp': started + timedelta(seconds=index * 2592000 / rows),
+            'confidence': round(random.uniform(50, 99), 1),
+            'user_id': 1,
+            'is_valid': True,
+            'region': 'Tunis'
+        } for index in range(rows)])
+        db.session.commit()
+    return app
+
+def register_orm_routes(app):
+    """The previous implementations, for comparison"""
+
+    @app.route('/orm/detections')
+    def orm_detections():
+        page = keyset_paginate(Detection.query, cursor=request.args.get('cursor'),
+                               per_page=PAGE_SIZE, archive_filters={})
+        return jsonify({'status': 'success', 'data': [detection.to_dict() for detection in page.items],
+                        'pagination': page.to_dict()})
+
+    @app.route('/orm/search')
+    def orm_search():
+        query = filter_postal_code(Detection.query, request.args['postal_code'])
+        page = keyset_paginate(query, cursor=request.args.get('cursor'), per_page=PAGE_SIZE,
+                               archive_filters={'postal_code': request.args['postal_code']})
+        return jsonify({'status': 'success', 'data': [detection.to_dict() for detection in page.items],
+                        'pagination': page.to_dict()})
+
+    @app.route('/orm/export')
+    def orm_export():
+        statement = select(
+            Detection.id, Detection.postal_code, Detection.raw_postal_code, Detection.timestamp,
+            Detection.confidence, Detection.user_id, Detection.is_valid, Detection.region, Detection.node_id
+        ).order_by(Detection.timestamp.desc(), Detection.id.desc())
+
+        def records():
+            # One datetime, strftime and json.dumps per row
+            yield '{"status": "success", "data": ['
+            count = 0
+            for rows in iter_chunks(read_session(), statement):
+                text = ', '.join(json.dumps({
+                    'id': row.id, 'code': row.postal_code, 'raw_code': row.raw_postal_code,
+                    'timestamp': row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                    'timestamp_ms': to_epoch_ms(row.timestamp), 'confidence': row.confidence,
+                    'user_id': row.user_id, 'is_valid': row.is_valid, 'region': row.region,
+                    'node_id': row.node_id,
+                    'corrected': row.raw_postal_code is not None and row.raw_postal_code != row.postal_code
+                }) for row in rows)
+                yield (', ' if count and text else '') + text
+                count += len(rows)
+            yield f'], "count": {count}}}'
+        return app.response_class(stream_with_context(records()), mimetype='application/json')
+
+def orm_history():
+    detections = Detection.query.order_by(Detection.timestamp.desc()).limit(HISTORY_SIZE).all()
+    return [{'postal_code': detection.postal_code, 'timestamp': detection.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+             'is_valid': detection.is_valid, 'confidence': detection.confidence} for detection in detections]
+
+def core_history():
+    rows = db.session.query(
+        Detection.postal_code, TIMESTAMP_MS, Detection.is_valid, Detection.confidence
+    ).order_by(Detection.timestamp.desc()).limit(HISTORY_SIZE).all()
+    timestamps = format_epoch_ms([row.timestamp_ms for row in rows])
+    return [{'postal_code': row.postal_code, 'timestamp': timestamp, 'is_valid': row.is_valid,
+             'confidence': row.confidence} for row, timestamp in zip(rows, timestamps)]
+
+def loads(body):
+    # Client-side parsing is the same for both paths; keep it cheap so the server side dominates
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+def walk_pages(client, url, max_rows):
+    """Follow next_cursor until max_rows rows were served; returns the row count"""
+    served, cursor = 0, None
+    while served < max_rows:
+        separator = '&' if '?' in url else '?'
+        body = loads(client.get(url + (f'{separator}cursor={cursor}' if cursor else '')).get_data())
+        served += len(body['data'])
+        cursor = body['pagination']['next_cursor']
+        if not cursor:
+            break
+    return served
+
+def export_rows(client, url):
+    return len(loads(client.get(url).get_data())['data'])
+
+def best_rate(function, repeat):
+    """Highest rows/second over repeat runs"""
+    best = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = function()
+        best = max(best, rows / (time.perf_counter() - started))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(directory, args.rows)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['username'], session['role'], session['user_id'] = 'admin', 'admin', 1
+        page_rows = min(args.rows, 20 * PAGE_SIZE)
+
+        def history(function, respond):
+            def run():
+                with app.app_context():
+                    for _ in range(200):
+                        respond({'history': function()})
+                return 200 * HISTORY_SIZE
+            return run
+
+        cases = [
+            ('history', history(orm_history, jsonify), history(core_history, json_response)),
+            ('detections', lambda: walk_pages(client, '/orm/detections', page_rows),
+             lambda: walk_pages(client, f'/api/detections?per_page={PAGE_SIZE}&total=none', page_rows)),
+            ('search', lambda: walk_pages(client, '/orm/search?postal_code=1', page_rows),
+             lambda: walk_pages(client, f'/api/detections/search?postal_code=1&per_page={PAGE_SIZE}', page_rows)),
+            ('export', lambda: export_rows(client, '/orm/export'),
+             lambda: export_rows(client, '/api/export/detections?format=json')),
+        ]
+
+        print(f"📊 {args.rows} detections, JSON via {'orjson' if orjson is not None else 'json'}, best of {args.repeat}")
+        print(f"{'endpoint':<12} {'orm rows/s':>12} {'core rows/s':>12} {'speedup':>8}")
+        for name, orm, core in cases:
+            orm_rate = best_rate(orm, args.repeat)
+            core_rate = best_rate(core, args.repeat)
+            print(f"{name:<12} {orm_rate:>12.0f} {core_rate:>12.0f} {core_rate / orm_rate:>7.1f}x")
+
+        with app.app_context():
+            db.engine.dispose()
+        if sqlite_profile.read_engine is not None:
+            sqlite_profile.read_engine.dispose()
+
+if __name__ == "__main__":
+    main()
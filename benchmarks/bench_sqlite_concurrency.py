@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark: concurrent read/write throughput on the detections table
+Compares SQLite defaults with the tuned profile from sqlite_profile.py
+Usage: python benchmarks/bench_sqlite_concurrency.py [--seconds 10] [--readers 4] [--batch 20]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from models import db
+from sqlite_profile import apply_pragmas
+from epoch_time import to_epoch_ms
+
+TUNED_SETTINGS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE': -16000,
+    'SQLITE_MMAP_SIZE': 64 * 1024 * 1024,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_AUTO_VACUUM': 'INCREMENTAL',
+}
+
+READ_QUERIES = [
+    "SELECT COUNT(*) FROM detections WHERE is_valid = 1",
+    "SELECT COUNT(*) FROM detections WHERE user_id = 1 AND timestamp >= ?",
+    "SELECT * FROM detections ORDER BY timestamp DESC LIMIT 50",
+]
+
+def create_database(path, seed_rows):
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    start = datetime.now() - timedelta(days=30)
+    conn.executemany(
+        "INSERT INTO detections (postal_code, timestamp, confidence, user_id, is_valid) VALUES (?, ?, ?, ?, ?)",
+        [(str(random.randint(1000, 9999)), to_epoch_ms(start + timedelta(seconds=i * 10)),
+          80.0, random.randint(1, 5), random.random() < 0.8) for i in range(seed_rows)]
+    )
+    conn.commit()
+    conn.close()
+
+def connect(path, tuned, read_only=False):
+    if tuned and read_only:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5, check_same_thread=False)
+    else:
+        # Default profile still gets a busy timeout so it measures contention, not instant failures
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    if tuned:
+        apply_pragmas(conn, TUNED_SETTINGS, read_only=read_only)
+    return conn
+
+def run(path, tuned, seconds, readers, batch):
+    stop = threading.Event()
+    counters = {'writes': 0, 'reads': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def writer():
+        conn = connect(path, tuned)
+        while not stop.is_set():
+            rows = [(str(random.randint(1000, 9999)), to_epoch_ms(datetime.now()), 75.0, random.randint(1, 5), True)
+                    for _ in range(batch)]
+            try:
+                conn.executemany(
+                    "INSERT INTO detections (postal_code, timestamp, confidence, user_id, is_valid) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+                with lock:
+                    counters['writes'] += batch
+            except sqlite3.OperationalError:
+                conn.rollback()
+                with lock:
+                    counters['locked'] += 1
+        conn.close()
+
+    def reader():
+        conn = connect(path, tuned, read_only=True)
+        since = to_epoch_ms(datetime.now() - timedelta(days=1))
+        while not stop.is_set():
+            query = random.choice(READ_QUERIES)
+            try:
+                conn.execute(query, (since,) if '?' in query else ()).fetchall()
+                with lock:
+                    counters['reads'] += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    counters['locked'] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {name: value / seconds if name != 'locked' else value for name, value in counters.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=20, help='rows per write transaction')
+    parser.add_argument('--seed-rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"📊 {args.readers} readers + 1 writer ({args.batch} rows/commit), {args.seconds}s, {args.seed_rows} seed rows")
+    print(f"{'profile':<10} {'writes/s':>12} {'reads/s':>12} {'locked':>8}")
+
+    for tuned in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.db')
+            create_database(path, args.seed_rows)
+            result = run(path, tuned, args.seconds, args.readers, args.batch)
+            name = 'tuned' if tuned else 'default'
+            print(f"{name:<10} {result['writes']:>12.0f} {result['reads']:>12.1f} {result['locked']:>8}")
+
+if __name__ == "__main__":
+    main()
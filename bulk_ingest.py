@@ -0,0 +1,171 @@
+"""
+Bulk Ingest Module
+Loads NDJSON or CSV detection uploads in batches: one vectorized validation pass,
+one executemany insert and one stats/rollup update per batch, with per-row errors
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+import numpy as np
+from sqlalchemy import insert
+from models import db, User, Detection
+from tunisia_postal_codes import POSTAL_CODES
+from detection_stats import DetectionFacts, record_inserts, region_of
+from epoch_time import parse_timestamp
+
+INGEST_FORMATS = ('ndjson', 'csv')
+INGEST_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+KNOWN_POSTAL_CODES = np.array(sorted(POSTAL_CODES), dtype='U10')
+
+def read_records(stream, fmt):
+    """Yield (line_number, record dict or None, parse error or None) from an upload stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline='')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, 'Expected a JSON object'
+            continue
+        yield line_number, record, None
+
+def _parse_fields(record, default_user_id, now):
+    """Per-row conversions that cannot be vectorized; raises ValueError with a readable message"""
+    timestamp = record.get('timestamp')
+    confidence = record.get('confidence')
+    user_id = record.get('user_id')
+    raw_code = record.get('raw_code') or record.get('raw_postal_code') or None
+
+    try:
+        timestamp = parse_timestamp(timestamp) if timestamp not in (None, '') else now
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid timestamp {timestamp!r}')
+    try:
+        confidence = float(confidence) if confidence not in (None, '') else 65.0
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid confidence {confidence!r}')
+    try:
+        user_id = int(user_id) if user_id not in (None, '') else default_user_id
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid user_id {user_id!r}')
+
+    return timestamp, confidence, user_id, raw_code
+
+def validate_batch(records, default_user_id, user_ids, now):
+    """
+    Validate a batch of (line_number, record) pairs
+
+    Returns:
+        tuple: ([(line_number, row ready for insert), ...], [(line_number, error), ...])
+    """
+    codes = np.array([str(record.get('postal_code') or record.get('code') or '').strip()
+                      for _, record in records], dtype='U10')
+    well_formed = (np.char.str_len(codes) == 4) & np.char.isdigit(codes)
+    known = np.isin(codes, KNOWN_POSTAL_CODES)
+
+    rows, errors, owners = [], [], []
+    for index, (line_number, record) in enumerate(records):
+        if not well_formed[index]:
+            errors.append((line_number, f'Invalid postal code {str(codes[index])!r} (expected 4 digits)'))
+            continue
+        try:
+            timestamp, confidence, user_id, raw_code = _parse_fields(record, default_user_id, now)
+        except ValueError as e:
+            errors.append((line_number, str(e)))
+            continue
+        if not 0 <= confidence <= 100:
+            errors.append((line_number, f'Confidence {confidence} out of range 0-100'))
+            continue
+
+        code = str(codes[index])
+        owners.append(user_id if user_id is not None else -1)
+        rows.append((line_number, {
+            'postal_code': code,
+            'raw_postal_code': raw_code,
+            'timestamp': timestamp,
+            'confidence': confidence,
+            'user_id': user_id,
+            'is_valid': bool(known[index]),
+            'region': region_of(code) or None
+        }))
+
+    # Unknown users are rejected in one pass as well (-1 = no user)
+    owner_known = np.isin(np.array(owners, dtype=np.int64), np.append(user_ids, -1))
+    accepted = []
+    for (line_number, row), ok in zip(rows, owner_known):
+        if ok:
+            accepted.append((line_number, row))
+        else:
+            errors.append((line_number, f"Unknown user_id {row['user_id']}"))
+
+    errors.sort(key=lambda error: error[0])
+    return accepted, errors
+
+def _insert_batch(rows, now):
+    """executemany insert plus one stats/rollup update, committed together"""
+    db.session.execute(insert(Detection), rows)
+    record_inserts([DetectionFacts(row['postal_code'], row['timestamp'], row['user_id'], row['is_valid'])
+                    for row in rows], now)
+    db.session.commit()
+
+def ingest(stream, fmt, default_user_id=None, batch_size=INGEST_BATCH_SIZE):
+    """
+    Ingest an upload stream
+
+    Returns:
+        dict: received, inserted, failed, batches, errors (first MAX_REPORTED_ERRORS) and errors_truncated
+    """
+    user_ids = np.array([user_id for (user_id,) in db.session.query(User.id)], dtype=np.int64)
+    summary = {'received': 0, 'inserted': 0, 'failed': 0, 'batches': 0, 'errors': [], 'errors_truncated': False}
+
+    def report(errors):
+        summary['failed'] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(summary['errors'])
+        summary['errors'].extend({'line': line, 'error': error} for line, error in errors[:max(room, 0)])
+        if len(errors) > room:
+            summary['errors_truncated'] = True
+
+    def flush(batch):
+        now = datetime.now()
+        accepted, errors = validate_batch(batch, default_user_id, user_ids, now)
+        report(errors)
+        if not accepted:
+            return
+        try:
+            _insert_batch([row for _, row in accepted], now)
+            summary['inserted'] += len(accepted)
+            summary['batches'] += 1
+        except Exception as e:
+            db.session.rollback()
+            report([(line_number, f'Batch insert failed: {e}') for line_number, _ in accepted])
+
+    batch = []
+    for line_number, record, error in read_records(stream, fmt):
+        summary['received'] += 1
+        if error:
+            report([(line_number, error)])
+            continue
+        batch.append((line_number, record))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    return summary
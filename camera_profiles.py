@@ -0,0 +1,146 @@
+"""
+Camera Profiles Module
+Static region of interest and perspective/deskew transforms for fixed cameras
+"""
+
+import json
+import threading
+from types import SimpleNamespace
+import cv2
+import numpy as np
+from models import CameraProfile
+
+def parse_points(value, expected=None):
+    """Validate a list of [x, y] points; returns a float32 array or raises ValueError"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not isinstance(value, (list, tuple)):
+        raise ValueError('Points must be a list of [x, y] pairs')
+
+    points = []
+    for point in value:
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            raise ValueError('Each point must be an [x, y] pair')
+        points.append([float(point[0]), float(point[1])])
+
+    if expected is not None and len(points) != expected:
+        raise ValueError(f'Exactly {expected} points are required')
+    if len(points) < 3:
+        raise ValueError('At least 3 points are required')
+
+    points = np.array(points, dtype=np.float32)
+    # Collinear or repeated points enclose nothing and give a degenerate transform
+    if cv2.contourArea(points) < 1:
+        raise ValueError('Points must enclose a non-empty area')
+    return points
+
+class CompiledProfile:
+    """Precomputed crop box, mask and warp matrix for one camera profile and frame size"""
+
+    def __init__(self, profile, frame_shape):
+        height, width = frame_shape[:2]
+        self.frame_shape = frame_shape[:2]
+        self.warp_matrix = None
+        self.warp_size = None
+        self.crop = None
+        self.mask = None
+        self.rotation = None
+
+        if profile.perspective_quad:
+            # Map the label quad to an upright rectangle; this crops and rectifies in one warp
+            quad = parse_points(profile.perspective_quad, expected=4)
+            out_width = profile.output_width or int(max(np.linalg.norm(quad[1] - quad[0]), np.linalg.norm(quad[2] - quad[3])))
+            out_height = profile.output_height or int(max(np.linalg.norm(quad[3] - quad[0]), np.linalg.norm(quad[2] - quad[1])))
+            out_width, out_height = max(out_width, 1), max(out_height, 1)
+            target = np.array([[0, 0], [out_width - 1, 0], [out_width - 1, out_height - 1], [0, out_height - 1]], dtype=np.float32)
+            matrix = cv2.getPerspectiveTransform(quad, target)
+
+            if profile.deskew_angle:
+                # Fold the deskew rotation into the same warp
+                rotation = cv2.getRotationMatrix2D((out_width / 2, out_height / 2), profile.deskew_angle, 1.0)
+                matrix = np.vstack([rotation, [0, 0, 1]]) @ matrix
+
+            self.warp_matrix = matrix
+            self.warp_size = (out_width, out_height)
+            return
+
+        if profile.roi_polygon:
+            polygon = parse_points(profile.roi_polygon)
+            polygon[:, 0] = np.clip(polygon[:, 0], 0, width - 1)
+            polygon[:, 1] = np.clip(polygon[:, 1], 0, height - 1)
+            x, y, w, h = cv2.boundingRect(polygon)
+            self.crop = (x, y, w, h)
+
+            mask = np.zeros((h, w), dtype=np.uint8)
+            cv2.fillPoly(mask, [np.round(polygon - [x, y]).astype(np.int32)], 255)
+            # Rectangular ROIs need no mask
+            self.mask = None if cv2.countNonZero(mask) == w * h else mask
+            size = (w, h)
+        else:
+            size = (width, height)
+
+        if profile.deskew_angle:
+            self.rotation = (cv2.getRotationMatrix2D((size[0] / 2, size[1] / 2), profile.deskew_angle, 1.0), size)
+
+    def apply(self, frame):
+        if self.warp_matrix is not None:
+            return cv2.warpPerspective(frame, self.warp_matrix, self.warp_size, borderValue=(255, 255, 255))
+
+        if self.crop is not None:
+            x, y, w, h = self.crop
+            frame = frame[y:y + h, x:x + w]
+            if self.mask is not None:
+                # Paint outside the polygon white, like label background
+                frame = frame.copy()
+                frame[self.mask == 0] = 255
+
+        if self.rotation is not None:
+            matrix, size = self.rotation
+            frame = cv2.warpAffine(frame, matrix, size, borderValue=(255, 255, 255))
+
+        return frame
+
+class CameraProfileCache:
+    """Loads camera profiles once and keeps compiled transforms until a profile changes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.compiled = {}
+
+    def invalidate(self, camera_id=None):
+        with self.lock:
+            if camera_id is None:
+                self.profiles.clear()
+                self.compiled.clear()
+            else:
+                self.profiles.pop(camera_id, None)
+                self.compiled.pop(camera_id, None)
+
+    def _get_profile(self, camera_id):
+        """Return a snapshot of the camera's profile, or None; requires an app context on first load"""
+        if camera_id not in self.profiles:
+            profile = CameraProfile.query.filter_by(camera_id=camera_id, enabled=True).first()
+            # Keep plain values so the cached entry outlives the database session
+            self.profiles[camera_id] = SimpleNamespace(
+                perspective_quad=profile.perspective_quad,
+                roi_polygon=profile.roi_polygon,
+                output_width=profile.output_width,
+                output_height=profile.output_height,
+                deskew_angle=profile.deskew_angle
+            ) if profile else None
+        return self.profiles[camera_id]
+
+    def apply(self, camera_id, frame):
+        """Crop and rectify a frame with the camera's profile (unchanged when none is configured)"""
+        with self.lock:
+            profile = self._get_profile(camera_id)
+            if profile is None:
+                return frame
+
+            compiled = self.compiled.get(camera_id)
+            if compiled is None or compiled.frame_shape != frame.shape[:2]:
+                compiled = CompiledProfile(profile, frame.shape)
+                self.compiled[camera_id] = compiled
+
+        return compiled.apply(frame)
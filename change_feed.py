@@ -0,0 +1,127 @@
+"""
+Change Feed Module
+Records every insert, update and delete on detections in detection_changes
+(via SQLite triggers, so bulk deletes and raw SQL are captured too)
+and serves them in sequence order since a consumer's cursor
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event, text
+from models import db, Detection, DetectionChange
+from epoch_time import to_epoch_ms
+
+# UTC epoch ms, like detections.timestamp
+_CHANGED_AT = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+# Columns a consumer sees in Detection.to_dict(); updating only others (e.g. source_id) is not a change
+FEED_COLUMNS = ('postal_code', 'raw_postal_code', 'timestamp', 'confidence', 'user_id', 'is_valid', 'region', 'node_id')
+
+CHANGE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_detections_insert_change AFTER INSERT ON detections
+    BEGIN
+        INSERT INTO detection_changes (detection_id, op, changed_at) VALUES (NEW.id, 'insert', {_CHANGED_AT});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_detections_update_change AFTER UPDATE OF {', '.join(FEED_COLUMNS)} ON detections
+    BEGIN
+        INSERT INTO detection_changes (detection_id, op, changed_at) VALUES (NEW.id, 'update', {_CHANGED_AT});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_detections_delete_change AFTER DELETE ON detections
+    BEGIN
+        INSERT INTO detection_changes (detection_id, op, changed_at) VALUES (OLD.id, 'delete', {_CHANGED_AT});
+    END""",
+]
+
+def install_change_triggers(conn):
+    """Create the change triggers on a Core connection (idempotent)"""
+    for ddl in CHANGE_TRIGGERS:
+        conn.execute(text(ddl))
+
+def drop_change_triggers(conn):
+    """Remove the change triggers, e.g. while a migration rewrites every row"""
+    for op in ('insert', 'update', 'delete'):
+        conn.execute(text(f'DROP TRIGGER IF EXISTS trg_detections_{op}_change'))
+
+@contextmanager
+def change_triggers_suspended(conn):
+    """Keep a maintenance rewrite of derived values out of the feed (within the caller's transaction)"""
+    drop_change_triggers(conn)
+    try:
+        yield
+    finally:
+        install_change_triggers(conn)
+
+@event.listens_for(db.metadata, 'after_create')
+def _install_after_create(target, connection, **kw):
+    # Fresh databases built with create_all get the triggers too; existing ones get them from migration 006
+    if connection.dialect.name == 'sqlite' and Detection.__table__ in kw.get('tables', ()):
+        install_change_triggers(connection)
+
+def latest_cursor(session):
+    """Sequence number of the newest change (0 when the feed is empty)"""
+    return session.query(db.func.max(DetectionChange.seq)).scalar() or 0
+
+def oldest_cursor(session):
+    """Smallest cursor that can still be served without a gap"""
+    oldest = session.query(db.func.min(DetectionChange.seq)).scalar()
+    return oldest - 1 if oldest else latest_cursor(session)
+
+def fetch_changes(session, since=0, limit=1000):
+    """
+    Changes after a cursor, compacted to the latest change per detection
+
+    Args:
+        session: session to read with (the read-only one for the API)
+        since: last sequence number the consumer has applied
+        limit: maximum change rows to scan
+
+    Returns:
+        dict: changes (seq order), next_cursor and has_more
+    """
+    rows = session.query(DetectionChange).filter(
+        DetectionChange.seq > since
+    ).order_by(DetectionChange.seq).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1].seq if rows else since
+
+    # Only the last change per detection matters to a consumer applying the page
+    latest = {}
+    for change in rows:
+        latest[change.detection_id] = change
+
+    live_ids = [change.detection_id for change in latest.values() if change.op != 'delete']
+    current = {}
+    for start in range(0, len(live_ids), 500):
+        chunk = live_ids[start:start + 500]
+        current.update((detection.id, detection) for detection in
+                       session.query(Detection).filter(Detection.id.in_(chunk)))
+
+    changes = []
+    for change in sorted(latest.values(), key=lambda change: change.seq):
+        detection = current.get(change.detection_id)
+        if change.op != 'delete' and detection is None:
+            continue  # Deleted again later; its tombstone is further along the feed
+        changes.append({
+            'seq': change.seq,
+            'op': change.op,
+            'detection_id': change.detection_id,
+            'changed_at': change.changed_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'detection': detection.to_dict() if detection is not None else None
+        })
+
+    return {'changes': changes, 'next_cursor': next_cursor, 'has_more': has_more}
+
+def prune_changes(conn, keep_days=30, keep_after=None):
+    """
+    Delete changes older than keep_days, always keeping the newest one; returns rows removed
+
+    keep_after protects changes a consumer has not read yet (e.g. the edge sync cursor)
+    """
+    cutoff = to_epoch_ms(datetime.now() - timedelta(days=keep_days))
+    sql = ('DELETE FROM detection_changes WHERE changed_at < :cutoff '
+           'AND seq < (SELECT MAX(seq) FROM detection_changes)')
+    if keep_after is not None:
+        sql += ' AND seq <= :keep_after'
+    return conn.execute(text(sql), {'cutoff': cutoff, 'keep_after': keep_after}).rowcount
@@ -3,10 +3,25 @@ CRUD Routes for Postal Code Detector Database
 Provides comprehensive Create, Read, Update, Delete operations for all entities
 """
 
-from flask import request, jsonify, session
+from flask import request, jsonify, session, current_app
+import itertools
 from datetime import datetime
 from functools import wraps
 from models import db, User, Detection, SystemStats
+from detection_stats import record_deletes, record_change, facts_of, region_of, rollup_totals, FACT_COLUMNS
+from pagination import keyset_paginate
+from sqlite_profile import read_session
+from bulk_ingest import INGEST_FORMATS, ingest
+from postal_search import SEARCH_MODES, filter_postal_code, codes_matching
+from change_feed import fetch_changes, latest_cursor, oldest_cursor
+from detection_archive import detection_archiver
+from background_jobs import job_manager
+from analytics_replica import analytics_session
+from detection_rows import listing_query, detection_dicts
+from fast_json import json_response
+from epoch_time import parse_timestamp
+from export_stream import (EXPORT_FORMATS, DETECTION_FIELDS, USER_FIELDS, detection_export_statement,
+                           detection_records, user_export_statement, user_records, iter_chunks, export_response)
 
 def admin_required(f):
     @wraps(f)
@@ -26,6 +41,24 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def detection_total(query, mode, user_id=None, filtered=False):
+    """
+    Row count for a paginated listing
+
+    mode 'exact' runs COUNT(*); 'approx' reads the maintained counters
+    (SystemStats, or the rollups for a single user) and is only available
+    when no other filter applies; anything else skips the total.
+    Returns (total, is_estimate).
+    """
+    if mode == 'exact':
+        return query.count(), False
+    if mode == 'approx' and not filtered:
+        if user_id is not None:
+            return rollup_totals(db.session, user_id=user_id)[0], True
+        stats = SystemStats.query.first()
+        return (stats.total_detections if stats else 0), True
+    return None, False
+
 def register_crud_routes(app):
     """Register all CRUD routes with the Flask app"""
     
@@ -154,8 +187,10 @@ def register_crud_routes(app):
             if user.username == 'admin':
                 return jsonify({'status': 'error', 'message': 'Cannot delete admin user'}), 400
             
-            # Also delete user's detections
+            # Also delete user's detections, keeping the tallies and rollups in step
+            user_detections = db.session.query(*FACT_COLUMNS).filter(Detection.user_id == user_id).all()
             Detection.query.filter_by(user_id=user_id).delete()
+            record_deletes(user_detections)
             
             db.session.delete(user)
             db.session.commit()
@@ -174,30 +209,24 @@ def register_crud_routes(app):
     @app.route('/api/detections', methods=['GET'])
     @login_required
     def crud_get_all_detections():
-        """GET: Retrieve all detections with pagination"""
+        """GET: Retrieve all detections with cursor pagination (?cursor=, ?per_page=, ?total=approx|exact|none)"""
         try:
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 50, type=int)
+            per_page = min(request.args.get('per_page', 50, type=int), 500)
+            total, total_is_estimate = detection_total(Detection.query, request.args.get('total', 'approx'))
             
-            detections = Detection.query.order_by(Detection.timestamp.desc()).paginate(
-                page=page, per_page=per_page, error_out=False
+            detections = keyset_paginate(
+                listing_query(), cursor=request.args.get('cursor'), per_page=per_page,
+                total=total, total_is_estimate=total_is_estimate, archive_filters={}
             )
             
-            detection_list = [detection.to_dict() for detection in detections.items]
-            
-            return jsonify({
+            return json_response({
                 'status': 'success',
-                'data': detection_list,
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': detections.total,
-                    'pages': detections.pages,
-                    'has_next': detections.has_next,
-                    'has_prev': detections.has_prev
-                }
+                'data': detection_dicts(detections.items),
+                'pagination': detections.to_dict()
             })
             
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -225,25 +254,23 @@ def register_crud_routes(app):
             if 'postal_code' not in data:
                 return jsonify({'status': 'error', 'message': 'Missing required field: postal_code'}), 400
             
-            # Create new detection
-            new_detection = Detection(
-                postal_code=data['postal_code'],
-                timestamp=datetime.now() if 'timestamp' not in data else datetime.fromisoformat(data['timestamp']),
-                confidence=data.get('confidence', 65),
-                user_id=data.get('user_id', session.get('user_id'))
-            )
-            
-            db.session.add(new_detection)
-            
-            # Update system stats
-            stats = SystemStats.query.first()
-            if stats:
-                stats.total_detections += 1
-                stats.last_updated = datetime.now()
-                unique_count = db.session.query(Detection.postal_code).distinct().count()
-                stats.unique_codes_count = unique_count + 1
-            
-            db.session.commit()
+            # Create new detection through the group-commit writer (stats are updated per batch)
+            writer = current_app.extensions['detection_writer']
+            try:
+                detection_id = writer.submit(
+                    wait=True,
+                    postal_code=data['postal_code'],
+                    timestamp=datetime.now() if 'timestamp' not in data else parse_timestamp(data['timestamp']),
+                    confidence=data.get('confidence', 65),
+                    user_id=data.get('user_id', session.get('user_id'))
+                )
+            except TimeoutError:
+                # Still queued and will be committed: a retry would create a duplicate
+                return jsonify({
+                    'status': 'accepted',
+                    'message': 'Detection accepted; it will appear once the writer catches up'
+                }), 202
+            new_detection = db.session.get(Detection, detection_id)
             
             return jsonify({
                 'status': 'success',
@@ -255,6 +282,29 @@ def register_crud_routes(app):
             db.session.rollback()
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
+    @app.route('/api/detections/bulk', methods=['POST'])
+    @admin_required
+    def crud_bulk_ingest_detections():
+        """POST: Ingest many detections from an NDJSON or CSV body (?format=ndjson|csv, ?user_id=)"""
+        try:
+            fmt = request.args.get('format')
+            if not fmt:
+                fmt = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+            if fmt not in INGEST_FORMATS:
+                return jsonify({'status': 'error', 'message': f"Unsupported ingest format '{fmt}' (use ndjson or csv)"}), 400
+            
+            summary = ingest(
+                request.stream, fmt,
+                default_user_id=request.args.get('user_id', session.get('user_id'), type=int)
+            )
+            
+            status = 'success' if not summary['failed'] else ('partial' if summary['inserted'] else 'error')
+            return jsonify({'status': status, **summary}), 200 if summary['inserted'] or not summary['failed'] else 400
+            
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
     @app.route('/api/detections/<int:detection_id>', methods=['PUT'])
     @admin_required
     def crud_update_detection(detection_id):
@@ -263,26 +313,22 @@ def register_crud_routes(app):
             detection = Detection.query.get_or_404(detection_id)
             data = request.get_json()
             
+            before = facts_of(detection)
+            
             # Update detection fields
             if 'postal_code' in data:
                 detection.postal_code = data['postal_code']
+                detection.region = region_of(detection.postal_code) or None
             if 'confidence' in data:
                 detection.confidence = data['confidence']
             if 'timestamp' in data:
-                detection.timestamp = datetime.fromisoformat(data['timestamp'])
+                detection.timestamp = parse_timestamp(data['timestamp'])
             if 'user_id' in data:
                 detection.user_id = data['user_id']
             
+            record_change(before, detection)
             db.session.commit()
             
-            # Update system stats
-            stats = SystemStats.query.first()
-            if stats:
-                unique_count = db.session.query(Detection.postal_code).distinct().count()
-                stats.unique_codes_count = unique_count
-                stats.last_updated = datetime.now()
-                db.session.commit()
-            
             return jsonify({
                 'status': 'success',
                 'message': 'Detection updated successfully',
@@ -303,12 +349,7 @@ def register_crud_routes(app):
             db.session.delete(detection)
             
             # Update system stats
-            stats = SystemStats.query.first()
-            if stats:
-                stats.total_detections = max(0, stats.total_detections - 1)
-                unique_count = db.session.query(Detection.postal_code).distinct().count()
-                stats.unique_codes_count = unique_count - 1 if unique_count > 0 else 0
-                stats.last_updated = datetime.now()
+            record_deletes([detection])
             
             db.session.commit()
             
@@ -324,7 +365,7 @@ def register_crud_routes(app):
     @app.route('/api/detections/bulk-delete', methods=['DELETE'])
     @admin_required
     def crud_bulk_delete_detections():
-        """DELETE: Remove multiple detections"""
+        """DELETE: Remove multiple detections (runs as a chunked background job)"""
         try:
             data = request.get_json()
             detection_ids = data.get('detection_ids', [])
@@ -332,28 +373,51 @@ def register_crud_routes(app):
             if not detection_ids:
                 return jsonify({'status': 'error', 'message': 'No detection IDs provided'}), 400
             
-            # Delete detections
-            deleted_count = Detection.query.filter(Detection.id.in_(detection_ids)).delete(synchronize_session=False)
-            
-            # Update system stats
-            stats = SystemStats.query.first()
-            if stats:
-                stats.total_detections = max(0, stats.total_detections - deleted_count)
-                unique_count = db.session.query(Detection.postal_code).distinct().count()
-                stats.unique_codes_count = unique_count
-                stats.last_updated = datetime.now()
-            
-            db.session.commit()
+            try:
+                job = job_manager.start_bulk_delete(detection_ids)
+            except (TypeError, ValueError):
+                return jsonify({'status': 'error', 'message': 'detection_ids must be integers'}), 400
             
             return jsonify({
-                'status': 'success',
-                'message': f'Successfully deleted {deleted_count} detections'
-            })
+                'status': 'accepted',
+                'message': f'Deleting {job.total} detections in the background',
+                'job': job.to_dict()
+            }), 202
             
         except Exception as e:
-            db.session.rollback()
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
+    # ====================== BACKGROUND JOBS ======================
+    
+    @app.route('/api/jobs', methods=['GET'])
+    @admin_required
+    def crud_list_jobs():
+        """GET: Recent background jobs, newest first"""
+        return jsonify({
+            'status': 'success',
+            'data': [job.to_dict() for job in job_manager.list_jobs()]
+        })
+
+    @app.route('/api/jobs/<int:job_id>', methods=['GET'])
+    @admin_required
+    def crud_get_job(job_id):
+        """GET: Progress of one background job"""
+        job = job_manager.get(job_id)
+        if not job:
+            return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+        
+        return jsonify({'status': 'success', 'data': job.to_dict()})
+
+    @app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+    @admin_required
+    def crud_cancel_job(job_id):
+        """POST: Stop a background job after its current chunk"""
+        job = job_manager.cancel(job_id)
+        if not job:
+            return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+        
+        return jsonify({'status': 'success', 'data': job.to_dict()})
+
     # ====================== SYSTEM STATS CRUD OPERATIONS ======================
     
     @app.route('/api/stats', methods=['GET'])
@@ -361,7 +425,7 @@ def register_crud_routes(app):
     def crud_get_system_stats():
         """GET: Retrieve system statistics"""
         try:
-            stats = SystemStats.query.first()
+            stats = analytics_session().query(SystemStats).first()
             if not stats:
                 return jsonify({
                     'status': 'success',
@@ -444,58 +508,80 @@ def register_crud_routes(app):
     @app.route('/api/detections/search', methods=['GET'])
     @login_required
     def crud_search_detections():
-        """GET: Search detections by postal code or date range"""
+        """GET: Search detections by code prefix (?postal_code=, ?match=exact), place name (?q=), region or date range"""
         try:
-            postal_code = request.args.get('postal_code')
+            postal_code = request.args.get('postal_code', '').strip()  # Blank means no code filter
+            match = request.args.get('match', 'prefix')
+            search_text = request.args.get('q')
+            region = request.args.get('region')
             start_date = request.args.get('start_date')
             end_date = request.args.get('end_date')
-            user_id = request.args.get('user_id')
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 50, type=int)
+            user_id = request.args.get('user_id', type=int)
+            per_page = min(request.args.get('per_page', 50, type=int), 500)
             
-            query = Detection.query
+            if match not in SEARCH_MODES:
+                raise ValueError(f"Unsupported match mode '{match}' (use {', '.join(SEARCH_MODES)})")
             
-            # Apply filters
+            query = listing_query()
+            archive_filters = {'match': match}  # Same filters for the archived tier
+            
+            # Apply filters (each one an index range or lookup)
             if postal_code:
-                query = query.filter(Detection.postal_code.like(f'%{postal_code}%'))
+                query = filter_postal_code(query, postal_code, match)
+                archive_filters['postal_code'] = postal_code
+            
+            if search_text:
+                codes = codes_matching(read_session(), search_text)
+                query = query.filter(Detection.postal_code.in_(codes))
+                archive_filters['codes'] = codes
+            
+            if region:
+                query = query.filter(Detection.region == region)
+                archive_filters['region'] = region
             
             if start_date:
-                start_dt = datetime.fromisoformat(start_date)
+                start_dt = parse_timestamp(start_date)
                 query = query.filter(Detection.timestamp >= start_dt)
+                archive_filters['start'] = start_dt
             
             if end_date:
-                end_dt = datetime.fromisoformat(end_date)
+                end_dt = parse_timestamp(end_date)
                 query = query.filter(Detection.timestamp <= end_dt)
+                archive_filters['end'] = end_dt
             
             if user_id:
                 query = query.filter(Detection.user_id == user_id)
+                archive_filters['user_id'] = user_id
             
-            # Apply pagination and ordering
-            detections = query.order_by(Detection.timestamp.desc()).paginate(
-                page=page, per_page=per_page, error_out=False
+            # Totals are opt-in here: a filtered COUNT costs as much as the search itself
+            total, total_is_estimate = detection_total(
+                query, request.args.get('total', 'none'), user_id=user_id,
+                filtered=bool(postal_code or search_text or region or start_date or end_date)
             )
             
-            detection_list = [detection.to_dict() for detection in detections.items]
+            # Apply cursor pagination and ordering
+            detections = keyset_paginate(
+                query, cursor=request.args.get('cursor'), per_page=per_page,
+                total=total, total_is_estimate=total_is_estimate, archive_filters=archive_filters
+            )
             
-            return jsonify({
+            return json_response({
                 'status': 'success',
-                'data': detection_list,
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': detections.total,
-                    'pages': detections.pages,
-                    'has_next': detections.has_next,
-                    'has_prev': detections.has_prev
-                },
+                'data': detection_dicts(detections.items),
+                'pagination': detections.to_dict(),
                 'filters': {
                     'postal_code': postal_code,
+                    'match': match,
+                    'q': search_text,
+                    'region': region,
                     'start_date': start_date,
                     'end_date': end_date,
                     'user_id': user_id
                 }
             })
             
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -544,19 +630,76 @@ def register_crud_routes(app):
 
     # ====================== EXPORT OPERATIONS ======================
     
+    def export_options():
+        """Common ?format= and ?gzip= arguments of the export endpoints"""
+        fmt = request.args.get('format', 'json').lower()
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format '{fmt}' (use {', '.join(EXPORT_FORMATS)})")
+        compress = request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes')
+        return fmt, compress
+    
     @app.route('/api/export/detections', methods=['GET'])
     @admin_required
     def crud_export_detections():
-        """GET: Export detections data"""
+        """GET: Stream detections (?format=json|ndjson|csv, ?gzip=1, ?start=, ?end=, ?is_valid=, ?user_id=)"""
         try:
-            detections = Detection.query.order_by(Detection.timestamp.desc()).all()
-            detection_list = [detection.to_dict() for detection in detections]
+            fmt, compress = export_options()
+            start = request.args.get('start')
+            end = request.args.get('end')
+            is_valid = request.args.get('is_valid')
+            
+            filters = {
+                'start': parse_timestamp(start) if start else None,
+                'end': parse_timestamp(end) if end else None,
+                'is_valid': None if is_valid is None else is_valid.lower() in ('1', 'true', 'yes'),
+                'user_id': request.args.get('user_id', type=int)
+            }
+            statement = detection_export_statement(**filters)
+            
+            # Taken before the export starts: a consumer continues with /api/changes?since=<cursor>
+            cursor = latest_cursor(read_session())
+            
+            # Hot rows first, then the archived months (newest first)
+            chunks = itertools.chain(
+                iter_chunks(read_session(), statement),
+                detection_archiver.iter_chunks(read_session(), filters)
+            )
+            
+            response = export_response(
+                chunks, detection_records, DETECTION_FIELDS,
+                fmt, f"detections_{datetime.now().strftime('%Y%m%d_%H%M%S')}", compress
+            )
+            response.headers['X-Change-Cursor'] = str(cursor)
+            return response
+            
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    @app.route('/api/changes', methods=['GET'])
+    @admin_required
+    def crud_detection_changes():
+        """GET: Detections inserted, updated or deleted since a cursor (?since=, ?limit=)"""
+        try:
+            since = request.args.get('since', 0, type=int)
+            limit = min(request.args.get('limit', 1000, type=int), 10000)
+            
+            # Pruned history leaves a gap the consumer cannot bridge: it must re-export
+            oldest = oldest_cursor(read_session())
+            if since < oldest:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Cursor is older than the retained change history; re-export and resume from X-Change-Cursor',
+                    'oldest_cursor': oldest
+                }), 410
+            
+            feed = fetch_changes(read_session(), since=since, limit=limit)
             
             return jsonify({
                 'status': 'success',
-                'data': detection_list,
-                'count': len(detection_list),
-                'exported_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                'since': since,
+                **feed
             })
             
         except Exception as e:
@@ -565,17 +708,16 @@ def register_crud_routes(app):
     @app.route('/api/export/users', methods=['GET'])
     @admin_required
     def crud_export_users():
-        """GET: Export users data"""
+        """GET: Stream users (?format=json|ndjson|csv, ?gzip=1)"""
         try:
-            users = User.query.all()
-            user_list = [user.to_dict() for user in users]
+            fmt, compress = export_options()
             
-            return jsonify({
-                'status': 'success',
-                'data': user_list,
-                'count': len(user_list),
-                'exported_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+            return export_response(
+                iter_chunks(read_session(), user_export_statement()), user_records, USER_FIELDS,
+                fmt, f"users_{datetime.now().strftime('%Y%m%d_%H%M%S')}", compress
+            )
             
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500 
\ No newline at end of file
+            return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -0,0 +1,247 @@
+"""
+Database Backup Module
+Online backups through SQLite's backup API in small page steps, sleeping between
+steps so the detection writer keeps committing, with rotation and sha256 checks
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+from models import db
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = 'detector_backup_'
+BACKUP_SUFFIX = '.db'
+BACKUP_STAMP = '%Y%m%d_%H%M%S_%f'  # Microseconds, so a manual backup never collides with a scheduled one
+LEGACY_BACKUP_STAMP = '%Y%m%d_%H%M%S'
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as backup_file:
+        for block in iter(lambda: backup_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _checksum_path(path):
+    return path + '.sha256'
+
+class _TooManyRestarts(Exception):
+    pass
+
+def stepped_copy(source_path, target, pages_per_step, step_sleep_ms, max_restarts, busy_timeout_ms=5000):
+    """
+    Copy a live database into an open sqlite3 connection through the backup API
+
+    Copies pages_per_step pages at a time and sleeps between steps so the writer
+    keeps committing; after max_restarts restarts caused by those writes, the rest
+    is copied in one step.
+
+    Returns:
+        dict: steps and restarts
+    """
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def on_step(status, remaining, total):
+        # A write on another connection restarts the copy; remaining jumps back up
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+        progress['remaining'] = remaining
+        progress['steps'] += 1
+        time.sleep(step_sleep_ms / 1000.0)  # Locks are released between steps: let the writer in
+        if progress['restarts'] > max_restarts:
+            raise _TooManyRestarts()
+
+    source = sqlite3.connect(source_path, timeout=busy_timeout_ms / 1000.0)
+    try:
+        try:
+            source.backup(target, pages=pages_per_step, progress=on_step)
+        except _TooManyRestarts:
+            # Under a steady write load, finish with one step (a WAL read does not block writers)
+            source.backup(target, pages=-1)
+    finally:
+        source.close()
+    return {'steps': progress['steps'], 'restarts': progress['restarts']}
+
+class BackupManager:
+    """Scheduled online backups of the SQLite database"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()  # One backup at a time
+        self.stats = {
+            'backups': 0,
+            'failures': 0,
+            'last_duration_seconds': None,
+            'last_steps': None,
+            'last_restarts': None,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the backup manager with Flask app"""
+        self.app = app
+
+        app.config.setdefault('BACKUP_DIR', os.path.join(app.instance_path, 'backups'))
+        app.config.setdefault('BACKUP_INTERVAL_HOURS', 24)
+        app.config.setdefault('BACKUP_KEEP', 7)  # Rotations kept
+        app.config.setdefault('BACKUP_PAGES_PER_STEP', 256)
+        app.config.setdefault('BACKUP_STEP_SLEEP_MS', 20)  # Pause between steps so writers get the lock
+        app.config.setdefault('BACKUP_MAX_RESTARTS', 5)  # Then copy the rest in one step
+
+        app.extensions['backup_manager'] = self
+
+    @property
+    def backup_dir(self):
+        return self.app.config['BACKUP_DIR']
+
+    def database_path(self):
+        with self.app.app_context():
+            return db.engine.url.database
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='db-backup')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            last = self.last_backup()
+            interval = self.app.config['BACKUP_INTERVAL_HOURS'] * 3600
+            if last is None or (datetime.now() - last['created_at']).total_seconds() >= interval:
+                try:
+                    self.backup_now()
+                except Exception as e:
+                    logger.error(f"Scheduled backup failed: {e}")
+            time.sleep(60)
+
+    def backup_now(self):
+        """
+        Take one backup, verify it and rotate old ones
+
+        Returns:
+            dict: the new backup's entry (see list_backups)
+        """
+        with self.lock:
+            try:
+                return self._backup()
+            except Exception as e:
+                self.stats['failures'] += 1
+                self.stats['last_error'] = str(e)
+                raise
+
+    def _backup(self):
+        settings = self.app.config
+        os.makedirs(self.backup_dir, exist_ok=True)
+
+        name = path = None
+        while path is None or os.path.exists(path):
+            name = f"{BACKUP_PREFIX}{datetime.now().strftime(BACKUP_STAMP)}{BACKUP_SUFFIX}"
+            path = os.path.join(self.backup_dir, name)
+        temporary = path + '.partial'
+
+        started = time.monotonic()
+        target = sqlite3.connect(temporary)
+        try:
+            progress = stepped_copy(
+                self.database_path(), target, settings['BACKUP_PAGES_PER_STEP'], settings['BACKUP_STEP_SLEEP_MS'],
+                settings['BACKUP_MAX_RESTARTS'], settings.get('SQLITE_BUSY_TIMEOUT_MS', 5000)
+            )
+            # A restored edge database must not reuse the sync epoch: its ids and change
+            # sequence numbers restart from this point, so it pushes as a new incarnation
+            target.execute("UPDATE ingest_log_positions SET epoch = NULL WHERE name = 'edge_sync'")
+            target.commit()
+            check = target.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise RuntimeError(f'Backup failed quick_check: {check}')
+        finally:
+            target.close()
+
+        os.replace(temporary, path)
+        checksum = file_sha256(path)
+        with open(_checksum_path(path), 'w') as checksum_file:
+            checksum_file.write(f"{checksum}  {name}\n")
+
+        self.stats['backups'] += 1
+        self.stats['last_duration_seconds'] = round(time.monotonic() - started, 2)
+        self.stats['last_steps'] = progress['steps']
+        self.stats['last_restarts'] = progress['restarts']
+        self.stats['last_error'] = None
+
+        self.rotate()
+        print(f"💾 Backup written: {name} ({os.path.getsize(path)} bytes, {progress['steps']} steps)")
+        return self._entry(name)
+
+    def _names(self):
+        """Backup file names, newest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = [name for name in os.listdir(self.backup_dir)
+                 if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)]
+        return sorted(names, reverse=True)
+
+    def _entry(self, name, verify=False):
+        path = os.path.join(self.backup_dir, name)
+        stamp = name[len(BACKUP_PREFIX):-len(BACKUP_SUFFIX)]
+        entry = {
+            'name': name,
+            'created_at': datetime.strptime(stamp, BACKUP_STAMP if stamp.count('_') == 2 else LEGACY_BACKUP_STAMP),
+            'size_bytes': os.path.getsize(path)
+        }
+        if verify:
+            entry['verified'] = self.verify(name)
+        return entry
+
+    def list_backups(self, verify=False):
+        return [self._entry(name, verify) for name in self._names()]
+
+    def last_backup(self):
+        names = self._names()
+        return self._entry(names[0]) if names else None
+
+    def verify(self, name):
+        """True when the backup matches its recorded sha256"""
+        path = os.path.join(self.backup_dir, name)
+        try:
+            with open(_checksum_path(path)) as checksum_file:
+                expected = checksum_file.read().split()[0]
+        except (OSError, IndexError):
+            return False
+        return file_sha256(path) == expected
+
+    def rotate(self):
+        """Delete all but the newest BACKUP_KEEP backups; returns the names removed"""
+        removed = self._names()[self.app.config['BACKUP_KEEP']:]
+        for name in removed:
+            path = os.path.join(self.backup_dir, name)
+            for stale in (path, _checksum_path(path)):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        return removed
+
+    def to_dict(self, verify=False):
+        backups = self.list_backups(verify)
+        for entry in backups:
+            entry['created_at'] = entry['created_at'].strftime("%Y-%m-%d %H:%M:%S")
+        return {
+            'backups': backups,
+            'keep': self.app.config['BACKUP_KEEP'],
+            'interval_hours': self.app.config['BACKUP_INTERVAL_HOURS'],
+            **self.stats
+        }
+
+# Global instance
+backup_manager = BackupManager()
@@ -0,0 +1,226 @@
+"""
+Database Maintenance Module
+Runs ANALYZE / PRAGMA optimize, incremental vacuum, a passive WAL checkpoint and a quick
+integrity check in a nightly low-traffic window, in small throttled steps, and keeps a
+report of table sizes, free pages and timings for the admin dashboard
+"""
+
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+from sqlalchemy.exc import OperationalError
+from models import db
+from detection_writer import detection_writer
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+class MaintenanceScheduler:
+    """Keeps the SQLite file compact and its planner statistics fresh"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()  # One run at a time
+        self.last_report = None
+        self.stats = {
+            'runs': 0,
+            'last_run': None,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the maintenance scheduler with Flask app"""
+        self.app = app
+
+        app.config.setdefault('MAINTENANCE_WINDOW', (2, 5))  # Local hours [start, end) with little traffic
+        app.config.setdefault('MAINTENANCE_INTERVAL_HOURS', 20)  # At most one run per window
+        app.config.setdefault('MAINTENANCE_VACUUM_PAGES_PER_STEP', 256)
+        app.config.setdefault('MAINTENANCE_MAX_VACUUM_PAGES', 25600)  # Per run; the rest waits for the next window
+        app.config.setdefault('MAINTENANCE_STEP_SLEEP_MS', 50)
+        app.config.setdefault('MAINTENANCE_MAX_WRITER_QUEUE', 100)  # Back off while the detector has this many pending
+        app.config.setdefault('MAINTENANCE_ANALYSIS_LIMIT', 1000)  # Rows sampled per index by ANALYZE
+
+        app.extensions['maintenance_scheduler'] = self
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='db-maintenance')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def in_window(self, now=None):
+        start, end = self.app.config['MAINTENANCE_WINDOW']
+        hour = (now or datetime.now()).hour
+        return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+    def _due(self, now):
+        last = self.stats['last_run']
+        interval = self.app.config['MAINTENANCE_INTERVAL_HOURS'] * 3600
+        return self.in_window(now) and (last is None or (now - last).total_seconds() >= interval)
+
+    def _run(self):
+        while self.running:
+            if self._due(datetime.now()):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error(f"Database maintenance failed: {e}")
+            time.sleep(60)
+
+    def _throttle(self):
+        """Pause between steps, longer while the detection writer has a backlog"""
+        settings = self.app.config
+        time.sleep(settings['MAINTENANCE_STEP_SLEEP_MS'] / 1000.0)
+        waited = 0
+        while detection_writer.pending() > settings['MAINTENANCE_MAX_WRITER_QUEUE'] and waited < 30:
+            time.sleep(1)
+            waited += 1
+
+    def run_once(self, job=None):
+        """
+        Run every maintenance task once
+
+        Args:
+            job: optional background_jobs.Job to report progress to (one unit per task)
+
+        Returns:
+            dict: the report (also kept in last_report)
+        """
+        with self.lock, self.app.app_context():
+            started = time.monotonic()
+            report = {'started_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'tasks': {}}
+            tasks = [
+                ('analyze', self._analyze),
+                ('incremental_vacuum', self._incremental_vacuum),
+                ('wal_checkpoint', self._checkpoint),
+                ('quick_check', self._quick_check),
+            ]
+            try:
+                report['before'] = self.size_report()
+                for name, task in tasks:
+                    task_started = time.monotonic()
+                    result = task()
+                    result['seconds'] = round(time.monotonic() - task_started, 3)
+                    report['tasks'][name] = result
+                    self._throttle()
+                    if job is not None:
+                        job.advance(1)
+                report['after'] = self.size_report()
+                self.stats['last_error'] = None
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                report['error'] = str(e)
+                raise
+            finally:
+                report['seconds'] = round(time.monotonic() - started, 3)
+                self.stats['runs'] += 1
+                self.stats['last_run'] = datetime.now()
+                self.last_report = report
+
+            freed = report['tasks']['incremental_vacuum'].get('pages_freed', 0)
+            print(f"🧹 Database maintenance done in {report['seconds']}s "
+                  f"({freed} pages freed, integrity {report['tasks']['quick_check']['result']})")
+            return report
+
+    # ------------------------------------------------------------------ tasks
+
+    def _analyze(self):
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA analysis_limit = {int(self.app.config['MAINTENANCE_ANALYSIS_LIMIT'])}")
+            analyzed = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").first() is not None
+            # The first run needs a full ANALYZE; afterwards optimize only re-analyzes tables that changed a lot
+            conn.exec_driver_sql("PRAGMA optimize" if analyzed else "ANALYZE")
+            conn.commit()
+        return {'statement': 'PRAGMA optimize' if analyzed else 'ANALYZE'}
+
+    def _incremental_vacuum(self):
+        settings = self.app.config
+        step = int(settings['MAINTENANCE_VACUUM_PAGES_PER_STEP'])
+        raw = db.engine.raw_connection()
+        try:
+            sqlite_connection = raw.driver_connection
+            mode = sqlite_connection.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if mode != 2:
+                # Switching modes needs a full VACUUM, which blocks writers (manage_db.py vacuum)
+                return {'skipped': f'auto_vacuum is {AUTO_VACUUM_MODES.get(mode, mode)}', 'pages_freed': 0}
+
+            freed = 0
+            while freed < settings['MAINTENANCE_MAX_VACUUM_PAGES']:
+                free_pages = sqlite_connection.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free_pages:
+                    break
+                pages = min(step, free_pages)
+                # executescript steps the pragma to completion (execute frees a single page);
+                # each call is its own short write transaction
+                sqlite_connection.executescript(f"PRAGMA incremental_vacuum({pages})")
+                freed += pages
+                self._throttle()
+
+            return {'pages_freed': freed, 'free_pages_left': sqlite_connection.execute("PRAGMA freelist_count").fetchone()[0]}
+        finally:
+            raw.close()
+
+    def _checkpoint(self):
+        with db.engine.connect() as conn:
+            busy, log_frames, checkpointed = conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").first()
+        return {'busy': bool(busy), 'wal_frames': log_frames, 'checkpointed_frames': checkpointed}
+
+    def _quick_check(self):
+        # A read transaction: under WAL it does not block the detection writer
+        with db.engine.connect() as conn:
+            messages = [row[0] for row in conn.exec_driver_sql("PRAGMA quick_check(20)")]
+        return {'result': 'ok' if messages == ['ok'] else 'failed', 'messages': messages}
+
+    # --------------------------------------------------------------- reporting
+
+    def size_report(self):
+        """File, page and per-table sizes of the database"""
+        with db.engine.connect() as conn:
+            page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+            page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+            free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            auto_vacuum = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+            try:
+                rows = conn.exec_driver_sql(
+                    "SELECT name, SUM(pgsize), SUM(unused) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC").fetchall()
+                objects = [{'name': name, 'size_bytes': size, 'unused_bytes': unused} for name, size, unused in rows]
+            except OperationalError:
+                objects = None  # SQLite built without the dbstat table
+
+        path = db.engine.url.database
+        wal_path = f'{path}-wal'
+        return {
+            'file_bytes': os.path.getsize(path) if path and os.path.exists(path) else None,
+            'wal_bytes': os.path.getsize(wal_path) if path and os.path.exists(wal_path) else 0,
+            'page_size': page_size,
+            'page_count': page_count,
+            'free_pages': free_pages,
+            'free_ratio': round(free_pages / page_count, 4) if page_count else 0.0,
+            'auto_vacuum': AUTO_VACUUM_MODES.get(auto_vacuum, auto_vacuum),
+            'objects': objects
+        }
+
+    def to_dict(self):
+        return {
+            'window': list(self.app.config['MAINTENANCE_WINDOW']),
+            'in_window': self.in_window(),
+            'runs': self.stats['runs'],
+            'last_run': self.stats['last_run'].strftime("%Y-%m-%d %H:%M:%S") if self.stats['last_run'] else None,
+            'last_error': self.stats['last_error'],
+            'last_report': self.last_report
+        }
+
+# Global instance
+maintenance_scheduler = MaintenanceScheduler()
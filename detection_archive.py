@@ -0,0 +1,462 @@
+"""
+Detection Archive Module
+Moves detections older than ARCHIVE_AFTER_DAYS out of the hot table into per-month
+compressed columnar .npz chunks (with min/max metadata in archive_chunks),
+and reads them back so history, search and export span both tiers
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select
+from models import db, Detection, ArchiveChunk, DetectionChange
+from detection_stats import DetectionFacts, record_deletes
+from epoch_time import from_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+CATEGORICAL_COLUMNS = ('postal_code', 'raw_postal_code', 'region', 'node_id', 'source_epoch')
+CHUNK_CACHE_SIZE = 2  # Decoded month chunks kept in memory
+
+def month_key(timestamp):
+    return timestamp.strftime('%Y-%m')
+
+def month_bounds(month):
+    """[start, end) datetimes of a YYYY-MM month"""
+    start = datetime.strptime(month, '%Y-%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+def _to_datetime64(value):
+    return np.datetime64(value, 'us')
+
+class ArchivedChunk:
+    """One month of archived detections as numpy columns, sorted newest first"""
+
+    def __init__(self, columns):
+        self.id = columns['id']
+        self.timestamp = columns['timestamp']
+        self.confidence = columns['confidence']
+        self.user_id = columns['user_id']
+        self.is_valid = columns['is_valid']
+        self.source_id = columns['source_id']  # -1 = detected on this node
+        # Categorical columns: dictionary of distinct values plus an index per row ('' = NULL)
+        self.values = {name: columns[f'{name}_values'] for name in CATEGORICAL_COLUMNS}
+        self.codes = {name: columns[f'{name}_codes'] for name in CATEGORICAL_COLUMNS}
+
+    def __len__(self):
+        return len(self.id)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            columns = {name: data[name] for name in data.files}
+        columns['timestamp'] = columns['timestamp'].astype('datetime64[us]')
+        # Chunks written before edge sync attribution have no node columns: all local rows
+        columns.setdefault('source_id', np.full(len(columns['id']), -1, dtype=np.int64))
+        for name in CATEGORICAL_COLUMNS:
+            columns.setdefault(f'{name}_values', np.array([''], dtype=str))
+            columns.setdefault(f'{name}_codes', np.zeros(len(columns['id']), dtype=np.int32))
+        return cls(columns)
+
+    def decoded(self):
+        """Plain column arrays (for merging with newly archived rows)"""
+        columns = {
+            'id': self.id,
+            'timestamp': self.timestamp,
+            'confidence': self.confidence,
+            'user_id': self.user_id,
+            'is_valid': self.is_valid,
+            'source_id': self.source_id
+        }
+        for name in CATEGORICAL_COLUMNS:
+            columns[name] = self.values[name][self.codes[name]]
+        return columns
+
+    def facts(self):
+        """DetectionFacts for every row (to take the chunk out of the stats)"""
+        codes = self.values['postal_code'][self.codes['postal_code']].tolist()
+        timestamps = self.timestamp.astype(datetime).tolist()
+        users = [None if user_id < 0 else user_id for user_id in self.user_id.tolist()]
+        return [DetectionFacts(*row) for row in zip(codes, timestamps, users, self.is_valid.tolist())]
+
+    def _category_mask(self, name, allowed_values):
+        allowed = np.flatnonzero(allowed_values)
+        return np.isin(self.codes[name], allowed)
+
+    def mask(self, filters):
+        """Boolean row mask for the filter dict used by history, search and export"""
+        mask = np.ones(len(self), dtype=bool)
+        if filters.get('user_id') is not None:
+            mask &= self.user_id == filters['user_id']
+        if filters.get('start') is not None:
+            mask &= self.timestamp >= _to_datetime64(filters['start'])
+        if filters.get('end') is not None:
+            mask &= self.timestamp <= _to_datetime64(filters['end'])
+        if filters.get('is_valid') is not None:
+            mask &= self.is_valid == bool(filters['is_valid'])
+        if filters.get('postal_code'):
+            values = self.values['postal_code']
+            if filters.get('match') == 'exact':
+                mask &= self._category_mask('postal_code', values == filters['postal_code'])
+            else:
+                mask &= self._category_mask('postal_code', np.char.startswith(values, filters['postal_code']))
+        if filters.get('codes') is not None:
+            mask &= self._category_mask('postal_code', np.isin(self.values['postal_code'], list(filters['codes'])))
+        if filters.get('region'):
+            mask &= self._category_mask('region', self.values['region'] == filters['region'])
+        return mask
+
+    def synced_mask(self, node_id, source_epoch, source_ids):
+        """Rows synced from node_id (in source_epoch) whose id there is one of source_ids"""
+        mask = self._category_mask('node_id', self.values['node_id'] == node_id)
+        mask &= self._category_mask('source_epoch', self.values['source_epoch'] == source_epoch)
+        return mask & np.isin(self.source_id, list(source_ids))
+
+    def keyset_mask(self, direction, timestamp, detection_id):
+        """Rows strictly after a cursor in the given direction ('n' = older, 'p' = newer)"""
+        timestamp = _to_datetime64(timestamp)
+        if direction == 'n':
+            return (self.timestamp < timestamp) | ((self.timestamp == timestamp) & (self.id < detection_id))
+        return (self.timestamp > timestamp) | ((self.timestamp == timestamp) & (self.id > detection_id))
+
+    def detection(self, index):
+        """Transient (never added to a session) Detection for one row"""
+        def category(name):
+            value = self.values[name][self.codes[name][index]]
+            return str(value) if value else None
+
+        confidence = float(self.confidence[index])
+        user_id = int(self.user_id[index])
+        node_id = category('node_id')
+        return Detection(
+            id=int(self.id[index]),
+            postal_code=category('postal_code'),
+            raw_postal_code=category('raw_postal_code'),
+            timestamp=self.timestamp[index].astype(datetime),
+            confidence=None if np.isnan(confidence) else confidence,
+            user_id=None if user_id < 0 else user_id,
+            is_valid=bool(self.is_valid[index]),
+            region=category('region'),
+            node_id=node_id,
+            # '' is a real epoch (rows synced before epochs existed) once the row has a node
+            source_epoch=str(self.values['source_epoch'][self.codes['source_epoch'][index]]) if node_id else None,
+            source_id=int(self.source_id[index]) if node_id else None
+        )
+
+def _columns_from_rows(rows):
+    """numpy columns from (id, timestamp, postal_code, raw_postal_code, confidence, user_id, is_valid, region,
+    node_id, source_epoch, source_id) rows"""
+    ids, timestamps, codes, raws, confidences, users, valids, regions, nodes, epochs, sources = zip(*rows)
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'timestamp': np.array(timestamps, dtype='datetime64[us]'),
+        'postal_code': np.array([value or '' for value in codes], dtype=str),
+        'raw_postal_code': np.array([value or '' for value in raws], dtype=str),
+        'confidence': np.array([np.nan if value is None else value for value in confidences], dtype=np.float64),
+        'user_id': np.array([-1 if value is None else value for value in users], dtype=np.int64),
+        'is_valid': np.array([bool(value) for value in valids], dtype=bool),
+        'region': np.array([value or '' for value in regions], dtype=str),
+        'node_id': np.array([value or '' for value in nodes], dtype=str),
+        'source_epoch': np.array([value or '' for value in epochs], dtype=str),
+        'source_id': np.array([-1 if value is None else value for value in sources], dtype=np.int64)
+    }
+
+def _merge_columns(newer, older):
+    """Concatenate two column sets, keeping newer's version of any duplicate id"""
+    merged = {name: np.concatenate([newer[name], older[name]]) for name in newer}
+    _, first = np.unique(merged['id'], return_index=True)
+    return {name: values[first] for name, values in merged.items()}
+
+def write_chunk(path, columns):
+    """Write columns to a compressed .npz atomically, sorted newest first; returns the file size"""
+    order = np.lexsort((columns['id'], columns['timestamp']))[::-1]
+    arrays = {
+        'id': columns['id'][order],
+        'timestamp': columns['timestamp'][order].astype(np.int64),  # microseconds since the epoch
+        'confidence': columns['confidence'][order],
+        'user_id': columns['user_id'][order],
+        'is_valid': columns['is_valid'][order],
+        'source_id': columns['source_id'][order]
+    }
+    for name in CATEGORICAL_COLUMNS:
+        values, codes = np.unique(columns[name][order], return_inverse=True)
+        arrays[f'{name}_values'] = values
+        arrays[f'{name}_codes'] = codes.astype(np.int32)
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as chunk_file:
+        np.savez_compressed(chunk_file, **arrays)
+        chunk_file.flush()
+        os.fsync(chunk_file.fileno())
+    os.replace(temporary, path)
+    return os.path.getsize(path)
+
+class DetectionArchiver:
+    """Compacts old detections into monthly chunks and serves them back"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.stats = {
+            'runs': 0,
+            'archived_rows': 0,
+            'last_run': None,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the archiver with Flask app"""
+        self.app = app
+
+        app.config.setdefault('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+        app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)  # Age at which a whole month moves to the archive
+        app.config.setdefault('ARCHIVE_CHECK_HOURS', 24)
+
+        app.extensions['detection_archiver'] = self
+
+    @property
+    def archive_dir(self):
+        return self.app.config['ARCHIVE_DIR']
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='detection-archiver')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        next_run = time.monotonic() + 60  # Let startup settle first
+        while self.running:
+            if time.monotonic() >= next_run:
+                with self.app.app_context():
+                    try:
+                        self.run_once()
+                    except Exception as e:
+                        db.session.rollback()
+                        self.stats['last_error'] = str(e)
+                        logger.error(f"Archive run failed: {e}")
+                next_run = time.monotonic() + self.app.config['ARCHIVE_CHECK_HOURS'] * 3600
+            time.sleep(5)
+
+    # ---------------------------------------------------------------- writing
+
+    def pending_months(self, now=None):
+        """Months whose every day is older than ARCHIVE_AFTER_DAYS and that still have hot rows"""
+        now = now or datetime.now()
+        cutoff_month_start = (now - timedelta(days=self.app.config['ARCHIVE_AFTER_DAYS'])).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        months = []
+        oldest = db.session.query(db.func.min(Detection.timestamp)).scalar()
+        while oldest is not None and oldest < cutoff_month_start:
+            month = month_key(oldest)
+            months.append(month)
+            # Jump to the next month that actually has rows (index seek on timestamp)
+            oldest = db.session.query(db.func.min(Detection.timestamp)).filter(
+                Detection.timestamp >= month_bounds(month)[1]).scalar()
+        return months
+
+    def archive_month(self, month):
+        """Move one month of hot detections into its chunk file; returns the rows moved"""
+        start, end = month_bounds(month)
+        statement = select(
+            Detection.id, Detection.timestamp, Detection.postal_code, Detection.raw_postal_code,
+            Detection.confidence, Detection.user_id, Detection.is_valid, Detection.region,
+            Detection.node_id, Detection.source_epoch, Detection.source_id
+        ).where(Detection.timestamp >= start, Detection.timestamp < end)
+
+        # Converted to numpy columns partition by partition, never holding the month as Python rows
+        parts = [_columns_from_rows(rows) for rows in
+                 db.session.execute(statement.execution_options(yield_per=10000)).partitions()]
+        if not parts:
+            return 0
+
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+        moved = len(columns['id'])
+        max_id = int(columns['id'].max())
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        filename = f'detections_{month}.npz'
+        path = os.path.join(self.archive_dir, filename)
+        if os.path.exists(path):
+            # Late rows for an archived month: merge (a re-run after a failed delete is deduplicated by id)
+            columns = _merge_columns(columns, ArchivedChunk.load(path).decoded())
+        size = write_chunk(path, columns)
+
+        # Archiving is not a logical delete: drop the change-feed tombstones the delete triggers write
+        last_seq = db.session.query(db.func.max(DetectionChange.seq)).scalar() or 0
+        db.session.query(Detection).filter(
+            Detection.timestamp >= start, Detection.timestamp < end, Detection.id <= max_id
+        ).delete(synchronize_session=False)
+        db.session.query(DetectionChange).filter(
+            DetectionChange.seq > last_seq, DetectionChange.op == 'delete'
+        ).delete(synchronize_session=False)
+
+        chunk = db.session.get(ArchiveChunk, month) or ArchiveChunk(month=month)
+        chunk.path = filename
+        chunk.row_count = len(columns['id'])
+        chunk.min_timestamp = columns['timestamp'].min().astype(datetime)
+        chunk.max_timestamp = columns['timestamp'].max().astype(datetime)
+        chunk.min_id = int(columns['id'].min())
+        chunk.max_id = int(columns['id'].max())
+        chunk.size_bytes = size
+        chunk.updated_at = datetime.now()
+        db.session.add(chunk)
+        db.session.commit()
+
+        self._forget(path)
+        return moved
+
+    def drop_chunk(self, chunk):
+        """Remove one month from the archive and from the stats; returns the rows removed"""
+        path = os.path.join(self.archive_dir, chunk.path)
+        if os.path.exists(path):
+            record_deletes(ArchivedChunk.load(path).facts())
+        removed = chunk.row_count
+        db.session.delete(chunk)
+        db.session.commit()
+
+        # The file goes only once the catalogue no longer points at it
+        self._forget(path)
+        if os.path.exists(path):
+            os.remove(path)
+        return removed
+
+    def run_once(self, now=None):
+        """Archive every pending month; returns [(month, rows moved), ...]"""
+        archived = []
+        for month in self.pending_months(now):
+            moved = self.archive_month(month)
+            archived.append((month, moved))
+            self.stats['archived_rows'] += moved
+            print(f"🗄️  Archived {moved} detections from {month}")
+        self.stats['runs'] += 1
+        self.stats['last_run'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.stats['last_error'] = None
+        return archived
+
+    # ---------------------------------------------------------------- reading
+
+    def _forget(self, path):
+        with self.lock:
+            for key in [key for key in self._cache if key[0] == path]:
+                del self._cache[key]
+
+    def load(self, chunk):
+        """Decoded chunk, cached by path and modification time"""
+        path = os.path.join(self.archive_dir, chunk.path)
+        key = (path, os.path.getmtime(path))
+        with self.lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        loaded = ArchivedChunk.load(path)
+        with self.lock:
+            self._cache[key] = loaded
+            while len(self._cache) > CHUNK_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return loaded
+
+    def _chunks(self, session, filters, newest_first=True):
+        """Chunk rows overlapping the filter's time range, in time order"""
+        query = session.query(ArchiveChunk)
+        if filters.get('start') is not None:
+            query = query.filter(ArchiveChunk.max_timestamp >= filters['start'])
+        if filters.get('end') is not None:
+            query = query.filter(ArchiveChunk.min_timestamp <= filters['end'])
+        order = ArchiveChunk.max_timestamp.desc() if newest_first else ArchiveChunk.min_timestamp.asc()
+        return query.order_by(order).all()
+
+    def page(self, session, filters, cursor=None, limit=50):
+        """
+        Archived detections after a keyset cursor
+
+        Args:
+            filters: dict (user_id, start, end, is_valid, postal_code/match, codes, region)
+            cursor: (direction, timestamp_ms, id) from pagination.decode_cursor, or None
+            limit: maximum rows
+
+        Returns:
+            list: transient Detections, newest first for 'n' and oldest first for 'p'
+        """
+        direction = cursor[0] if cursor else 'n'
+        # Chunks hold local times; epoch ms -> local time is unambiguous in this direction
+        moment = from_epoch_ms(cursor[1]) if cursor else None
+        found = []
+        for chunk in self._chunks(session, filters, newest_first=(direction == 'n')):
+            if cursor and direction == 'n' and chunk.min_timestamp > moment:
+                continue
+            if cursor and direction == 'p' and chunk.max_timestamp < moment:
+                continue
+
+            loaded = self.load(chunk)
+            mask = loaded.mask(filters)
+            if cursor:
+                mask &= loaded.keyset_mask(direction, moment, cursor[2])
+            indexes = np.flatnonzero(mask)
+            if direction == 'p':
+                indexes = indexes[::-1]
+            found.extend(loaded.detection(index) for index in indexes[:limit - len(found)])
+            if len(found) >= limit:
+                break
+        return found
+
+    def archived_facts(self, conn):
+        """DetectionFacts of every archived row, one list per month (for the stats and rollup rebuilds)"""
+        chunks = conn.execute(select(ArchiveChunk.month, ArchiveChunk.path).order_by(ArchiveChunk.month)).all()
+        for month, filename in chunks:
+            path = os.path.join(self.archive_dir, filename)
+            if not os.path.exists(path):
+                raise RuntimeError(f'Archive chunk {filename} ({month}) is missing; cannot count its detections')
+            yield ArchivedChunk.load(path).facts()
+
+    def synced_source_ids(self, session, node_id, source_epoch, source_ids, months=None):
+        """
+        The ids among source_ids that node_id (in source_epoch) has in the archive
+
+        months: only look in these YYYY-MM chunks (None = every chunk)
+        """
+        query = session.query(ArchiveChunk)
+        if months is not None:
+            query = query.filter(ArchiveChunk.month.in_(list(months)))
+        found = set()
+        for chunk in query.order_by(ArchiveChunk.month.desc()).all():
+            loaded = self.load(chunk)
+            found.update(loaded.source_id[loaded.synced_mask(node_id, source_epoch, source_ids)].tolist())
+        return found
+
+    def iter_chunks(self, session, filters, chunk_size=1000):
+        """Yield lists of archived detections matching filters, newest first (for exports)"""
+        for chunk in self._chunks(session, filters):
+            loaded = self.load(chunk)
+            indexes = np.flatnonzero(loaded.mask(filters))
+            for start in range(0, len(indexes), chunk_size):
+                yield [loaded.detection(index) for index in indexes[start:start + chunk_size]]
+
+    def summary(self, session):
+        chunks = session.query(ArchiveChunk).order_by(ArchiveChunk.month).all()
+        return {
+            'chunks': [chunk.to_dict() for chunk in chunks],
+            'archived_rows': sum(chunk.row_count for chunk in chunks),
+            'size_bytes': sum(chunk.size_bytes for chunk in chunks),
+            'archive_after_days': self.app.config['ARCHIVE_AFTER_DAYS'],
+            **self.stats
+        }
+
+# Global instance
+detection_archiver = DetectionArchiver()
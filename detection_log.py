@@ -0,0 +1,525 @@
+"""
+Detection Log Module
+Append-only binary log of detections: fixed 48-byte records with a CRC32 each,
+written in fsync batches, and an indexer thread that projects the log into the
+detections table and the stats, recording how far it got in the same transaction
+"""
+
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+import logging
+from datetime import datetime
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from models import db, Detection, IngestLogPosition
+from detection_stats import DetectionFacts, record_inserts, region_of
+from epoch_time import to_epoch_ms, from_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+LOG_MAGIC = b'PCDLOG'
+LOG_VERSION = 1
+POSITION_NAME = 'detection_log'
+QUARANTINE_NAME = 'quarantine.log'  # Records the indexer gave up on: 8-byte sequence number + record
+
+# magic, version, record size, first sequence number in the segment
+HEADER = struct.Struct('<6sHIQ4x')
+# timestamp_ms, postal_code, raw_postal_code, confidence (NaN = none), user_id (0 = none), flags, crc32
+RECORD = struct.Struct('<q10s10sfiB7xI')
+CRC_SPAN = RECORD.size - 4  # The CRC covers everything before it
+
+FLAG_VALID = 1
+FLAG_RAW_CODE = 2
+
+# Same layout as RECORD, for reading a segment straight from an mmap
+RECORD_DTYPE = np.dtype({
+    'names': ['timestamp_ms', 'postal_code', 'raw_postal_code', 'confidence', 'user_id', 'flags', 'crc'],
+    'formats': ['<i8', 'S10', 'S10', '<f4', '<i4', 'u1', '<u4'],
+    'offsets': [0, 8, 18, 28, 32, 36, 44],
+    'itemsize': RECORD.size
+})
+
+def pack_record(postal_code, timestamp=None, raw_postal_code=None, confidence=None, user_id=None, is_valid=True):
+    """One log record for a detection (the fields DetectionWriter.submit takes)"""
+    flags = (FLAG_VALID if is_valid else 0) | (FLAG_RAW_CODE if raw_postal_code is not None else 0)
+    body = RECORD.pack(
+        to_epoch_ms(timestamp or datetime.now()),
+        postal_code.encode('utf-8')[:10],
+        (raw_postal_code or '').encode('utf-8')[:10],
+        math.nan if confidence is None else confidence,
+        user_id or 0,
+        flags,
+        0
+    )
+    return body[:CRC_SPAN] + struct.pack('<I', zlib.crc32(body[:CRC_SPAN]))
+
+def record_ok(data, start=0):
+    """Whether the record at data[start:] matches its CRC"""
+    view = memoryview(data)[start:start + RECORD.size]
+    return zlib.crc32(view[:CRC_SPAN]) == struct.unpack_from('<I', view, CRC_SPAN)[0]
+
+def segment_name(first_seq):
+    return f'detections_{first_seq:012d}.log'
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read_segment(path, first_seq, start, end):
+    """Records [start, end) of a segment as (structured array, raw bytes), through an mmap"""
+    with open(path, 'rb') as segment:
+        with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offset = HEADER.size + (start - first_seq) * RECORD.size
+            raw = mapped[offset:offset + (end - start) * RECORD.size]
+    return np.frombuffer(raw, dtype=RECORD_DTYPE), raw
+
+class DetectionLog:
+    """Durable append path for detections, indexed into SQLite in the background
+
+    Every record has a sequence number (its position in the log). Records below
+    durable_seq are fsynced; records below applied_seq are in the detections table.
+    Segments are named after their first sequence number and deleted once applied.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.lock = threading.Lock()
+        self.durable = threading.Condition(self.lock)
+        self.wake = threading.Event()
+        self.buffer = bytearray()
+        self.file = None
+        self.segment_first = 0
+        self.next_seq = 0
+        self.durable_seq = 0
+        self.applied_seq = 0
+        self.running = False
+        self.opened = False
+        self.flusher = None
+        self.indexer = None
+        self.stalled_seq = None  # Record the indexer is stuck on, if any
+        self.stats = {
+            'appended': 0,
+            'fsyncs': 0,
+            'indexed': 0,
+            'index_batches': 0,
+            'corrupt': 0,
+            'index_failures': 0,
+            'quarantined': 0,
+            'recovered_bytes': 0,
+            'write_failures': 0,
+            'last_fsync_ms': 0.0,
+            'last_index_ms': 0.0,
+            'last_error': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the detection log with Flask app"""
+        self.app = app
+
+        app.config.setdefault('DETECTION_LOG_DIR', os.path.join(app.instance_path, 'detection_log'))
+        app.config.setdefault('DETECTION_LOG_FSYNC_MS', 20)  # Group fsync window
+        app.config.setdefault('DETECTION_LOG_FSYNC_RECORDS', 1000)  # ... or as soon as this many are buffered
+        app.config.setdefault('DETECTION_LOG_SEGMENT_RECORDS', 1000000)  # 48 MB segments
+        app.config.setdefault('DETECTION_LOG_INDEX_BATCH', 5000)  # Records per indexer transaction
+        app.config.setdefault('DETECTION_LOG_INDEX_MS', 200)  # Indexer poll interval when caught up
+        app.config.setdefault('DETECTION_LOG_INDEX_RETRIES', 8)  # Failures of a lone record before it is quarantined
+
+        app.extensions['detection_log'] = self
+
+    @property
+    def log_dir(self):
+        return self.app.config['DETECTION_LOG_DIR']
+
+    # ---------------------------------------------------------------- segments
+
+    def segments(self):
+        """(first_seq, path) for every segment, oldest first"""
+        if not os.path.isdir(self.log_dir):
+            return []
+        found = []
+        for name in os.listdir(self.log_dir):
+            if name.startswith('detections_') and name.endswith('.log'):
+                found.append((int(name[len('detections_'):-len('.log')]), os.path.join(self.log_dir, name)))
+        return sorted(found)
+
+    def _new_segment(self, first_seq):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        path = os.path.join(self.log_dir, segment_name(first_seq))
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(LOG_MAGIC, LOG_VERSION, RECORD.size, first_seq))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        _fsync_directory(self.log_dir)
+        self.segment_first = first_seq
+
+    def _recover_tail(self, path):
+        """Drop a torn or corrupt tail left by a crash; returns the number of good records"""
+        size = os.path.getsize(path)
+        if size < HEADER.size:
+            return None
+        count = (size - HEADER.size) // RECORD.size
+        with open(path, 'rb') as segment:
+            magic, version, record_size, _ = HEADER.unpack(segment.read(HEADER.size))
+            if magic != LOG_MAGIC or record_size != RECORD.size:
+                raise RuntimeError(f'{path} is not a version {LOG_VERSION} detection log segment')
+            # Only the last records can be torn: walk back to the first one that checks out
+            while count > 0:
+                segment.seek(HEADER.size + (count - 1) * RECORD.size)
+                if record_ok(segment.read(RECORD.size)):
+                    break
+                count -= 1
+
+        good_size = HEADER.size + count * RECORD.size
+        if good_size != size:
+            with open(path, 'r+b') as segment:
+                segment.truncate(good_size)
+                os.fsync(segment.fileno())
+            self.stats['recovered_bytes'] += size - good_size
+            logger.warning(f"Detection log: dropped {size - good_size} torn bytes from {os.path.basename(path)}")
+        return count
+
+    def _applied_position(self):
+        position = db.session.get(IngestLogPosition, POSITION_NAME)
+        return position.applied_seq if position else 0
+
+    def open(self):
+        """Recover the log and position the writer and the indexer (idempotent)"""
+        with self.lock:
+            if self.opened:
+                return
+            os.makedirs(self.log_dir, exist_ok=True)
+            with self.app.app_context():
+                self.applied_seq = self._applied_position()
+
+            segments = self.segments()
+            count = self._recover_tail(segments[-1][1]) if segments else None
+            if count is None:
+                # No log yet (or a segment cut short while being created): continue from the applied position
+                if segments:
+                    os.remove(segments[-1][1])
+                    segments = segments[:-1]
+                last_seq = 0
+                if segments:
+                    # The previous segment ends where its records end, not where it starts
+                    first, path = segments[-1]
+                    last_seq = first + (self._recover_tail(path) or 0)
+                self._new_segment(max(self.applied_seq, last_seq))
+            else:
+                self.segment_first = segments[-1][0]
+                self.file = open(segments[-1][1], 'ab')
+
+            self.next_seq = self.segment_first + (count or 0)
+            if self.next_seq < self.applied_seq:
+                # The log lost records the database already has (e.g. restored from a backup): never reuse numbers
+                logger.warning(f"Detection log ends at {self.next_seq} but {self.applied_seq} are applied; starting a new segment")
+                self._new_segment(self.applied_seq)
+                self.next_seq = self.applied_seq
+            self.durable_seq = self.next_seq
+            self.opened = True
+        self._drop_applied_segments()
+
+    # ------------------------------------------------------------------ writing
+
+    def start(self):
+        self.open()
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.flusher = threading.Thread(target=self._run_flusher, name='detection-log-fsync')
+        self.flusher.daemon = True
+        self.flusher.start()
+        self.indexer = threading.Thread(target=self._run_indexer, name='detection-log-indexer')
+        self.indexer.daemon = True
+        self.indexer.start()
+
+    def stop(self, timeout=10.0):
+        """Flush and fsync everything appended, then let the indexer catch up"""
+        self.running = False
+        self.wake.set()
+        for thread in (self.flusher, self.indexer):
+            if thread and thread.is_alive():
+                thread.join(timeout=timeout)
+
+    def append(self, wait=False, timeout=10.0, **fields):
+        """
+        Append a detection (Detection column values); returns its sequence number
+
+        With wait=True, return only once the record is fsynced.
+        """
+        if not self.running:
+            self.start()
+
+        record = pack_record(**fields)
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.buffer += record
+            self.stats['appended'] += 1
+            if len(self.buffer) >= self.app.config['DETECTION_LOG_FSYNC_RECORDS'] * RECORD.size:
+                self.wake.set()
+            if wait:
+                self.wake.set()
+                if not self.durable.wait_for(lambda: self.durable_seq > seq, timeout):
+                    raise TimeoutError('Detection was not written to the log in time')
+        return seq
+
+    def _run_flusher(self):
+        interval = self.app.config['DETECTION_LOG_FSYNC_MS'] / 1000.0
+        failures = 0
+        while self.running:
+            if failures:
+                time.sleep(min(interval * 2 ** failures, 5.0))  # Back off while the disk keeps failing
+            else:
+                self.wake.wait(interval)
+            self.wake.clear()
+            failures = 0 if self._flush() else failures + 1
+        self._flush()
+
+    def _flush(self):
+        """Write and fsync the buffered records; returns False if the write failed (they stay buffered)"""
+        with self.lock:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        if not data:
+            return True
+
+        started = time.monotonic()
+        segment_records = self.app.config['DETECTION_LOG_SEGMENT_RECORDS']
+        start = durable = self.durable_seq  # Only this thread writes, so the buffer starts here
+        seq = start
+        written = 0
+        try:
+            if self.file is None:
+                self._rewind(durable)  # An earlier failure left no segment open
+            while written < len(data):
+                room = segment_records - (seq - self.segment_first)
+                if room <= 0:
+                    self._new_segment(seq)
+                    durable = seq  # The full segment was fsynced before the switch
+                    continue
+                chunk = data[written:written + room * RECORD.size]
+                self.file.write(chunk)
+                written += len(chunk)
+                seq += len(chunk) // RECORD.size
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            # Appends are acknowledged only once durable: keep the records and retry, in order,
+            # ahead of anything appended meanwhile, so sequence numbers keep matching file positions
+            self.stats['write_failures'] += 1
+            self.stats['last_error'] = str(e)
+            logger.error(f"Detection log write failed, retrying: {e}")
+            with self.lock:
+                self.buffer[:0] = data[(durable - start) * RECORD.size:]
+                if durable > self.durable_seq:
+                    self.durable_seq = durable
+                    self.durable.notify_all()
+            try:
+                self._rewind(durable)
+            except OSError as rewind_error:
+                logger.error(f"Detection log could not be cut back to record {durable}: {rewind_error}")
+            return False
+
+        with self.lock:
+            self.durable_seq = seq
+            self.durable.notify_all()
+        self.stats['fsyncs'] += 1
+        self.stats['last_fsync_ms'] = round((time.monotonic() - started) * 1000, 2)
+        return True
+
+    def _rewind(self, seq):
+        """Cut the log back to its first seq records after a failed write and reopen it for appending"""
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+        segments = self.segments()
+        for first, path in segments:
+            if first > seq:
+                os.remove(path)  # Started during the failed write: holds nothing durable
+        segments = [(first, path) for first, path in segments if first <= seq]
+
+        if segments and os.path.getsize(segments[-1][1]) >= HEADER.size:
+            first, path = segments[-1]
+            with open(path, 'r+b') as segment:
+                segment.truncate(HEADER.size + (seq - first) * RECORD.size)
+                os.fsync(segment.fileno())
+            self.segment_first = first
+            self.file = open(path, 'ab')
+        else:
+            if segments:
+                os.remove(segments[-1][1])  # Its header never made it to disk
+            self._new_segment(seq)
+
+    # ----------------------------------------------------------------- indexing
+
+    def backlog(self):
+        """Records appended but not yet in the detections table (quarantined ones are not counted)"""
+        return self.next_seq - self.applied_seq if self.opened else 0
+
+    def _run_indexer(self):
+        interval = self.app.config['DETECTION_LOG_INDEX_MS'] / 1000.0
+        batch_size = self.app.config['DETECTION_LOG_INDEX_BATCH']
+        batch = batch_size
+        failures = 0
+        while True:
+            if self.applied_seq < self.durable_seq:
+                try:
+                    error = self.index_once(batch)
+                    transient = isinstance(error, OperationalError)  # Locked or busy database
+                except Exception as e:
+                    # e.g. an unreadable segment: no record is to blame
+                    error, transient = e, True
+                    self.stats['last_error'] = str(e)
+                    logger.error(f"Detection log indexing failed: {e}")
+                if error is None:
+                    failures = 0
+                    self.stalled_seq = None
+                    batch = min(batch * 2, batch_size)  # Grow back after bisecting past a bad record
+                    continue
+
+                self.stats['index_failures'] += 1
+                self.stalled_seq = self.applied_seq
+                if transient:
+                    pass  # The same batch goes through later
+                elif batch > 1:
+                    batch //= 2  # Bisect towards the record that fails
+                else:
+                    failures += 1
+                    if failures >= self.app.config['DETECTION_LOG_INDEX_RETRIES']:
+                        if self.quarantine(self.applied_seq, error):
+                            failures = 0
+                            continue
+                time.sleep(min(interval * 2 ** failures, 5.0))
+            elif not self.running and (self.flusher is None or not self.flusher.is_alive()):
+                break
+            else:
+                time.sleep(interval)
+
+    def _segment_for(self, seq):
+        """(first_seq, path, end_seq) of the segment holding seq"""
+        segments = self.segments()
+        for index, (first, path) in enumerate(segments):
+            end = segments[index + 1][0] if index + 1 < len(segments) else math.inf
+            if first <= seq < end:
+                return first, path, end
+        raise RuntimeError(f'Detection log record {seq} is missing (no segment holds it)')
+
+    def index_once(self, limit=None):
+        """Apply the next batch of durable records (at most limit); returns None, or the error if it failed"""
+        start = self.applied_seq
+        first, path, segment_end = self._segment_for(start)
+        end = min(self.durable_seq, start + (limit or self.app.config['DETECTION_LOG_INDEX_BATCH']), segment_end)
+        started = time.monotonic()
+
+        records, raw = read_segment(path, first, start, end)
+        rows, facts = [], []
+        for index, (timestamp_ms, code, raw_code, confidence, user_id, flags, _) in enumerate(records.tolist()):
+            if not record_ok(raw, index * RECORD.size):
+                self.stats['corrupt'] += 1
+                logger.error(f"Detection log record {start + index} fails its checksum; skipped")
+                continue
+            postal_code = code.decode('utf-8', 'replace')
+            is_valid = bool(flags & FLAG_VALID)
+            user_id = user_id or None
+            rows.append({
+                'postal_code': postal_code,
+                'raw_postal_code': raw_code.decode('utf-8', 'replace') if flags & FLAG_RAW_CODE else None,
+                'timestamp': timestamp_ms,  # EpochMillis passes integers through
+                'confidence': None if math.isnan(confidence) else confidence,
+                'user_id': user_id,
+                'is_valid': is_valid,
+                'region': region_of(postal_code) or None
+            })
+            facts.append(DetectionFacts(postal_code, from_epoch_ms(timestamp_ms), user_id, is_valid))
+
+        with self.app.app_context():
+            try:
+                if rows:
+                    db.session.execute(insert(Detection), rows)
+                    record_inserts(facts, datetime.now())
+                self._save_position(end)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.stats['last_error'] = str(e)
+                logger.error(f"Detection log indexing of records {start}-{end} failed: {e}")
+                return e
+
+        self.applied_seq = end
+        self.stats['indexed'] += len(rows)
+        self.stats['index_batches'] += 1
+        self.stats['last_index_ms'] = round((time.monotonic() - started) * 1000, 1)
+        if end == segment_end:
+            self._drop_applied_segments()
+        return None
+
+    def _save_position(self, applied_seq):
+        position = db.session.get(IngestLogPosition, POSITION_NAME)
+        if position is None:
+            position = IngestLogPosition(name=POSITION_NAME)
+            db.session.add(position)
+        position.applied_seq = applied_seq
+        position.updated_at = datetime.now()
+
+    def quarantine(self, seq, error):
+        """Copy record seq to quarantine.log and move the indexer past it; returns False if that failed"""
+        first, path, _ = self._segment_for(seq)
+        _, raw = read_segment(path, first, seq, seq + 1)
+        with self.app.app_context():
+            try:
+                with open(os.path.join(self.log_dir, QUARANTINE_NAME), 'ab') as quarantine:
+                    quarantine.write(struct.pack('<Q', seq) + raw)
+                    quarantine.flush()
+                    os.fsync(quarantine.fileno())
+                self._save_position(seq + 1)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Detection log record {seq} could not be quarantined: {e}")
+                return False
+
+        self.applied_seq = seq + 1
+        self.stats['quarantined'] += 1
+        logger.error(f"Detection log record {seq} keeps failing ({error}); moved to {QUARANTINE_NAME}")
+        return True
+
+    def _drop_applied_segments(self):
+        """Delete segments whose every record is applied (never the one being written)"""
+        segments = self.segments()
+        for (first, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first <= self.applied_seq and first != self.segment_first:
+                os.remove(path)
+
+    def to_dict(self):
+        return {
+            'next_seq': self.next_seq,
+            'durable_seq': self.durable_seq,
+            'applied_seq': self.applied_seq,
+            'backlog': self.backlog(),
+            'stalled_seq': self.stalled_seq,
+            'segments': len(self.segments()),
+            **self.stats
+        }
+
+# Global instance
+detection_log = DetectionLog()
@@ -0,0 +1,54 @@
+"""
+Detection Rows Module
+Lean Core query layer for detection listings: selects only the listed columns as
+tuples, with the timestamp left as stored epoch milliseconds, and builds the
+to_dict() shape for a whole page at once with bulk timestamp formatting
+"""
+
+from sqlalchemy import BigInteger, type_coerce
+from models import db, Detection
+from epoch_time import to_epoch_ms, format_epoch_ms
+
+# The raw column value: skips EpochMillis' per-row datetime conversion
+TIMESTAMP_MS = type_coerce(Detection.timestamp, BigInteger).label('timestamp_ms')
+
+LISTING_COLUMNS = (
+    Detection.id, Detection.postal_code, Detection.raw_postal_code, TIMESTAMP_MS,
+    Detection.confidence, Detection.user_id, Detection.is_valid, Detection.region, Detection.node_id
+)
+
+def listing_query(session=None):
+    """Detection query returning LISTING_COLUMNS rows instead of Detection objects"""
+    return (session or db.session).query(*LISTING_COLUMNS)
+
+def timestamp_ms_of(row):
+    """Epoch ms of a listing row or of a Detection (e.g. a transient archived one)"""
+    if isinstance(row, Detection):
+        return to_epoch_ms(row.timestamp) if row.timestamp else None
+    return row.timestamp_ms
+
+def _listing_tuple(row):
+    if not isinstance(row, Detection):
+        return row  # Already in LISTING_COLUMNS order
+    return (row.id, row.postal_code, row.raw_postal_code, timestamp_ms_of(row),
+            row.confidence, row.user_id, row.is_valid, row.region, row.node_id)
+
+def detection_dicts(rows):
+    """Detection.to_dict() for many listing rows (or Detections) at once"""
+    # Positional unpacking: attribute access by name on a Row costs more than building the dict
+    rows = [_listing_tuple(row) for row in rows]
+    stamps = format_epoch_ms([row[3] for row in rows])
+    return [{
+        'id': detection_id,
+        'code': code,
+        'raw_code': raw_code,
+        'timestamp': stamp,
+        'timestamp_ms': millis,
+        'confidence': confidence,
+        'user_id': user_id,
+        'is_valid': is_valid,
+        'region': region,
+        'node_id': node_id,
+        'corrected': raw_code is not None and raw_code != code
+    } for (detection_id, code, raw_code, millis, confidence, user_id, is_valid, region, node_id), stamp
+        in zip(rows, stamps)]
@@ -0,0 +1,262 @@
+"""
+Detection Statistics Module
+Keeps SystemStats, per-postal-code tallies and hourly rollups up to date incrementally,
+inside the caller's transaction, so no write path needs a DISTINCT scan
+and no chart needs to scan the detections table
+"""
+
+from collections import Counter, namedtuple
+from datetime import datetime
+from sqlalchemy import text
+from models import db, Detection, SystemStats, PostalCodeTally, DetectionRollup
+from tunisia_postal_codes import POSTAL_CODES
+from epoch_time import HOUR_MS, to_epoch_ms, from_epoch_ms, floor_hour
+
+# What the aggregates need to know about a detection
+DetectionFacts = namedtuple('DetectionFacts', 'postal_code timestamp user_id is_valid')
+FACT_COLUMNS = (Detection.postal_code, Detection.timestamp, Detection.user_id, Detection.is_valid)
+
+def facts_of(detection):
+    """Snapshot a Detection (e.g. before editing it)"""
+    return DetectionFacts(detection.postal_code, detection.timestamp, detection.user_id, detection.is_valid)
+
+def hour_bucket(timestamp):
+    # Same arithmetic as rebuild_rollups so both paths agree on bucket boundaries
+    return from_epoch_ms(floor_hour(to_epoch_ms(timestamp)))
+
+def region_of(postal_code):
+    """Region name for a postal code, '' when the code is not in the table"""
+    return POSTAL_CODES.get(postal_code, {}).get('region', '')
+
+def backfill_regions(conn, only_missing=True):
+    """Set detections.region from the postal table on a Core connection
+
+    With only_missing=False every row is recomputed (after editing tunisia_postal_codes.py).
+    Returns the number of rows updated.
+    """
+    condition = ' AND region IS NULL' if only_missing else ''
+    updated = conn.execute(
+        text(f'UPDATE detections SET region = :region WHERE postal_code = :code{condition}'),
+        [{'region': info['region'], 'code': code} for code, info in POSTAL_CODES.items()]
+    ).rowcount
+    if not only_missing:
+        placeholders = ', '.join(f':code{i}' for i in range(len(POSTAL_CODES)))
+        updated += conn.execute(
+            text(f'UPDATE detections SET region = NULL WHERE region IS NOT NULL AND postal_code NOT IN ({placeholders})'),
+            {f'code{i}': code for i, code in enumerate(POSTAL_CODES)}
+        ).rowcount
+    return updated
+
+def rollup_key(detection):
+    """Primary key of the rollup row a detection is counted in"""
+    return (hour_bucket(detection.timestamp), detection.user_id or 0,
+            region_of(detection.postal_code), bool(detection.is_valid))
+
+def get_or_create_stats(now=None):
+    """Return the SystemStats row, creating it in the current session if missing"""
+    stats = SystemStats.query.first()
+    if not stats:
+        now = now or datetime.now()
+        stats = SystemStats(
+            start_time=now,
+            total_detections=0,
+            unique_codes_count=0,
+            last_updated=now
+        )
+        db.session.add(stats)
+    return stats
+
+def _adjust_rollups(detections, sign):
+    counts = Counter(rollup_key(detection) for detection in detections if detection.timestamp)
+    for key, count in counts.items():
+        rollup = db.session.get(DetectionRollup, key)
+        if rollup is None:
+            if sign < 0:
+                continue
+            bucket_hour, user_id, region, is_valid = key
+            db.session.add(DetectionRollup(bucket_hour=bucket_hour, user_id=user_id, region=region,
+                                           is_valid=is_valid, count=count))
+        else:
+            rollup.count += sign * count
+            if rollup.count <= 0:
+                db.session.delete(rollup)
+
+def _load_tallies(codes, chunk_size=500):
+    """Tallies for many codes in a few IN queries instead of one lookup per code"""
+    codes = list(codes)
+    tallies = {}
+    for start in range(0, len(codes), chunk_size):
+        rows = PostalCodeTally.query.filter(PostalCodeTally.postal_code.in_(codes[start:start + chunk_size]))
+        tallies.update((tally.postal_code, tally) for tally in rows)
+    return tallies
+
+def record_inserts(detections, now=None):
+    """Account for new detections (Detection objects, facts or FACT_COLUMNS rows)"""
+    detections = list(detections)
+    counts = Counter(detection.postal_code for detection in detections)
+    if not counts:
+        return
+
+    _adjust_rollups(detections, +1)
+
+    stats = get_or_create_stats(now)
+    tallies = _load_tallies(counts)
+    new_codes = 0
+    for code, count in counts.items():
+        tally = tallies.get(code)
+        if tally is None:
+            db.session.add(PostalCodeTally(postal_code=code, count=count))
+            new_codes += 1
+        else:
+            if tally.count <= 0:
+                new_codes += 1
+            tally.count += count
+
+    stats.total_detections = (stats.total_detections or 0) + sum(counts.values())
+    stats.unique_codes_count = (stats.unique_codes_count or 0) + new_codes
+    stats.last_updated = now or datetime.now()
+
+def record_deletes(detections, now=None):
+    """Account for removed detections (Detection objects, facts or FACT_COLUMNS rows)"""
+    detections = list(detections)
+    counts = Counter(detection.postal_code for detection in detections)
+    if not counts:
+        return
+
+    _adjust_rollups(detections, -1)
+
+    stats = get_or_create_stats(now)
+    tallies = _load_tallies(counts)
+    removed_codes = 0
+    for code, count in counts.items():
+        tally = tallies.get(code)
+        if tally is None:
+            continue
+        tally.count -= count
+        if tally.count <= 0:
+            db.session.delete(tally)
+            removed_codes += 1
+
+    stats.total_detections = max(0, (stats.total_detections or 0) - sum(counts.values()))
+    stats.unique_codes_count = max(0, (stats.unique_codes_count or 0) - removed_codes)
+    stats.last_updated = now or datetime.now()
+
+def record_change(before, detection, now=None):
+    """Account for an edited detection; before is facts_of() taken prior to the edit"""
+    after = facts_of(detection)
+    if before.postal_code != after.postal_code:
+        _adjust_tallies_for_code_change(before.postal_code, after.postal_code, now)
+    if before.timestamp is None or after.timestamp is None or rollup_key(before) != rollup_key(after):
+        _adjust_rollups([before], -1)
+        _adjust_rollups([after], +1)
+
+def _adjust_tallies_for_code_change(old_code, new_code, now):
+    stats = get_or_create_stats(now)
+    old_tally = db.session.get(PostalCodeTally, old_code)
+    if old_tally is not None:
+        old_tally.count -= 1
+        if old_tally.count <= 0:
+            db.session.delete(old_tally)
+            stats.unique_codes_count = max(0, (stats.unique_codes_count or 0) - 1)
+
+    new_tally = db.session.get(PostalCodeTally, new_code)
+    if new_tally is None:
+        db.session.add(PostalCodeTally(postal_code=new_code, count=1))
+        stats.unique_codes_count = (stats.unique_codes_count or 0) + 1
+    else:
+        new_tally.count += 1
+    stats.last_updated = now or datetime.now()
+
+def unique_codes_count(session):
+    """Number of distinct postal codes detected (reads the small tally table); pass the read-only session for dashboards"""
+    return session.query(PostalCodeTally).count()
+
+def reset_tallies():
+    """Drop all tallies and rollups; used when every detection is deleted"""
+    PostalCodeTally.query.delete()
+    DetectionRollup.query.delete()
+
+def rebuild_stats(archived=()):
+    """Recompute tallies and SystemStats from the detections table (repair command)
+
+    archived: DetectionFacts lists for the archived rows (DetectionArchiver.archived_facts),
+    which the counts keep including; leaving them out would drop archived months from the stats.
+    """
+    counts = Counter(dict(
+        db.session.query(Detection.postal_code, db.func.count(Detection.id)).group_by(Detection.postal_code).all()))
+    for facts in archived:
+        counts.update(fact.postal_code for fact in facts)
+
+    PostalCodeTally.query.delete()
+    db.session.add_all(PostalCodeTally(postal_code=code, count=count) for code, count in counts.items())
+
+    stats = get_or_create_stats()
+    stats.total_detections = sum(counts.values())
+    stats.unique_codes_count = len(counts)
+    stats.last_updated = datetime.now()
+
+    db.session.commit()
+    return stats.total_detections, stats.unique_codes_count
+
+def rebuild_rollups(conn, archived=()):
+    """Recompute the hourly rollups from the detections table on a Core connection
+
+    Used by the migrations that create or convert the table and by manage_db.py rebuild-rollups;
+    archived is as for rebuild_stats. Returns the number of rollup rows written.
+    """
+    counts = Counter()
+    for facts in archived:
+        counts.update((floor_hour(to_epoch_ms(fact.timestamp)), fact.user_id or 0, region_of(fact.postal_code),
+                       bool(fact.is_valid)) for fact in facts)
+
+    conn.execute(DetectionRollup.__table__.delete())
+
+    # Timestamps are epoch ms, so the hour is integer arithmetic (text rows predate migration 009)
+    rows = conn.execute(text(
+        "SELECT timestamp - timestamp % :hour AS bucket, COALESCE(user_id, 0), "
+        "postal_code, is_valid, COUNT(*) FROM detections "
+        "WHERE typeof(timestamp) = 'integer' GROUP BY bucket, user_id, postal_code, is_valid"
+    ), {'hour': HOUR_MS})
+
+    for bucket, user_id, postal_code, is_valid, count in rows:
+        counts[(bucket, user_id, region_of(postal_code), bool(is_valid))] += count
+
+    if counts:
+        conn.execute(DetectionRollup.__table__.insert(), [
+            {'bucket_hour': bucket_hour, 'user_id': user_id, 'region': region, 'is_valid': is_valid, 'count': count}
+            for (bucket_hour, user_id, region, is_valid), count in counts.items()
+        ])
+    return len(counts)
+
+def hourly_counts_query(session, start, end, user_id=None):
+    """Query for (bucket_hour, is_valid, count) rollup rows between two datetimes (inclusive)"""
+    count = db.func.sum(DetectionRollup.count)
+    query = session.query(DetectionRollup.bucket_hour, DetectionRollup.is_valid, count).filter(
+        DetectionRollup.bucket_hour >= hour_bucket(start),
+        DetectionRollup.bucket_hour <= end
+    )
+    if user_id is not None:
+        query = query.filter(DetectionRollup.user_id == user_id)
+    return query.group_by(DetectionRollup.bucket_hour, DetectionRollup.is_valid)
+
+def hourly_counts(session, start, end, user_id=None):
+    """Rollup rows for a chart, regions summed; pass the read-only session for dashboard queries"""
+    return hourly_counts_query(session, start, end, user_id).all()
+
+def rollup_totals(session, user_id=None):
+    """(total, valid) detection counts summed from the rollups, optionally for one user"""
+    query = session.query(DetectionRollup.is_valid, db.func.sum(DetectionRollup.count))
+    if user_id is not None:
+        query = query.filter(DetectionRollup.user_id == user_id)
+    counts = dict(query.group_by(DetectionRollup.is_valid).all())
+    valid = counts.get(True, 0) or 0
+    return valid + (counts.get(False, 0) or 0), valid
+
+def region_counts(session, user_id=None):
+    """{region: count} of valid detections summed from the rollups ('' = not in the Tunisia table)"""
+    query = session.query(DetectionRollup.region, db.func.sum(DetectionRollup.count)).filter(
+        DetectionRollup.is_valid == True
+    )
+    if user_id is not None:
+        query = query.filter(DetectionRollup.user_id == user_id)
+    return {region: count for region, count in query.group_by(DetectionRollup.region) if count}
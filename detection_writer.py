@@ -0,0 +1,224 @@
+"""
+Detection Writer Module
+Group-commits detections from a queue so OCR and request threads never wait on SQLite
+"""
+
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+from sqlalchemy.exc import OperationalError
+from models import db, Detection
+from detection_stats import record_inserts, region_of
+from detection_log import detection_log
+
+logger = logging.getLogger(__name__)
+
+class DetectionEvent:
+    """A detection waiting to be written; callers may wait for its commit"""
+
+    def __init__(self, fields, waiting=False):
+        self.fields = fields
+        self.waiting = waiting
+        self.detection_id = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the batch holding this event is committed; returns the new detection ID"""
+        if not self.done.wait(timeout):
+            raise TimeoutError('Detection was not committed in time')
+        if self.error:
+            raise self.error
+        return self.detection_id
+
+class DetectionWriter:
+    """Background writer flushing queued detections every N rows or M milliseconds
+
+    Ingest paths (DETECTION_INGEST):
+        'log'   - append to the binary detection log; its indexer fills the table
+        'queue' - group commit from an in-memory queue, as below
+
+    Durability modes (DETECTION_WRITER_DURABILITY, queue path):
+        'batched'   - group commit; submit() returns before the row is on disk
+        'immediate' - one commit per detection, like the former inline writes
+    Any caller can still pass wait=True to block until its own row is committed
+    (on both paths this goes through the queue, which reports the new ID).
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.queue = queue.Queue()
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'batches': 0,
+            'failed': 0,
+            'retries': 0,
+            'row_fallbacks': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the writer with Flask app"""
+        self.app = app
+
+        app.config.setdefault('DETECTION_WRITER_BATCH_SIZE', 50)  # Flush after N rows
+        app.config.setdefault('DETECTION_WRITER_FLUSH_MS', 500)  # ... or after M milliseconds
+        app.config.setdefault('DETECTION_WRITER_DURABILITY', 'batched')
+        app.config.setdefault('DETECTION_WRITER_RETRIES', 3)  # Extra attempts while the database is locked
+        app.config.setdefault('DETECTION_WRITER_RETRY_MS', 100)  # First backoff, doubled per attempt
+        app.config.setdefault('DETECTION_INGEST', 'log')
+
+        app.extensions['detection_writer'] = self
+
+    @property
+    def batch_size(self):
+        if self.app.config['DETECTION_WRITER_DURABILITY'] == 'immediate':
+            return 1
+        return self.app.config['DETECTION_WRITER_BATCH_SIZE']
+
+    @property
+    def flush_interval(self):
+        return self.app.config['DETECTION_WRITER_FLUSH_MS'] / 1000.0
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='detection-writer')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the writer after flushing everything already queued"""
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+
+    def submit(self, wait=False, timeout=10.0, **fields):
+        """Accept a detection (Detection column values)
+
+        With wait=True, block until the row is committed and return its ID, on
+        either ingest path: the log indexer does not report IDs, so waiting
+        callers always go through the group-commit queue. Otherwise return None
+        as soon as the detection is queued or appended to the log.
+        """
+        if self.app.config['DETECTION_INGEST'] == 'log' and not wait:
+            detection_log.append(**fields)
+            return None
+
+        # Started lazily so the writer also runs under gunicorn, where __main__ is skipped
+        if not self.running:
+            self.start()
+
+        event = DetectionEvent(fields, waiting=wait)
+        self.queue.put(event)
+        self.stats['queued'] += 1
+
+        if wait:
+            return event.wait(timeout)
+        return None
+
+    def pending(self):
+        """Detections accepted but not yet in the table (queued or not yet indexed from the log)"""
+        return self.queue.qsize() + detection_log.backlog()
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            try:
+                first = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            # A caller blocked on its commit gets the batch flushed right away
+            while len(batch) < self.batch_size and not batch[-1].waiting:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """Write one batch; if it still fails after retries, write its rows one by one so only bad rows are lost"""
+        started = time.monotonic()
+        with self.app.app_context():
+            try:
+                error = self._write_with_retry(batch)
+                if error is not None and len(batch) > 1:
+                    logger.warning(f"Detection batch of {len(batch)} failed ({error}); writing rows one by one")
+                    self.stats['row_fallbacks'] += 1
+                    for event in batch:
+                        row_error = self._write_with_retry([event])
+                        if row_error is not None:
+                            self._fail(event, row_error)
+                elif error is not None:
+                    self._fail(batch[0], error)
+
+            finally:
+                self.stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 1)
+                for event in batch:
+                    event.done.set()
+
+    def _write_with_retry(self, events):
+        """Commit events in one transaction, backing off while the database is locked; returns the error if it fails"""
+        attempts = self.app.config['DETECTION_WRITER_RETRIES'] + 1
+        delay = self.app.config['DETECTION_WRITER_RETRY_MS'] / 1000.0
+        for attempt in range(attempts):
+            try:
+                self._write(events)
+                return None
+            except OperationalError as e:
+                db.session.rollback()
+                if attempt + 1 == attempts:
+                    return e
+                self.stats['retries'] += 1
+                time.sleep(delay * 2 ** attempt)
+            except Exception as e:
+                # A bad row: the same data would fail again
+                db.session.rollback()
+                return e
+
+    def _write(self, events):
+        """Insert events and the matching stats and rollup updates in a single transaction"""
+        detections = [Detection(**event.fields) for event in events]
+        for detection in detections:
+            if detection.region is None:
+                detection.region = region_of(detection.postal_code) or None
+        db.session.add_all(detections)
+
+        record_inserts(detections, datetime.now())
+
+        db.session.flush()
+        detection_ids = [detection.id for detection in detections]
+        db.session.commit()
+
+        for event, detection_id in zip(events, detection_ids):
+            event.detection_id = detection_id
+
+        self.stats['written'] += len(events)
+        self.stats['batches'] += 1
+        self.stats['last_batch_size'] = len(events)
+
+    def _fail(self, event, error):
+        logger.error(f"Detection {event.fields.get('postal_code')} could not be written: {error}")
+        self.stats['failed'] += 1
+        event.error = error
+
+# Global instance
+detection_writer = DetectionWriter()
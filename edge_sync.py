@@ -0,0 +1,433 @@
+"""
+Edge Sync Module
+Edge nodes push their detections to a central instance in gzip-compressed,
+idempotency-keyed batches read from the change feed, backing off while the
+central node is unreachable; the central node deduplicates batches and
+upserts rows per (node_id, source_epoch, source_id)
+"""
+
+import gzip
+import hmac
+import json
+import random
+import socket
+import threading
+import uuid
+import zlib
+import logging
+import urllib.error
+import urllib.request
+from datetime import datetime
+from flask import request, jsonify
+from sqlalchemy.exc import IntegrityError
+from models import db, Detection, IngestLogPosition, SyncBatch, ArchiveChunk
+from change_feed import fetch_changes, oldest_cursor
+from crud_routes import admin_required
+from detection_stats import record_inserts, record_deletes, record_change, facts_of, region_of
+from epoch_time import from_epoch_ms
+from detection_archive import detection_archiver, month_key
+
+logger = logging.getLogger(__name__)
+
+POSITION_NAME = 'edge_sync'
+INGEST_PATH = '/api/sync/batches'
+
+# Fields of a detection an edge node sends; ids, users and regions stay local
+SYNC_FIELDS = ('code', 'raw_code', 'timestamp_ms', 'confidence', 'is_valid')
+
+class SyncError(Exception):
+    """A batch the central node did not accept"""
+
+class BatchTooLarge(SyncError):
+    """A batch that inflates past SYNC_MAX_BATCH_BYTES"""
+
+def batch_record(change):
+    """The wire form of one compacted change-feed entry"""
+    record = {'seq': change['seq'], 'op': change['op'], 'source_id': change['detection_id']}
+    if change['detection'] is not None:
+        record['detection'] = {field: change['detection'][field] for field in SYNC_FIELDS}
+    return record
+
+class EdgeSync:
+    """Pushes this node's detections to the central instance"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.thread = None
+        self.running = False
+        self.wake = threading.Event()
+        self.lock = threading.Lock()  # One push at a time
+        self.failures = 0  # Consecutive; drives the backoff
+        self.stats = {
+            'batches': 0,
+            'changes': 0,
+            'bytes_sent': 0,
+            'failures': 0,
+            'last_push': None,
+            'last_error': None,
+            'retry_in_seconds': None
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize edge sync with Flask app"""
+        self.app = app
+
+        app.config.setdefault('SYNC_CENTRAL_URL', None)  # e.g. http://10.0.0.5:5000; unset = not an edge node
+        app.config.setdefault('SYNC_NODE_ID', socket.gethostname())
+        app.config.setdefault('SYNC_TOKEN', None)  # Shared secret; the central node rejects batches without it
+        app.config.setdefault('SYNC_BATCH_SIZE', 500)  # Change-feed rows per batch
+        app.config.setdefault('SYNC_INTERVAL_SECONDS', 10)
+        app.config.setdefault('SYNC_BACKOFF_SECONDS', 5)  # First retry; doubles per failure
+        app.config.setdefault('SYNC_BACKOFF_MAX_SECONDS', 300)
+        app.config.setdefault('SYNC_TIMEOUT_SECONDS', 30)
+        app.config.setdefault('SYNC_MAX_BATCH_BYTES', 16 * 1024 * 1024)  # Decompressed, on the central node
+
+        app.extensions['edge_sync'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.app is not None and self.app.config['SYNC_CENTRAL_URL'])
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.running = True
+        self.wake.clear()
+        self.thread = threading.Thread(target=self._run, name='edge-sync')
+        self.thread.daemon = True
+        self.thread.start()
+        print(f"📡 Edge sync: node {self.app.config['SYNC_NODE_ID']} -> {self.app.config['SYNC_CENTRAL_URL']}")
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def _run(self):
+        while self.running:
+            try:
+                while self.running and self.push_once():
+                    pass  # Drain the spool while the central node accepts
+                delay = self.app.config['SYNC_INTERVAL_SECONDS']
+            except Exception as e:
+                delay = self._record_failure(e)
+            self.wake.wait(delay)
+
+    def _record_failure(self, error):
+        """Count a failed push and return the jittered backoff before the next try"""
+        settings = self.app.config
+        self.failures += 1
+        backoff = min(settings['SYNC_BACKOFF_MAX_SECONDS'], settings['SYNC_BACKOFF_SECONDS'] * 2 ** (self.failures - 1))
+        # Jitter keeps a fleet of edge nodes from retrying in lockstep after an outage
+        delay = backoff * random.uniform(0.5, 1.0)
+        self.stats['failures'] += 1
+        self.stats['last_error'] = str(error)
+        self.stats['retry_in_seconds'] = round(delay, 1)
+        logger.warning(f"Edge sync push failed ({self.failures} in a row), retrying in {delay:.0f}s: {error}")
+        return delay
+
+    def pushed_cursor(self):
+        """Change-feed sequence number the central node has acknowledged (needs an app context)"""
+        position = db.session.get(IngestLogPosition, POSITION_NAME)
+        return position.applied_seq if position is not None else 0
+
+    def _position(self):
+        position = db.session.get(IngestLogPosition, POSITION_NAME)
+        if position is None:
+            position = IngestLogPosition(name=POSITION_NAME, applied_seq=0)
+            db.session.add(position)
+        return position
+
+    def sync_epoch(self):
+        """
+        Random id of this database's incarnation, created on first use (needs an app context)
+
+        Detection ids and change sequence numbers restart when the database is rebuilt
+        (init_db.py) or restored from a backup (backups drop the epoch), so the central
+        node tells incarnations apart by this id instead of trusting the numbers alone.
+        """
+        position = self._position()
+        if position.epoch is None:
+            position.epoch = uuid.uuid4().hex
+            position.updated_at = datetime.now()
+            db.session.commit()
+            logger.info(f"Edge sync: new sync epoch {position.epoch} from change {position.applied_seq}")
+        return position.epoch
+
+    def _save_cursor(self, seq):
+        position = self._position()
+        position.applied_seq = seq
+        position.updated_at = datetime.now()
+        db.session.commit()
+
+    def push_once(self):
+        """
+        Push the next batch of changes to the central node
+
+        The local detections table and its change feed are the spool: the cursor
+        only moves once the central node has acknowledged a batch, so nothing is
+        lost while it is unreachable and a retried batch is deduplicated there.
+
+        Returns:
+            bool: whether more changes are waiting
+        """
+        with self.lock, self.app.app_context():
+            epoch = self.sync_epoch()
+            since = pushed = self.pushed_cursor()
+            oldest = oldest_cursor(db.session)
+            if since < oldest:
+                # The feed was pruned past the cursor (manage_db.py prune-changes keeps unpushed rows)
+                logger.error(f"Edge sync cursor {since} is older than the change history; resuming at {oldest}")
+                since = oldest
+
+            feed = fetch_changes(db.session, since=since, limit=self.app.config['SYNC_BATCH_SIZE'])
+            # Rows this node received from others are not sent back
+            changes = [batch_record(change) for change in feed['changes']
+                       if change['detection'] is None or change['detection']['node_id'] is None]
+
+            if changes:
+                self._post({
+                    'node_id': self.app.config['SYNC_NODE_ID'],
+                    'epoch': epoch,
+                    'first_seq': since + 1,
+                    'last_seq': feed['next_cursor'],
+                    'changes': changes
+                })
+            if feed['next_cursor'] != pushed:
+                self._save_cursor(feed['next_cursor'])
+
+            self.failures = 0
+            self.stats['retry_in_seconds'] = None
+            return feed['has_more']
+
+    def _post(self, batch):
+        settings = self.app.config
+        body = gzip.compress(json.dumps(batch, separators=(',', ':')).encode('utf-8'))
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            # Same incarnation and range, same key: a retry after a lost response is recognized as a duplicate
+            'Idempotency-Key': f"{batch['node_id']}:{batch['epoch']}:{batch['first_seq']}-{batch['last_seq']}"
+        }
+        if settings['SYNC_TOKEN']:
+            headers['Authorization'] = f"Bearer {settings['SYNC_TOKEN']}"
+
+        url = settings['SYNC_CENTRAL_URL'].rstrip('/') + INGEST_PATH
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data=body, headers=headers, method='POST'),
+                                        timeout=settings['SYNC_TIMEOUT_SECONDS']) as response:
+                result = json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            raise SyncError(f"HTTP {e.code} from central: {e.read(500).decode('utf-8', 'replace')}")
+        except (urllib.error.URLError, OSError) as e:
+            raise SyncError(f"Central unreachable: {e}")
+
+        self.stats['batches'] += 1
+        self.stats['changes'] += len(batch['changes'])
+        self.stats['bytes_sent'] += len(body)
+        self.stats['last_push'] = datetime.now()
+        self.stats['last_error'] = None
+        return result
+
+    def _known_epoch(self):
+        position = db.session.get(IngestLogPosition, POSITION_NAME)
+        return position.epoch if position is not None else None
+
+    def to_dict(self):
+        settings = self.app.config
+        return {
+            'enabled': self.enabled,
+            'node_id': settings['SYNC_NODE_ID'],
+            'central_url': settings['SYNC_CENTRAL_URL'],
+            'epoch': self._known_epoch(),
+            'consecutive_failures': self.failures,
+            **self.stats,
+            'last_push': self.stats['last_push'].strftime("%Y-%m-%d %H:%M:%S") if self.stats['last_push'] else None
+        }
+
+# Global instance
+edge_sync = EdgeSync()
+
+# ------------------------------------------------------------------ central side
+
+def _decompress(data, limit):
+    """gunzip a request body without letting it inflate past limit bytes"""
+    decompressor = zlib.decompressobj(wbits=31)
+    body = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail:
+        raise BatchTooLarge(f'Batch is larger than {limit} bytes uncompressed')
+    return body
+
+def _detection_fields(record):
+    fields = record['detection']
+    code = str(fields['code'])
+    return {
+        'postal_code': code,
+        'raw_postal_code': fields.get('raw_code'),
+        'timestamp': from_epoch_ms(int(fields['timestamp_ms'])),
+        'confidence': fields.get('confidence'),
+        'is_valid': bool(fields.get('is_valid', True)),
+        'region': region_of(code) or None
+    }
+
+def _archived_source_ids(node_id, epoch, records):
+    """source_ids of records (missing from the hot table) whose row is in the archive"""
+    # A row first sent in this batch arrives as an insert, or as an update dated in a month not
+    # archived yet, so the common case never opens a chunk; deletes carry no date to narrow by
+    changed = [record for record in records if record['op'] != 'insert']
+    if not changed or not db.session.query(ArchiveChunk.month).first():
+        return set()
+    months = None
+    if all(record['op'] == 'update' for record in changed):
+        months = {month_key(from_epoch_ms(int(record['detection']['timestamp_ms']))) for record in changed}
+    return detection_archiver.synced_source_ids(
+        db.session, node_id, epoch, {int(record['source_id']) for record in changed}, months)
+
+def apply_batch(batch_key, batch, chunk_size=500):
+    """
+    Apply one edge batch in a single transaction
+
+    Inserts and updates become upserts on (node_id, epoch, source_id) and deletes remove
+    the node's row, so a replayed change is harmless; a replayed batch_key is skipped
+    outright. Rows of another epoch of the same node (an earlier incarnation of its
+    database) are never touched, and neither are rows this node has since archived:
+    the archive is read-only, so changes aimed at them are skipped and counted.
+
+    Returns:
+        dict: duplicate flag and inserted / updated / deleted / archived counts
+    """
+    node_id = batch['node_id']
+    epoch = batch.get('epoch', '')  # '' = synced before epochs existed
+    result = {'batch_key': batch_key, 'duplicate': False, 'inserted': 0, 'updated': 0, 'deleted': 0, 'archived': 0}
+    if db.session.get(SyncBatch, batch_key) is not None:
+        result['duplicate'] = True
+        return result
+
+    records = batch['changes']
+    source_ids = [int(record['source_id']) for record in records]
+    existing = {}
+    for start in range(0, len(source_ids), chunk_size):
+        existing.update((detection.source_id, detection) for detection in Detection.query.filter(
+            Detection.node_id == node_id, Detection.source_epoch == epoch,
+            Detection.source_id.in_(source_ids[start:start + chunk_size])))
+    archived = _archived_source_ids(node_id, epoch, [record for record in records if
+                                                     int(record['source_id']) not in existing])
+
+    inserted, deleted = [], []
+    for record in records:
+        source_id = int(record['source_id'])
+        detection = existing.get(source_id)
+        if source_id in archived:
+            result['archived'] += 1
+            continue
+        if record['op'] == 'delete':
+            if detection is not None:
+                deleted.append(facts_of(detection))
+                db.session.delete(detection)
+            continue
+        if detection is None:
+            detection = Detection(node_id=node_id, source_epoch=epoch, source_id=source_id, user_id=None,
+                                  **_detection_fields(record))
+            db.session.add(detection)
+            inserted.append(detection)
+        else:
+            before = facts_of(detection)
+            for name, value in _detection_fields(record).items():
+                setattr(detection, name, value)
+            record_change(before, detection)
+            result['updated'] += 1
+
+    record_inserts(inserted)
+    record_deletes(deleted)
+    db.session.add(SyncBatch(batch_key=batch_key, node_id=node_id, epoch=epoch, first_seq=batch['first_seq'],
+                             last_seq=batch['last_seq'], changes=len(records)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same batch committed concurrently (a retry racing a slow first attempt)
+        db.session.rollback()
+        if db.session.get(SyncBatch, batch_key) is None:
+            raise
+        result['duplicate'] = True
+        return result
+
+    result['inserted'] = len(inserted)
+    result['deleted'] = len(deleted)
+    return result
+
+def node_summary():
+    """Per edge node: batches received, last acknowledged sequence number and rows held"""
+    batches = db.session.query(
+        SyncBatch.node_id, db.func.count(SyncBatch.batch_key), db.func.max(SyncBatch.last_seq),
+        db.func.max(SyncBatch.received_at)
+    ).group_by(SyncBatch.node_id).all()
+    rows = dict(db.session.query(Detection.node_id, db.func.count(Detection.id)).filter(
+        Detection.node_id.isnot(None)).group_by(Detection.node_id).all())
+    return [{
+        'node_id': node_id,
+        'batches': count,
+        'last_seq': last_seq,
+        'last_received_at': received_at.strftime("%Y-%m-%d %H:%M:%S") if received_at else None,
+        'detections': rows.get(node_id, 0)
+    } for node_id, count, last_seq, received_at in batches]
+
+def _authorized(token):
+    supplied = request.headers.get('Authorization', '')
+    return hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+def register_sync_routes(app):
+    """Register the central node's batch ingest and node overview routes"""
+
+    @app.route(INGEST_PATH, methods=['POST'])
+    def sync_ingest_batch():
+        """POST: Apply a gzip JSON batch from an edge node (Idempotency-Key header required)"""
+        token = app.config['SYNC_TOKEN']
+        if not token:
+            return jsonify({'status': 'error', 'message': 'Sync ingest is disabled (SYNC_TOKEN is not set)'}), 403
+        if not _authorized(str(token)):
+            return jsonify({'status': 'error', 'message': 'Invalid sync token'}), 401
+
+        batch_key = request.headers.get('Idempotency-Key', '').strip()
+        if not batch_key or len(batch_key) > 200:
+            return jsonify({'status': 'error', 'message': 'Idempotency-Key header is required'}), 400
+
+        try:
+            body = request.get_data()
+            if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+                body = _decompress(body, app.config['SYNC_MAX_BATCH_BYTES'])
+            batch = json.loads(body)
+            node_id = batch.get('node_id')
+            if not isinstance(node_id, str) or not node_id or len(node_id) > 64:
+                raise SyncError('node_id must be a non-empty string of at most 64 characters')
+            epoch = batch.get('epoch', '')
+            if not isinstance(epoch, str) or len(epoch) > 36:
+                raise SyncError('epoch must be a string of at most 36 characters')
+            if not batch_key.startswith(f'{node_id}:{epoch}:' if epoch else f'{node_id}:'):
+                raise SyncError('Idempotency-Key does not belong to this node and epoch')
+        except BatchTooLarge as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 413
+        except SyncError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except (ValueError, AttributeError, zlib.error) as e:
+            return jsonify({'status': 'error', 'message': f'Malformed batch: {e}'}), 400
+
+        try:
+            result = apply_batch(batch_key, batch)
+            return jsonify({'status': 'success', **result})
+        except (KeyError, TypeError, ValueError) as e:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': f'Malformed batch: {e}'}), 400
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    @app.route('/api/sync/nodes', methods=['GET'])
+    @admin_required
+    def sync_nodes():
+        """GET: Edge nodes that have pushed batches to this instance"""
+        try:
+            return jsonify({'status': 'success', 'nodes': node_summary(), 'edge': edge_sync.to_dict()})
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
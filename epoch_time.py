@@ -0,0 +1,107 @@
+"""
+Epoch Time Module
+Detection times are stored as integer milliseconds since the Unix epoch (UTC);
+the application works with naive local datetimes, converted at the column type
+and when parsing API input
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy.types import TypeDecorator, BigInteger
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+EPOCH_MS_MIN_DIGITS = 11  # Shorter digit strings are compact ISO dates ("20240101"), not epoch ms
+
+def to_epoch_ms(value):
+    """Milliseconds since the epoch for a datetime (naive = local time)"""
+    if value.tzinfo is None:
+        value = value.astimezone()  # Attach the local offset
+    whole_seconds = int(value.replace(microsecond=0).timestamp())
+    return whole_seconds * 1000 + value.microsecond // 1000
+
+def from_epoch_ms(millis):
+    """Naive local datetime for milliseconds since the epoch"""
+    return datetime.fromtimestamp(millis // 1000).replace(microsecond=millis % 1000 * 1000)
+
+def floor_hour(millis):
+    return millis - millis % HOUR_MS
+
+_EPOCH = datetime(1970, 1, 1)
+_TWO_DIGITS = [f'{value:02d}' for value in range(60)]
+
+def _local_offset(hour_ms):
+    """Local UTC offset (ms) in force for the whole UTC hour, or None if it changes within it"""
+    first = from_epoch_ms(hour_ms) - _EPOCH
+    last = from_epoch_ms(hour_ms + HOUR_MS - 1000) - _EPOCH
+    offset = first // timedelta(milliseconds=1) - hour_ms
+    return offset if last // timedelta(milliseconds=1) - (hour_ms + HOUR_MS - 1000) == offset else None
+
+def format_epoch_ms(values, pattern="%Y-%m-%d %H:%M:%S"):
+    """
+    Local time strings for many epoch-ms values (None stays None)
+
+    The default pattern is built with integer arithmetic: one offset lookup per
+    distinct UTC hour and one date string per distinct day, instead of a datetime
+    and a strftime per value.
+    """
+    if pattern != "%Y-%m-%d %H:%M:%S":
+        return [None if millis is None else from_epoch_ms(millis).strftime(pattern) for millis in values]
+
+    offsets = {}
+    days = {}
+    digits = _TWO_DIGITS
+    formatted = []
+    for millis in values:
+        if millis is None:
+            formatted.append(None)
+            continue
+        hour = millis - millis % HOUR_MS
+        offset = offsets.get(hour, False)
+        if offset is False:
+            offset = offsets[hour] = _local_offset(hour)
+        if offset is None:
+            # A UTC offset change inside this hour
+            formatted.append(from_epoch_ms(millis).strftime(pattern))
+            continue
+        day, second = divmod((millis + offset) // 1000, 86400)
+        prefix = days.get(day)
+        if prefix is None:
+            prefix = days[day] = (_EPOCH + timedelta(days=day)).strftime("%Y-%m-%d ")
+        hours, second = divmod(second, 3600)
+        minutes, second = divmod(second, 60)
+        formatted.append(f"{prefix}{digits[hours]}:{digits[minutes]}:{digits[second]}")
+    return formatted
+
+def parse_timestamp(value):
+    """
+    Naive local datetime from API input: epoch milliseconds (a number, or a string of
+    at least EPOCH_MS_MIN_DIGITS digits) or an ISO 8601 string, with or without a UTC
+    offset; raises ValueError/TypeError
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return from_epoch_ms(int(value))
+    if isinstance(value, str) and value.strip().isdigit() and len(value.strip()) >= EPOCH_MS_MIN_DIGITS:
+        return from_epoch_ms(int(value))
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+class EpochMillis(TypeDecorator):
+    """Datetime column stored as UTC epoch milliseconds, so range scans compare integers"""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return to_epoch_ms(value)
+
+    def process_literal_param(self, value, dialect):
+        return 'NULL' if value is None else str(self.process_bind_param(value, dialect))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return from_epoch_ms(int(value))
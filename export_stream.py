@@ -0,0 +1,133 @@
+"""
+Export Streaming Module
+Streams detections and users as JSON, NDJSON or CSV in chunks (optionally gzipped),
+so an export's memory use does not depend on its size
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from models import Detection, User
+from detection_rows import LISTING_COLUMNS, detection_dicts
+from fast_json import dumps
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+EXPORT_CHUNK_SIZE = 1000
+
+DETECTION_FIELDS = ['id', 'code', 'raw_code', 'timestamp', 'timestamp_ms', 'confidence', 'user_id', 'is_valid', 'region', 'node_id', 'corrected']
+USER_FIELDS = ['id', 'username', 'role', 'is_approved', 'full_name', 'email', 'department', 'phone',
+               'address', 'bio', 'profile_updated_at', 'created_at', 'last_login', 'password_reset_at']
+USER_TIME_FIELDS = ('profile_updated_at', 'created_at', 'last_login', 'password_reset_at')
+
+def _format_time(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+def detection_export_statement(start=None, end=None, is_valid=None, user_id=None):
+    """Core select of the exported detection columns, newest first"""
+    statement = select(*LISTING_COLUMNS)
+    if start is not None:
+        statement = statement.where(Detection.timestamp >= start)
+    if end is not None:
+        statement = statement.where(Detection.timestamp <= end)
+    if is_valid is not None:
+        statement = statement.where(Detection.is_valid == is_valid)
+    if user_id is not None:
+        statement = statement.where(Detection.user_id == user_id)
+    return statement.order_by(Detection.timestamp.desc(), Detection.id.desc())
+
+def detection_records(rows):
+    """Same shape as Detection.to_dict(), for a chunk of plain rows (or archived Detections)"""
+    return detection_dicts(rows)
+
+def user_export_statement():
+    return select(*(getattr(User, field) for field in USER_FIELDS)).order_by(User.id)
+
+def user_record(row):
+    """Same shape as User.to_dict(), built from a plain row"""
+    record = {field: getattr(row, field) for field in USER_FIELDS}
+    for field in USER_TIME_FIELDS:
+        record[field] = _format_time(record[field])
+    return record
+
+def user_records(rows):
+    return [user_record(row) for row in rows]
+
+def iter_chunks(session, statement, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of rows from a server-side cursor, chunk_size rows at a time"""
+    result = session.execute(statement.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        yield partition
+
+def _encode_chunks(chunks, to_records, fields, fmt):
+    """Yield bytes for each chunk of rows in the requested format"""
+    count = 0
+    if fmt == 'json':
+        yield b'{"status": "success", "data": ['
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        yield buffer.getvalue().encode()
+
+    for rows in chunks:
+        records = to_records(rows)
+        if not records:
+            continue
+        if fmt == 'json':
+            # One serializer call per chunk: the list's brackets are dropped to continue the array
+            yield (b',' if count else b'') + dumps(records)[1:-1]
+        elif fmt == 'ndjson':
+            yield b''.join(dumps(record) + b'\n' for record in records)
+        else:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+            writer.writerows(records)
+            yield buffer.getvalue().encode()
+        count += len(records)
+
+    if fmt == 'json':
+        exported_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        yield f'], "count": {count}, "exported_at": "{exported_at}"}}'.encode()
+
+def _gzip(pieces):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(chunks, to_records, fields, fmt, filename, compress=False):
+    """
+    Build a streaming Response for an export
+
+    Args:
+        chunks: iterable of row lists (see iter_chunks)
+        to_records: list of rows -> list of dicts
+        fields: CSV column order
+        fmt: 'json', 'ndjson' or 'csv'
+        filename: download name without extension
+        compress: gzip the body as a .gz download
+    """
+    pieces = _encode_chunks(chunks, to_records, fields, fmt)
+    mimetype = EXPORT_FORMATS[fmt]
+    filename = f"{filename}.{fmt}"
+
+    if compress:
+        body = _gzip(pieces)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    else:
+        body = pieces
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    if fmt != 'json' or compress:
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -6,6 +6,7 @@ Crée les tables avec les nouveaux champs et un utilisateur admin par défaut
 
 from app_with_db import app
 from models import db, User, SystemStats
+from migrations import stamp_head
 from datetime import datetime
 
 def init_database():
@@ -22,6 +23,9 @@ def init_database():
         print("🏗️  Création des nouvelles tables...")
         db.create_all()
         
+        # Le schéma créé est déjà à jour : marquer toutes les migrations comme appliquées
+        stamp_head()
+        
         # Créer un utilisateur admin par défaut
         print("👤 Création de l'utilisateur admin par défaut...")
         admin_user = User(
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Database maintenance commands
+Usage: python manage_db.py <command>
+"""
+
+import argparse
+import sys
+from app_with_db import app
+from models import db
+from detection_stats import rebuild_stats, rebuild_rollups, backfill_regions
+from migrations import run_migrations, current_version, MIGRATIONS
+from query_plans import check_hot_queries
+from change_feed import prune_changes, change_triggers_suspended
+from postal_search import build_search_index
+from detection_archive import detection_archiver
+from db_backup import backup_manager
+from db_maintenance import maintenance_scheduler
+from edge_sync import edge_sync
+
+def cmd_rebuild_stats(args):
+    """Recompute per-postal-code tallies and SystemStats from the detections table and the archive"""
+    print("📊 Rebuilding detection statistics...")
+    with app.app_context():
+        total, unique = rebuild_stats(detection_archiver.archived_facts(db.session))
+    print(f"✅ Statistics rebuilt: {total} detections, {unique} unique postal codes")
+
+def cmd_rebuild_rollups(args):
+    """Recompute the hourly detection rollups behind the dashboard charts"""
+    print("📈 Rebuilding hourly detection rollups...")
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rows = rebuild_rollups(conn, detection_archiver.archived_facts(conn))
+    print(f"✅ Rollups rebuilt: {rows} hourly buckets")
+
+def cmd_backfill_regions(args):
+    """Set the region of each detection from the postal code table"""
+    print("🗺️  Backfilling detection regions...")
+    with app.app_context():
+        with db.engine.begin() as conn:
+            # Regions derive from postal codes, so feed consumers (and the edge sync) need no change rows
+            with change_triggers_suspended(conn):
+                updated = backfill_regions(conn, only_missing=not args.all)
+    print(f"✅ {updated} detection(s) updated")
+
+def cmd_prune_changes(args):
+    """Delete change-feed entries older than --keep-days"""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            # An edge node keeps the changes the central instance has not acknowledged yet
+            keep_after = edge_sync.pushed_cursor() if edge_sync.enabled else None
+            removed = prune_changes(conn, keep_days=args.keep_days, keep_after=keep_after)
+    print(f"🧹 {removed} change-feed entr{'y' if removed == 1 else 'ies'} older than {args.keep_days} days removed")
+
+def cmd_rebuild_search_index(args):
+    """Rebuild the FTS5 postal search table from tunisia_postal_codes.py"""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            indexed = build_search_index(conn)
+    if indexed is None:
+        print("⚠️  This SQLite build has no FTS5; place-name search falls back to the in-memory postal table")
+    else:
+        print(f"🔎 Search index rebuilt: {indexed} postal codes")
+
+def cmd_archive(args):
+    """Move whole months older than ARCHIVE_AFTER_DAYS from the detections table to the archive"""
+    if args.older_than_days is not None:
+        app.config['ARCHIVE_AFTER_DAYS'] = args.older_than_days
+    with app.app_context():
+        archived = detection_archiver.run_once()
+    total = sum(rows for _, rows in archived)
+    print(f"✅ {total} detection(s) archived from {len(archived)} month(s) into {app.config['ARCHIVE_DIR']}")
+
+def cmd_backup(args):
+    """Take an online backup of the database now and rotate old backups"""
+    backup = backup_manager.backup_now()
+    print(f"✅ Backup {backup['name']} written to {app.config['BACKUP_DIR']} ({backup['size_bytes']} bytes)")
+
+def cmd_verify_backups(args):
+    """Check every backup against its recorded sha256"""
+    backups = backup_manager.list_backups(verify=True)
+    failures = [backup for backup in backups if not backup['verified']]
+    for backup in backups:
+        print(f"{'✅' if backup['verified'] else '💥'} {backup['name']} ({backup['size_bytes']} bytes)")
+    if failures:
+        print(f"💥 {len(failures)} backup(s) do not match their checksum")
+        sys.exit(1)
+    print(f"✅ {len(backups)} backup(s) verified")
+
+def cmd_maintain(args):
+    """Run ANALYZE/optimize, incremental vacuum, a WAL checkpoint and a quick integrity check now"""
+    report = maintenance_scheduler.run_once()
+    before, after = report['before'], report['after']
+    print(f"📦 {before['file_bytes']} -> {after['file_bytes']} bytes, "
+          f"free pages {before['free_pages']} -> {after['free_pages']} (auto_vacuum: {after['auto_vacuum']})")
+    for name, result in report['tasks'].items():
+        print(f"   {name}: {result}")
+    if report['tasks']['quick_check']['result'] != 'ok':
+        sys.exit(1)
+
+def cmd_vacuum(args):
+    """Rebuild the database file with a full VACUUM and switch it to incremental auto-vacuum (stop the detector first)"""
+    with app.app_context():
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA auto_vacuum = {app.config['SQLITE_AUTO_VACUUM']}")
+            conn.exec_driver_sql("VACUUM")
+        report = maintenance_scheduler.size_report()
+    print(f"✅ Database vacuumed: {report['file_bytes']} bytes, auto_vacuum {report['auto_vacuum']}")
+
+def cmd_migrate(args):
+    """Apply pending schema migrations"""
+    with app.app_context():
+        db.create_all()
+        applied = run_migrations()
+        with db.engine.connect() as conn:
+            version = current_version(conn)
+    if applied:
+        print(f"✅ Applied {len(applied)} migration(s), schema is at version {version}")
+    else:
+        print(f"✅ Schema is up to date (version {version})")
+
+def cmd_status(args):
+    """Show applied and pending schema migrations"""
+    with app.app_context():
+        with db.engine.connect() as conn:
+            version = current_version(conn)
+    for number, description, _ in MIGRATIONS:
+        marker = '✅' if number <= version else '⏳'
+        print(f"{marker} {number:03d} {description}")
+
+def cmd_check_plans(args):
+    """EXPLAIN the hot detection queries; exit 1 if any falls back to a full table scan"""
+    with app.app_context():
+        results = check_hot_queries()
+
+    failures = 0
+    for result in results:
+        marker = '❌' if result['full_scan'] else '✅'
+        print(f"{marker} {result['name']}: {' | '.join(result['plan'])}")
+        failures += result['full_scan']
+
+    if failures:
+        print(f"💥 {failures} hot quer{'y' if failures == 1 else 'ies'} scan the whole detections table")
+        sys.exit(1)
+    print("✅ All hot queries use an index")
+
+def main():
+    parser = argparse.ArgumentParser(description="Postal code detector database commands")
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('rebuild-stats', help=cmd_rebuild_stats.__doc__).set_defaults(func=cmd_rebuild_stats)
+    subparsers.add_parser('rebuild-rollups', help=cmd_rebuild_rollups.__doc__).set_defaults(func=cmd_rebuild_rollups)
+    backfill = subparsers.add_parser('backfill-regions', help=cmd_backfill_regions.__doc__)
+    backfill.add_argument('--all', action='store_true', help='Recompute every row, not only those without a region')
+    backfill.set_defaults(func=cmd_backfill_regions)
+    prune = subparsers.add_parser('prune-changes', help=cmd_prune_changes.__doc__)
+    prune.add_argument('--keep-days', type=int, default=30, help='Days of changes to keep (default: 30)')
+    prune.set_defaults(func=cmd_prune_changes)
+    subparsers.add_parser('rebuild-search-index', help=cmd_rebuild_search_index.__doc__).set_defaults(func=cmd_rebuild_search_index)
+    archive = subparsers.add_parser('archive', help=cmd_archive.__doc__)
+    archive.add_argument('--older-than-days', type=int, help='Override ARCHIVE_AFTER_DAYS for this run')
+    archive.set_defaults(func=cmd_archive)
+    subparsers.add_parser('backup', help=cmd_backup.__doc__).set_defaults(func=cmd_backup)
+    subparsers.add_parser('verify-backups', help=cmd_verify_backups.__doc__).set_defaults(func=cmd_verify_backups)
+    subparsers.add_parser('maintain', help=cmd_maintain.__doc__).set_defaults(func=cmd_maintain)
+    subparsers.add_parser('vacuum', help=cmd_vacuum.__doc__).set_defaults(func=cmd_vacuum)
+    subparsers.add_parser('migrate', help=cmd_migrate.__doc__).set_defaults(func=cmd_migrate)
+    subparsers.add_parser('status', help=cmd_status.__doc__).set_defaults(func=cmd_status)
+    subparsers.add_parser('check-plans', help=cmd_check_plans.__doc__).set_defaults(func=cmd_check_plans)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    args.func(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
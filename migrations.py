@@ -0,0 +1,176 @@
+"""
+Database Migrations Module
+Versioned, forward-only schema migrations for existing databases
+(init_db.py builds a fresh database with create_all and stamps it as current)
+"""
+
+from datetime import datetime
+from sqlalchemy import inspect, text
+from models import db
+from detection_stats import rebuild_rollups, backfill_regions
+from change_feed import install_change_triggers, drop_change_triggers, change_triggers_suspended
+from postal_search import build_search_index
+from detection_archive import detection_archiver
+from analytics_replica import install_rollup_triggers
+
+def _column_names(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+def _add_column(conn, table, column, ddl):
+    if column not in _column_names(conn, table):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+def _create_missing_tables(conn):
+    db.metadata.create_all(bind=conn, checkfirst=True)
+
+def migration_001_raw_postal_code(conn):
+    _add_column(conn, 'detections', 'raw_postal_code', 'VARCHAR(10)')
+
+def migration_002_tallies_and_camera_profiles(conn):
+    _create_missing_tables(conn)
+    # Seed the tallies from existing detections
+    if conn.execute(text('SELECT COUNT(*) FROM postal_code_tallies')).scalar() == 0:
+        conn.execute(text(
+            'INSERT INTO postal_code_tallies (postal_code, count) '
+            'SELECT postal_code, COUNT(*) FROM detections GROUP BY postal_code'
+        ))
+
+def migration_003_detection_indexes(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_timestamp ON detections (timestamp)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_user_timestamp ON detections (user_id, timestamp)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_user_valid_code ON detections (user_id, is_valid, postal_code)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_valid_timestamp ON detections (is_valid, timestamp)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_postal_code ON detections (postal_code)'))
+
+def migration_004_detection_rollups(conn):
+    _create_missing_tables(conn)
+    rebuild_rollups(conn)
+
+def migration_005_detection_region(conn):
+    _add_column(conn, 'detections', 'region', 'VARCHAR(50)')
+    backfill_regions(conn)
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_valid_region ON detections (is_valid, region)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_user_valid_region ON detections (user_id, is_valid, region)'))
+
+def migration_006_change_feed(conn):
+    _create_missing_tables(conn)
+    install_change_triggers(conn)
+
+def migration_007_postal_search(conn):
+    # (postal_code, timestamp) serves exact and prefix lookups and keeps exact-code pages in time order
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_code_timestamp ON detections (postal_code, timestamp)'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_detections_postal_code'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_detections_region_timestamp ON detections (region, timestamp)'))
+    build_search_index(conn)
+
+def migration_008_archive_chunks(conn):
+    _create_missing_tables(conn)
+
+def migration_009_epoch_millis_timestamps(conn):
+    # Text datetimes become UTC epoch ms; they were written with datetime.now(), i.e. local time.
+    # The values the API shows do not change, so the rewrite is kept out of the change feed.
+    drop_change_triggers(conn)
+    conn.execute(text(
+        "UPDATE detections SET timestamp = "
+        "CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER) "
+        "WHERE typeof(timestamp) = 'text'"
+    ))
+    install_change_triggers(conn)
+    # Months archived since migration 008 stay counted
+    rebuild_rollups(conn, detection_archiver.archived_facts(conn))
+
+def migration_010_ingest_log_positions(conn):
+    _create_missing_tables(conn)
+
+def migration_011_edge_sync(conn):
+    _add_column(conn, 'detections', 'node_id', 'VARCHAR(64)')
+    _add_column(conn, 'detections', 'source_id', 'INTEGER')
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_detections_node_source ON detections (node_id, source_id)'))
+    _create_missing_tables(conn)
+
+def migration_012_change_feed_columns_and_epoch_millis(conn):
+    # Recreate the update trigger limited to consumer-visible columns, and move changed_at to UTC epoch ms
+    with change_triggers_suspended(conn):
+        conn.execute(text(
+            "UPDATE detection_changes SET changed_at = "
+            "CAST(ROUND((julianday(changed_at, 'utc') - 2440587.5) * 86400000) AS INTEGER) "
+            "WHERE typeof(changed_at) = 'text'"
+        ))
+
+def migration_013_sync_epochs(conn):
+    _add_column(conn, 'ingest_log_positions', 'epoch', 'VARCHAR(36)')
+    _add_column(conn, 'sync_batches', 'epoch', 'VARCHAR(36)')
+    _add_column(conn, 'detections', 'source_epoch', 'VARCHAR(36)')
+    conn.execute(text('DROP INDEX IF EXISTS ix_detections_node_source'))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_detections_node_epoch_source ON detections (node_id, source_epoch, source_id)'
+    ))
+    # Batches and rows synced so far belong to the existing incarnations: '' keeps both sides matching
+    conn.execute(text("UPDATE ingest_log_positions SET epoch = '' WHERE name = 'edge_sync' AND epoch IS NULL"))
+    conn.execute(text("UPDATE detections SET source_epoch = '' WHERE node_id IS NOT NULL AND source_epoch IS NULL"))
+
+def migration_014_rollup_changes(conn):
+    _create_missing_tables(conn)
+    install_rollup_triggers(conn)
+
+# (version, description, function) - append only, never renumber
+MIGRATIONS = [
+    (1, 'Add raw_postal_code to detections', migration_001_raw_postal_code),
+    (2, 'Create postal_code_tallies and camera_profiles', migration_002_tallies_and_camera_profiles),
+    (3, 'Add indexes for detection hot query paths', migration_003_detection_indexes),
+    (4, 'Create and backfill hourly detection_rollups', migration_004_detection_rollups),
+    (5, 'Add and backfill region on detections', migration_005_detection_region),
+    (6, 'Create detection_changes and its change-feed triggers', migration_006_change_feed),
+    (7, 'Add postal code search indexes and the FTS5 postal table', migration_007_postal_search),
+    (8, 'Create archive_chunks for the cold detection tier', migration_008_archive_chunks),
+    (9, 'Store detection and rollup times as UTC epoch milliseconds', migration_009_epoch_millis_timestamps),
+    (10, 'Create ingest_log_positions for the detection log indexer', migration_010_ingest_log_positions),
+    (11, 'Add node attribution to detections and create sync_batches', migration_011_edge_sync),
+    (12, 'Limit the change-feed update trigger to visible columns; changed_at as epoch ms', migration_012_change_feed_columns_and_epoch_millis),
+    (13, 'Attribute synced batches and rows to the edge database sync epoch', migration_013_sync_epochs),
+    (14, 'Create rollup_changes and its triggers for the incremental analytics replica', migration_014_rollup_changes),
+]
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'
+    ))
+
+def current_version(conn):
+    _ensure_version_table(conn)
+    return conn.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
+
+def _record(conn, version, description):
+    conn.execute(
+        text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)'),
+        {'version': version, 'description': description, 'applied_at': datetime.now()}
+    )
+
+def run_migrations(engine=None):
+    """Apply pending migrations, each in its own transaction; returns the versions applied"""
+    engine = engine or db.engine
+    applied = []
+
+    with engine.begin() as conn:
+        version = current_version(conn)
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            _record(conn, number, description)
+        applied.append(number)
+        print(f"🛠️  Migration {number:03d} applied: {description}")
+
+    return applied
+
+def stamp_head(engine=None):
+    """Mark every migration as applied (for a database just built with create_all)"""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        version = current_version(conn)
+        for number, description, _ in MIGRATIONS:
+            if number > version:
+                _record(conn, number, description)
@@ -1,6 +1,8 @@
+import json
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from epoch_time import EpochMillis, to_epoch_ms
 
 db = SQLAlchemy()
 
@@ -52,22 +54,44 @@ class User(db.Model):
 
 class Detection(db.Model):
     __tablename__ = 'detections'
+    __table_args__ = (
+        # Matched to the hot query shapes; existing databases get them through migrations.py
+        db.Index('ix_detections_timestamp', 'timestamp'),
+        db.Index('ix_detections_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_detections_user_valid_code', 'user_id', 'is_valid', 'postal_code'),
+        db.Index('ix_detections_valid_timestamp', 'is_valid', 'timestamp'),
+        db.Index('ix_detections_code_timestamp', 'postal_code', 'timestamp'),
+        db.Index('ix_detections_region_timestamp', 'region', 'timestamp'),
+        db.Index('ix_detections_valid_region', 'is_valid', 'region'),
+        db.Index('ix_detections_user_valid_region', 'user_id', 'is_valid', 'region'),
+        db.Index('ix_detections_node_epoch_source', 'node_id', 'source_epoch', 'source_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     postal_code = db.Column(db.String(10), nullable=False)  # Augmenté pour codes non-tunisiens
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(EpochMillis, default=datetime.now)  # UTC epoch ms in the table, local datetime in Python
     confidence = db.Column(db.Float, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     is_valid = db.Column(db.Boolean, default=True)  # NOUVEAU: Marque si le code postal est valide
+    raw_postal_code = db.Column(db.String(10), nullable=True)  # Code as read by OCR before misread correction
+    region = db.Column(db.String(50), nullable=True)  # Governorate from the postal table, set on insert; NULL if unknown
+    node_id = db.Column(db.String(64), nullable=True)  # Edge node the row was synced from; NULL = detected here
+    source_id = db.Column(db.Integer, nullable=True)  # The row's id on that edge node
+    source_epoch = db.Column(db.String(36), nullable=True)  # Sync epoch (database incarnation) of that edge node
     
     def to_dict(self):
         return {
             'id': self.id,
             'code': self.postal_code,
+            'raw_code': self.raw_postal_code,
             'timestamp': self.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            'timestamp_ms': to_epoch_ms(self.timestamp),
             'confidence': self.confidence,
             'user_id': self.user_id,
-            'is_valid': self.is_valid  # NOUVEAU: Inclure le statut de validité
+            'is_valid': self.is_valid,  # NOUVEAU: Inclure le statut de validité
+            'region': self.region,
+            'node_id': self.node_id,
+            'corrected': self.raw_postal_code is not None and self.raw_postal_code != self.postal_code
         }
 
 class SystemStats(db.Model):
@@ -85,4 +109,110 @@ class SystemStats(db.Model):
             'total_detections': self.total_detections,
             'unique_codes_count': self.unique_codes_count,
             'last_updated': self.last_updated.strftime("%Y-%m-%d %H:%M:%S")
-        } 
\ No newline at end of file
+        }
+
+
+class CameraProfile(db.Model):
+    __tablename__ = 'camera_profiles'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    camera_id = db.Column(db.Integer, unique=True, nullable=False)
+    roi_polygon = db.Column(db.Text, nullable=True)  # JSON list of [x, y] points in frame pixels
+    perspective_quad = db.Column(db.Text, nullable=True)  # JSON list of 4 [x, y] label corners (TL, TR, BR, BL)
+    output_width = db.Column(db.Integer, nullable=True)  # Rectified size, derived from the quad if empty
+    output_height = db.Column(db.Integer, nullable=True)
+    deskew_angle = db.Column(db.Float, default=0.0)  # Degrees, counter-clockwise
+    enabled = db.Column(db.Boolean, default=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'camera_id': self.camera_id,
+            'roi_polygon': json.loads(self.roi_polygon) if self.roi_polygon else None,
+            'perspective_quad': json.loads(self.perspective_quad) if self.perspective_quad else None,
+            'output_width': self.output_width,
+            'output_height': self.output_height,
+            'deskew_angle': self.deskew_angle,
+            'enabled': self.enabled,
+            'updated_at': self.updated_at.strftime("%Y-%m-%d %H:%M:%S") if self.updated_at else None
+        }
+
+class PostalCodeTally(db.Model):
+    __tablename__ = 'postal_code_tallies'
+    
+    postal_code = db.Column(db.String(10), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class DetectionRollup(db.Model):
+    __tablename__ = 'detection_rollups'
+    __table_args__ = (
+        db.Index('ix_detection_rollups_user_bucket', 'user_id', 'bucket_hour'),
+    )
+    
+    bucket_hour = db.Column(EpochMillis, primary_key=True)  # Detection time truncated to the hour
+    user_id = db.Column(db.Integer, primary_key=True, default=0)  # 0 = no user (camera detections)
+    region = db.Column(db.String(50), primary_key=True, default='')  # '' = not in the Tunisia table
+    is_valid = db.Column(db.Boolean, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class RollupChange(db.Model):
+    __tablename__ = 'rollup_changes'
+    
+    bucket_hour = db.Column(EpochMillis, primary_key=True, autoincrement=False)  # An hour whose rollups changed
+    seq = db.Column(db.Integer, nullable=False, index=True)  # Raised on each change, by triggers on detection_rollups
+
+class DetectionChange(db.Model):
+    __tablename__ = 'detection_changes'
+    
+    # AUTOINCREMENT keeps sequence numbers monotonic even after old rows are pruned
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    detection_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # insert / update / delete; written by SQLite triggers
+    changed_at = db.Column(EpochMillis, nullable=False)  # UTC epoch ms, set by the triggers
+    
+    __table_args__ = {'sqlite_autoincrement': True}
+
+class ArchiveChunk(db.Model):
+    __tablename__ = 'archive_chunks'
+    
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    path = db.Column(db.String(255), nullable=False)  # .npz file, relative to ARCHIVE_DIR
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    min_timestamp = db.Column(db.DateTime, nullable=False)
+    max_timestamp = db.Column(db.DateTime, nullable=False)
+    min_id = db.Column(db.Integer, nullable=False)
+    max_id = db.Column(db.Integer, nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'path': self.path,
+            'row_count': self.row_count,
+            'min_timestamp': self.min_timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            'max_timestamp': self.max_timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+            'size_bytes': self.size_bytes,
+            'updated_at': self.updated_at.strftime("%Y-%m-%d %H:%M:%S") if self.updated_at else None
+        }
+
+class IngestLogPosition(db.Model):
+    __tablename__ = 'ingest_log_positions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    applied_seq = db.Column(db.Integer, nullable=False, default=0)  # detection_log: records [0, applied_seq) are in detections; edge_sync: last change seq acknowledged by central
+    epoch = db.Column(db.String(36), nullable=True)  # edge_sync: random id of this database incarnation; NULL = not chosen yet
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class SyncBatch(db.Model):
+    __tablename__ = 'sync_batches'
+    
+    batch_key = db.Column(db.String(200), primary_key=True)  # Idempotency key sent by the edge node
+    node_id = db.Column(db.String(64), nullable=False, index=True)
+    epoch = db.Column(db.String(36), nullable=True)  # Sync epoch of the edge database that sent it
+    first_seq = db.Column(db.Integer, nullable=False)  # Change-feed range on the edge node
+    last_seq = db.Column(db.Integer, nullable=False)
+    changes = db.Column(db.Integer, nullable=False, default=0)
+    received_at = db.Column(db.DateTime, default=datetime.now)
@@ -0,0 +1,142 @@
+"""
+OCR Watchdog Module
+Per-cycle deadline budgets and a watchdog that restarts a stuck OCR worker
+"""
+
+import os
+import signal
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CycleDeadline:
+    """Deadline for one scan cycle, split across pipeline stages
+
+    Each stage ends at the cycle start plus the cumulative share of the stages
+    up to and including it, so time left over by a fast stage rolls forward.
+    """
+
+    def __init__(self, total_seconds, stage_budgets):
+        self.total_seconds = total_seconds
+        self.start = time.monotonic()
+        self.stage_ends = {}
+
+        cumulative = 0.0
+        for stage, share in stage_budgets.items():
+            cumulative += share
+            self.stage_ends[stage] = self.start + min(cumulative, 1.0) * total_seconds
+
+    def remaining(self, stage=None):
+        """Seconds left for the stage (or for the whole cycle)"""
+        if stage is None:
+            end = self.start + self.total_seconds
+        else:
+            end = self.stage_ends.get(stage, self.start + self.total_seconds)
+        return end - time.monotonic()
+
+    def expired(self, stage=None):
+        return self.remaining(stage) <= 0
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+class OCRWatchdog:
+    """Runs the OCR worker thread and restarts it when it stops making progress"""
+
+    def __init__(self, timeout=10, check_interval=1.0):
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.generation = 0
+        self.last_heartbeat = time.monotonic()
+        self.target = None
+        self.worker = None
+        self.monitor = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.stats = {
+            'cycles': 0,
+            'deadline_misses': 0,
+            'ocr_timeouts': 0,
+            'stage_overruns': 0,
+            'watchdog_restarts': 0,
+            'killed_ocr_processes': 0,
+            'last_cycle_seconds': 0.0
+        }
+
+    def start(self, target):
+        """Start target(generation) in a worker thread and begin monitoring it"""
+        self.target = target
+        self.running = True
+        self._spawn_worker()
+
+        self.monitor = threading.Thread(target=self._monitor_loop, name='ocr-watchdog')
+        self.monitor.daemon = True
+        self.monitor.start()
+
+    def stop(self):
+        self.running = False
+
+    def heartbeat(self):
+        """Called by the worker on every loop iteration"""
+        self.last_heartbeat = time.monotonic()
+
+    def is_current(self, generation):
+        """Workers exit as soon as a newer generation replaces them"""
+        return self.running and generation == self.generation
+
+    def is_healthy(self):
+        return self.running and (time.monotonic() - self.last_heartbeat) < self.timeout
+
+    def record_cycle(self, deadline, missed):
+        self.stats['cycles'] += 1
+        self.stats['last_cycle_seconds'] = round(deadline.elapsed(), 3)
+        if missed:
+            self.stats['deadline_misses'] += 1
+
+    def _spawn_worker(self):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.last_heartbeat = time.monotonic()
+            self.worker = threading.Thread(target=self.target, args=(generation,), name=f'ocr-worker-{generation}')
+            self.worker.daemon = True
+            self.worker.start()
+
+    def _monitor_loop(self):
+        while self.running:
+            time.sleep(self.check_interval)
+            stalled_for = time.monotonic() - self.last_heartbeat
+            if stalled_for < self.timeout:
+                continue
+
+            logger.warning(f"OCR worker stalled for {stalled_for:.1f}s, restarting")
+            killed = self._kill_ocr_processes()
+            self.stats['killed_ocr_processes'] += killed
+            self.stats['watchdog_restarts'] += 1
+            self._spawn_worker()
+
+    def _kill_ocr_processes(self):
+        """Kill tesseract processes started by this process (Linux /proc only)"""
+        if not os.path.isdir('/proc'):
+            return 0
+
+        killed = 0
+        my_pid = os.getpid()
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as stat_file:
+                    stat = stat_file.read()
+                # The command name is in parentheses and may contain spaces
+                command = stat[stat.index('(') + 1:stat.rindex(')')]
+                parent_pid = int(stat[stat.rindex(')') + 2:].split()[1])
+                if parent_pid == my_pid and command.startswith('tesseract'):
+                    os.kill(int(entry), signal.SIGKILL)
+                    killed += 1
+            except (OSError, ValueError, IndexError):
+                continue
+
+        return killed
@@ -0,0 +1,126 @@
+"""
+Pagination Module
+Keyset (cursor) pagination on (timestamp, id) for detection listings,
+so a page costs the same whether it is the first or the ten-thousandth
+"""
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_, literal
+from models import Detection
+from detection_archive import detection_archiver
+from sqlite_profile import read_session
+from detection_rows import timestamp_ms_of
+from epoch_time import to_epoch_ms
+
+def encode_cursor(direction, detection):
+    """Opaque token pointing just past a detection or listing row ('n' = older rows, 'p' = newer rows)"""
+    # Epoch ms, like the column: a local time string is ambiguous in the DST fall-back hour
+    payload = json.dumps([direction, timestamp_ms_of(detection), detection.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Return (direction, timestamp_ms, id); raises ValueError for a malformed token"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, timestamp, detection_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        if isinstance(timestamp, str):
+            timestamp = to_epoch_ms(datetime.fromisoformat(timestamp))  # Cursor issued before the epoch ms format
+        elif isinstance(timestamp, bool) or not isinstance(timestamp, int):
+            raise ValueError(timestamp)
+        return direction, timestamp, int(detection_id)
+    except Exception:
+        raise ValueError('Invalid pagination cursor')
+
+class KeysetPage:
+    """One page of detections, newest first"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        return {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+            'total': self.total,
+            'total_is_estimate': self.total_is_estimate
+        }
+
+def keyset_paginate(query, cursor=None, per_page=50, total=None, total_is_estimate=False, archive_filters=None):
+    """
+    Page through a Detection query ordered by (timestamp, id) descending
+
+    Args:
+        query: Detection (or detection_rows.listing_query) query with filters applied and no ordering
+        cursor: token from a previous page's next_cursor/prev_cursor (None = first page)
+        per_page: page size
+        total: optional row count computed by the caller (cheap or estimated)
+        archive_filters: the same filters as a dict, to merge in archived detections
+            (see detection_archive.ArchivedChunk.mask); None = hot table only
+
+    Returns:
+        KeysetPage
+    """
+    key = tuple_(Detection.timestamp, Detection.id)
+    direction = 'n'
+    decoded = None
+
+    if cursor:
+        decoded = direction, timestamp_ms, detection_id = decode_cursor(cursor)
+        # Typed like the column so the integer binds as is and compares with the stored epoch ms
+        bound = tuple_(literal(timestamp_ms, Detection.timestamp.type), detection_id)
+        if direction == 'n':
+            query = query.filter(key < bound)
+        else:
+            query = query.filter(key > bound)
+
+    if direction == 'n':
+        query = query.order_by(Detection.timestamp.desc(), Detection.id.desc())
+    else:
+        query = query.order_by(Detection.timestamp.asc(), Detection.id.asc())
+
+    # One extra row tells whether another page exists in this direction
+    rows = query.limit(per_page + 1).all()
+
+    if archive_filters is not None:
+        archived = detection_archiver.page(read_session(), archive_filters, decoded, per_page + 1)
+        if archived:
+            rows = sorted(rows + archived, key=lambda row: (timestamp_ms_of(row), row.id), reverse=(direction == 'n'))
+            rows = rows[:per_page + 1]
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if direction == 'p':
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = cursor is not None, more
+
+    return KeysetPage(
+        rows,
+        per_page,
+        next_cursor=encode_cursor('n', rows[-1]) if rows and has_older else None,
+        prev_cursor=encode_cursor('p', rows[0]) if rows and has_newer else None,
+        total=total,
+        total_is_estimate=total_is_estimate
+    )
@@ -0,0 +1,136 @@
+"""
+Postal Code Misread Correction
+Resolves OCR misreads (8/3/6/0, 1/7, ...) to the most likely valid Tunisia postal code
+"""
+
+from tunisia_postal_codes import POSTAL_CODES
+
+# Probability that OCR reads the second digit when the first one is printed
+DIGIT_CONFUSIONS = {
+    '8': {'3': 0.08, '6': 0.07, '0': 0.06, '9': 0.03},
+    '3': {'8': 0.08, '9': 0.02},
+    '6': {'8': 0.06, '0': 0.05, '5': 0.03},
+    '0': {'8': 0.05, '6': 0.05, '9': 0.02},
+    '9': {'8': 0.03, '0': 0.02},
+    '5': {'6': 0.03},
+    '1': {'7': 0.10, '4': 0.02},
+    '7': {'1': 0.10},
+    '4': {'1': 0.02},
+}
+
+# Probability of any other digit substitution (not a known confusion)
+OTHER_SUBSTITUTION = 0.001
+
+# Prior probability that a correctly read code is simply not in the table
+UNLISTED_CODE_PRIOR = 0.2
+
+# At most this many digits may be changed by a correction
+MAX_CORRECTED_DIGITS = 2
+
+# Corrections above this probability are accepted immediately
+CORRECTION_ACCEPT_PROBABILITY = 0.9
+
+# Corrections above this probability are accepted once seen on two consecutive reads
+CORRECTION_CONFIRM_PROBABILITY = 0.6
+
+def _error_scale(confidence):
+    """Scale confusion probabilities by OCR confidence (0-100); 50 leaves them unchanged"""
+    if confidence is None:
+        return 1.0
+    return min(2.0, max(0.1, (100.0 - float(confidence)) / 50.0))
+
+def _read_probability(printed, read, scale):
+    """Probability of reading `read` when `printed` is on the label"""
+    confusions = DIGIT_CONFUSIONS.get(printed, {})
+    if printed == read:
+        return max(0.0, 1.0 - scale * (sum(confusions.values()) + 8 * OTHER_SUBSTITUTION))
+    return scale * confusions.get(read, OTHER_SUBSTITUTION)
+
+def rank_corrections(raw_code, confidence=None, postal_codes=POSTAL_CODES):
+    """
+    Rank valid postal codes that could have been misread as raw_code
+
+    Args:
+        raw_code (str): 4-digit code as read by OCR
+        confidence (float): OCR confidence (0-100), None if unknown
+        postal_codes (dict): Table of valid postal codes
+
+    Returns:
+        list: (postal_code, probability) tuples, most likely first. raw_code itself
+              is listed when it is valid; the remaining probability mass belongs to
+              "raw_code was read correctly but is not in the table".
+    """
+    if not raw_code or len(raw_code) != 4 or not raw_code.isdigit():
+        return []
+
+    scale = _error_scale(confidence)
+    valid_prior = (1.0 - UNLISTED_CODE_PRIOR) / max(1, len(postal_codes))
+    unlisted_prior = UNLISTED_CODE_PRIOR / max(1, 9000 - len(postal_codes))
+
+    # Hypothesis: the code was read correctly and is genuinely not in the table
+    as_read = unlisted_prior
+    for digit in raw_code:
+        as_read *= _read_probability(digit, digit, scale)
+
+    candidates = []
+    for code in postal_codes:
+        if len(code) != 4:
+            continue
+        changed = sum(1 for printed, read in zip(code, raw_code) if printed != read)
+        if changed > MAX_CORRECTED_DIGITS:
+            continue
+
+        likelihood = valid_prior
+        for printed, read in zip(code, raw_code):
+            likelihood *= _read_probability(printed, read, scale)
+        if likelihood > 0:
+            candidates.append((code, likelihood))
+
+    total = as_read + sum(likelihood for _, likelihood in candidates)
+    if total <= 0:
+        return []
+
+    ranked = [(code, likelihood / total) for code, likelihood in candidates]
+    ranked.sort(key=lambda item: item[1], reverse=True)
+    return ranked
+
+class MisreadResolver:
+    """Accepts likely corrections immediately and plausible ones after a repeated read"""
+
+    def __init__(self, accept_probability=CORRECTION_ACCEPT_PROBABILITY,
+                 confirm_probability=CORRECTION_CONFIRM_PROBABILITY):
+        self.accept_probability = accept_probability
+        self.confirm_probability = confirm_probability
+        self.pending = None
+
+    def resolve(self, raw_code, confidence=None):
+        """
+        Resolve an invalid code read by OCR
+
+        Returns:
+            tuple: (corrected_code, probability); corrected_code is None when no
+                   correction is accepted yet
+        """
+        ranked = rank_corrections(raw_code, confidence)
+        if not ranked:
+            self.pending = None
+            return None, 0.0
+
+        best_code, probability = ranked[0]
+        if best_code == raw_code:
+            self.pending = None
+            return None, probability
+
+        if probability >= self.accept_probability:
+            self.pending = None
+            return best_code, probability
+
+        if probability >= self.confirm_probability:
+            if self.pending == (raw_code, best_code):
+                self.pending = None
+                return best_code, probability
+            self.pending = (raw_code, best_code)
+        else:
+            self.pending = None
+
+        return None, probability
@@ -0,0 +1,95 @@
+"""
+Postal Search Module
+Index-friendly postal code filters: anchored prefix ranges on detections.postal_code
+and an FTS5 table over the postal table (code, region, location) for text search
+"""
+
+import re
+import unicodedata
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from models import db, Detection
+from tunisia_postal_codes import POSTAL_CODES
+
+FTS_TABLE = 'postal_code_search'
+SEARCH_MODES = ('prefix', 'exact')
+
+def fts5_available(conn):
+    """Whether this SQLite build has the FTS5 extension"""
+    if conn.dialect.name != 'sqlite':
+        return False
+    options = {row[0] for row in conn.execute(text('PRAGMA compile_options'))}
+    return 'ENABLE_FTS5' in options
+
+def build_search_index(conn):
+    """(Re)build the FTS5 postal table on a Core connection; returns rows indexed (None without FTS5)"""
+    if not fts5_available(conn):
+        return None
+
+    conn.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"code, region, location, tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(
+        text(f'INSERT INTO {FTS_TABLE} (code, region, location) VALUES (:code, :region, :location)'),
+        [{'code': code, 'region': info['region'], 'location': info['location']} for code, info in POSTAL_CODES.items()]
+    )
+    return len(POSTAL_CODES)
+
+@event.listens_for(db.metadata, 'after_create')
+def _build_after_create(target, connection, **kw):
+    # Fresh databases built with create_all get the index too; existing ones get it from migration 007
+    if Detection.__table__ in kw.get('tables', ()):
+        build_search_index(connection)
+
+def prefix_bounds(prefix):
+    """Half-open [low, high) string range holding every value that starts with prefix"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def filter_postal_code(query, value, mode='prefix'):
+    """Restrict a Detection query to a postal code (exact) or code prefix, as an index range
+
+    A full 4-digit value is still a prefix: raw and foreign codes run up to 10 characters.
+    """
+    if not value:
+        return query  # Every code starts with the empty prefix
+    if mode == 'exact':
+        return query.filter(Detection.postal_code == value)
+    low, high = prefix_bounds(value)
+    return query.filter(Detection.postal_code >= low, Detection.postal_code < high)
+
+def _fts_query(terms):
+    # Every term must match, each as a quoted prefix so user input cannot inject FTS syntax
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+def _normalize(value):
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def codes_matching(session, search_text):
+    """
+    Postal codes whose code, region or location match every word of search_text
+
+    Uses the FTS5 table when it exists, otherwise scans the (small) postal table in Python.
+    """
+    terms = [term for term in re.split(r'\W+', search_text) if term]
+    if not terms:
+        return []
+
+    try:
+        rows = session.execute(
+            text(f'SELECT code FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query'),
+            {'query': _fts_query(terms)}
+        )
+        return [code for (code,) in rows]
+    except OperationalError:
+        pass  # No FTS5 index in this database (or no FTS5 in this SQLite build)
+
+    needles = [_normalize(term) for term in terms]
+    matches = []
+    for code, info in POSTAL_CODES.items():
+        words = re.split(r'\W+', _normalize(f"{code} {info['region']} {info['location']}"))
+        if all(any(word.startswith(needle) for word in words) for needle in needles):
+            matches.append(code)
+    return matches
@@ -0,0 +1,81 @@
+"""
+Query Plan Checks
+Runs EXPLAIN QUERY PLAN on the hot detection queries and reports full table scans
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_, literal
+from models import db, Detection
+from epoch_time import to_epoch_ms
+from detection_stats import hourly_counts_query
+from postal_search import filter_postal_code
+
+def _rollup_statement(start, end, user_id=None):
+    return hourly_counts_query(db.session, start, end, user_id).statement
+
+def _keyset_statement(query, now):
+    """A deep keyset page as built by pagination.keyset_paginate"""
+    key = tuple_(Detection.timestamp, Detection.id)
+    return query.filter(key < tuple_(literal(now, Detection.timestamp.type), 1000)).order_by(
+        Detection.timestamp.desc(), Detection.id.desc()).limit(51).statement
+
+def hot_queries():
+    """(name, statement) pairs mirroring the query shapes used by the endpoints"""
+    now = datetime.now()
+    day_start = datetime.combine(now.date(), datetime.min.time())
+    day_end = datetime.combine(now.date(), datetime.max.time())
+    count = db.func.count(Detection.id)
+
+    return [
+        ('user_history_page', _keyset_statement(Detection.query.filter_by(user_id=1), now)),
+        ('user_total', db.session.query(count).filter(Detection.user_id == 1).statement),
+        ('user_valid', db.session.query(count).filter(Detection.user_id == 1, Detection.is_valid == True).statement),
+        ('user_today', db.session.query(count).filter(Detection.user_id == 1, Detection.timestamp >= day_start).statement),
+        ('user_chart_rollups', _rollup_statement(day_start - timedelta(days=29), day_end, user_id=1)),
+        ('user_favorite_code', db.session.query(Detection.postal_code, count).filter(
+            Detection.user_id == 1, Detection.is_valid == True).group_by(Detection.postal_code).order_by(count.desc()).limit(1).statement),
+        ('admin_trend_rollups', _rollup_statement(day_start - timedelta(days=6), day_end)),
+        ('admin_hourly_rollups', _rollup_statement(day_start, day_end)),
+        ('recent_detections', Detection.query.order_by(Detection.timestamp.desc()).limit(50).statement),
+        ('detections_page', _keyset_statement(Detection.query, now)),
+        ('regional_counts', db.session.query(Detection.region, count).filter(
+            Detection.is_valid == True).group_by(Detection.region).statement),
+        ('user_regions', db.session.query(db.func.count(db.distinct(Detection.region))).filter(
+            Detection.user_id == 1, Detection.is_valid == True, Detection.region.isnot(None)).statement),
+        ('dynamic_chart_rollups', _rollup_statement(now - timedelta(days=7), now, user_id=1)),
+        ('postal_code_lookup', Detection.query.filter(Detection.postal_code == '2035').statement),
+        ('postal_code_prefix', filter_postal_code(Detection.query, '20').statement),
+        ('postal_code_page', _keyset_statement(filter_postal_code(Detection.query, '2035', 'exact'), now)),
+        ('region_page', _keyset_statement(Detection.query.filter(Detection.region == 'Tunis'), now)),
+    ]
+
+def _driver_params(compiled):
+    """Positional parameters for the raw DBAPI call; values only matter for their type"""
+    params = compiled.construct_params()
+    values = []
+    for name in compiled.positiontup:
+        value = params[name]
+        values.append(to_epoch_ms(value) if isinstance(value, datetime) else value)
+    return tuple(values)
+
+def explain(statement):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    engine = db.engine
+    compiled = statement.compile(dialect=engine.dialect)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), _driver_params(compiled)).fetchall()
+    return [row[-1] for row in rows]
+
+def check_hot_queries(table='detections'):
+    """
+    Explain every hot query
+
+    Returns:
+        list: dicts with name, plan lines and full_scan flag (a SCAN of the table without an index)
+    """
+    results = []
+    for name, statement in hot_queries():
+        plan = explain(statement)
+        full_scan = any(line.startswith(f'SCAN {table}') and 'INDEX' not in line for line in plan)
+        results.append({'name': name, 'plan': plan, 'full_scan': full_scan})
+    return results
@@ -0,0 +1,132 @@
+"""
+SQLite Profile Module
+Applies WAL, synchronous, cache, mmap and busy-timeout pragmas on every connection
+and provides a separate read-only connection pool for dashboard queries
+"""
+
+import logging
+from flask import g
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from models import db
+
+logger = logging.getLogger(__name__)
+
+def apply_pragmas(dbapi_connection, settings, read_only=False):
+    """Apply the tuning pragmas to a raw sqlite3 connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings['SQLITE_BUSY_TIMEOUT_MS'])}")
+        if not read_only:
+            # Only takes effect before the first table exists (or at the next full VACUUM)
+            cursor.execute(f"PRAGMA auto_vacuum = {settings['SQLITE_AUTO_VACUUM']}")
+            # journal_mode is persistent in the file; readers inherit WAL from the writer
+            cursor.execute(f"PRAGMA journal_mode = {settings['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous = {settings['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA cache_size = {int(settings['SQLITE_CACHE_SIZE'])}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings['SQLITE_MMAP_SIZE'])}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only = 1")
+    finally:
+        cursor.close()
+
+class SQLiteProfile:
+    def __init__(self, app=None):
+        self.app = app
+        self.read_engine = None
+        self.read_session_factory = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure engine options; must run before db.init_app(app)"""
+        self.app = app
+
+        app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+        app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')  # Safe with WAL; FULL for maximum durability
+        app.config.setdefault('SQLITE_CACHE_SIZE', -16000)  # Negative = KiB (16 MB)
+        app.config.setdefault('SQLITE_MMAP_SIZE', 64 * 1024 * 1024)
+        app.config.setdefault('SQLITE_BUSY_TIMEOUT_MS', 5000)
+        app.config.setdefault('SQLITE_AUTO_VACUUM', 'INCREMENTAL')  # Free pages are returned by db_maintenance
+        app.config.setdefault('SQLITE_READ_POOL_SIZE', 4)
+
+        if not self.is_sqlite():
+            return
+
+        engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        connect_args = engine_options.setdefault('connect_args', {})
+        connect_args.setdefault('timeout', app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0)
+        # Connections come from a pool and may be used by the OCR and writer threads
+        connect_args.setdefault('check_same_thread', False)
+
+        app.teardown_appcontext(self._remove_read_session)
+        app.extensions['sqlite_profile'] = self
+
+    def is_sqlite(self):
+        return self.app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite')
+
+    def bind(self):
+        """Attach the pragma listener to the primary engine and build the read-only pool"""
+        if not self.is_sqlite():
+            return
+
+        settings = self.app.config
+        with self.app.app_context():
+            engine = db.engine
+
+            @event.listens_for(engine, 'connect')
+            def _on_connect(dbapi_connection, connection_record):
+                apply_pragmas(dbapi_connection, settings)
+
+            self.create_read_engine(engine.url.database)
+
+    def create_read_engine(self, database_path):
+        """(Re)build the read-only pool for a database file"""
+        if not database_path or database_path == ':memory:':
+            return
+
+        settings = self.app.config
+        if self.read_engine is not None:
+            self.read_engine.dispose()
+
+        self.read_engine = create_engine(
+            f"sqlite:///file:{database_path}?mode=ro&uri=true",
+            pool_size=settings['SQLITE_READ_POOL_SIZE'],
+            connect_args={'timeout': settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0, 'check_same_thread': False}
+        )
+
+        @event.listens_for(self.read_engine, 'connect')
+        def _on_read_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, settings, read_only=True)
+
+        self.read_session_factory = sessionmaker(bind=self.read_engine)
+
+    def read_session(self):
+        """Session on the read-only pool for the current app context (primary session otherwise)"""
+        if self.read_session_factory is None:
+            return db.session
+        if 'read_session' not in g:
+            g.read_session = self.read_session_factory()
+        return g.read_session
+
+    def _remove_read_session(self, exception=None):
+        session = g.pop('read_session', None)
+        if session is not None:
+            session.close()
+
+    def pragma_report(self):
+        """Current pragma values as seen by a primary connection"""
+        with db.engine.connect() as conn:
+            return {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'busy_timeout', 'auto_vacuum')
+            }
+
+# Global instance
+sqlite_profile = SQLiteProfile()
+
+def read_session():
+    """Shortcut used by the dashboard endpoints"""
+    return sqlite_profile.read_session()
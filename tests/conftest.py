@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db
+import migrations  # noqa: F401 - registers the change-feed triggers for create_all
+
+@pytest.fixture
+def app(tmp_path):
+    """Bare Flask app on a temporary SQLite file, inside an app context"""
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    app.config['SECRET_KEY'] = 'test'
+    db.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
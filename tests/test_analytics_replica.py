@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Detection, SystemStats, DetectionRollup
+from detection_stats import record_inserts, record_deletes, rollup_totals, region_counts
+from sqlite_profile import sqlite_profile
+from analytics_replica import AnalyticsReplica
+
+@pytest.fixture
+def replica(app):
+    app.config['ANALYTICS_REPLICA'] = True
+    sqlite_profile.init_app(app)
+    db.create_all()
+    replica = AnalyticsReplica(app)
+    yield replica
+    if replica.writer is not None:
+        replica.writer.close()
+    if replica.engine is not None:
+        replica.engine.dispose()
+
+def _add(moments, code='2035', user_id=1):
+    detections = [Detection(postal_code=code, timestamp=moment, is_valid=True, user_id=user_id) for moment in moments]
+    db.session.add_all(detections)
+    record_inserts(detections)
+    db.session.commit()
+    return detections
+
+def _rollups(session):
+    return {(row.bucket_hour, row.user_id, row.region, row.is_valid): row.count
+            for row in session.query(DetectionRollup)}
+
+def test_refresh_copies_only_the_changed_hours(replica):
+    start = datetime(2026, 5, 1, 8)
+    detections = _add([start + timedelta(hours=hour) for hour in range(6)])
+
+    assert replica.refresh() is True
+    assert replica.stats['full_refreshes'] == 1
+    session = replica.session()
+    assert _rollups(session) == _rollups(db.session)
+    assert session.query(SystemStats).one().total_detections == 6
+
+    # One new hour and one emptied hour
+    _add([start + timedelta(hours=10)], code='1000', user_id=2)
+    record_deletes([detections[0]])
+    db.session.delete(detections[0])
+    db.session.commit()
+
+    assert replica.refresh() is True
+    assert replica.stats['full_refreshes'] == 1
+    assert replica.stats['last_rollup_hours'] == 2
+    session.close()
+    session = replica.session_factory()
+    assert _rollups(session) == _rollups(db.session)
+    assert rollup_totals(session) == (6, 6)
+    assert set(region_counts(session, user_id=2)) == {'Tunis'}
+    assert session.query(SystemStats).one().total_detections == 6
+    session.close()
+
+    # Nothing moved: no copy
+    assert replica.refresh() is False
+    assert replica.stats['skipped'] == 1
+    assert replica.to_dict()['changes_behind'] == 0
+
+def test_replica_holds_only_the_aggregates(replica):
+    _add([datetime(2026, 5, 1, 8)])
+    replica.refresh()
+    tables = {name for (name,) in replica.writer.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+    assert tables == {'system_stats', 'postal_code_tallies', 'detection_rollups'}
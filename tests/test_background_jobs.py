@@ -0,0 +1,47 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from models import db, Detection, ArchiveChunk, SystemStats, PostalCodeTally, DetectionRollup
+from detection_stats import record_inserts
+from detection_archive import detection_archiver
+from background_jobs import job_manager
+from pagination import keyset_paginate
+
+def _wait(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job.finished
+
+def test_system_reset_clears_the_archive_tier(app):
+    detection_archiver.init_app(app)
+    job_manager.init_app(app)
+    app.config['JOB_CHUNK_PAUSE_MS'] = 0
+    db.create_all()
+
+    old = datetime.now() - timedelta(days=500)
+    detections = [Detection(postal_code='2035', timestamp=old + timedelta(hours=index), is_valid=True)
+                  for index in range(5)]
+    detections.append(Detection(postal_code='1000', timestamp=datetime.now(), is_valid=True))
+    db.session.add_all(detections)
+    record_inserts(detections)
+    db.session.commit()
+
+    assert sum(moved for _, moved in detection_archiver.run_once()) == 5
+    chunk_path = os.path.join(detection_archiver.archive_dir, ArchiveChunk.query.one().path)
+    assert len(keyset_paginate(Detection.query, per_page=10, archive_filters={}).items) == 6
+
+    job = job_manager.start_system_reset()
+    assert job.total == 6
+    _wait(job)
+
+    assert job.status == 'completed', job.error
+    assert job.processed == 6
+    db.session.expire_all()
+    assert ArchiveChunk.query.count() == 0
+    assert not os.path.exists(chunk_path)
+    assert keyset_paginate(Detection.query, per_page=10, archive_filters={}).items == []
+    assert SystemStats.query.one().total_detections == 0
+    assert PostalCodeTally.query.count() == 0
+    assert DetectionRollup.query.count() == 0
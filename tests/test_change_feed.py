@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from models import db, Detection, DetectionChange
+from change_feed import change_triggers_suspended, fetch_changes, prune_changes
+from detection_stats import backfill_regions
+from epoch_time import to_epoch_ms
+
+def _ops():
+    return [(change.detection_id, change.op) for change in DetectionChange.query.order_by(DetectionChange.seq)]
+
+def test_triggers_record_visible_changes_only(app):
+    db.create_all()
+    detection = Detection(postal_code='2035', timestamp=datetime.now(), is_valid=True)
+    db.session.add(detection)
+    db.session.commit()
+
+    detection.is_valid = False
+    db.session.commit()
+    # Sync attribution is not part of to_dict(): no change row
+    detection.source_id = 7
+    db.session.commit()
+    db.session.delete(detection)
+    db.session.commit()
+
+    assert _ops() == [(1, 'insert'), (1, 'update'), (1, 'delete')]
+    page = fetch_changes(db.session)
+    assert [change['op'] for change in page['changes']] == ['delete']
+
+def test_changed_at_is_utc_epoch_millis(app):
+    db.create_all()
+    before = to_epoch_ms(datetime.now())
+    db.session.add(Detection(postal_code='2035', timestamp=datetime.now()))
+    db.session.commit()
+    after = to_epoch_ms(datetime.now())
+
+    kind, stored = db.session.execute(text('SELECT typeof(changed_at), changed_at FROM detection_changes')).one()
+    assert kind == 'integer'
+    assert before - 5 <= stored <= after + 5
+
+def test_region_backfill_stays_out_of_the_feed(app):
+    db.create_all()
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO detections (postal_code, timestamp, is_valid) VALUES ('2035', 0, 1)"))
+    with db.engine.begin() as conn:
+        with change_triggers_suspended(conn):
+            assert backfill_regions(conn, only_missing=False) == 1
+
+    assert _ops() == [(1, 'insert')]
+    # The triggers are back afterwards
+    db.session.get(Detection, 1).is_valid = False
+    db.session.commit()
+    assert _ops() == [(1, 'insert'), (1, 'update')]
+
+def test_prune_changes_by_age(app):
+    db.create_all()
+    old = to_epoch_ms(datetime.now() - timedelta(days=40))
+    recent = to_epoch_ms(datetime.now() - timedelta(days=1))
+    with db.engine.begin() as conn:
+        conn.execute(
+            text('INSERT INTO detection_changes (detection_id, op, changed_at) VALUES (:id, :op, :at)'),
+            [{'id': 1, 'op': 'insert', 'at': old}, {'id': 2, 'op': 'insert', 'at': old},
+             {'id': 3, 'op': 'insert', 'at': recent}]
+        )
+        assert prune_changes(conn, keep_days=30, keep_after=1) == 1
+
+    assert [change.detection_id for change in DetectionChange.query] == [2, 3]
@@ -0,0 +1,148 @@
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import detection_log as detection_log_module
+from models import db, Detection, SystemStats, PostalCodeTally
+from detection_log import (DetectionLog, HEADER, RECORD, LOG_MAGIC, LOG_VERSION, QUARANTINE_NAME, pack_record,
+                           segment_name)
+from detection_writer import DetectionWriter
+
+@pytest.fixture
+def log(app):
+    app.config['DETECTION_LOG_FSYNC_MS'] = 5
+    app.config['DETECTION_LOG_INDEX_MS'] = 10
+    db.create_all()
+    log = DetectionLog(app)
+    yield log
+    log.stop()
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def _segment_records(log):
+    return sum((os.path.getsize(path) - HEADER.size) // RECORD.size for _, path in log.segments())
+
+def test_indexer_projects_the_log_into_the_table(log):
+    moment = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    for index in range(20):
+        log.append(postal_code='2035' if index % 2 else '1000', timestamp=moment + timedelta(seconds=index),
+                   raw_postal_code='2O35' if index == 1 else None, confidence=90.5, is_valid=True)
+    seq = log.append(wait=True, postal_code='9999', timestamp=moment, is_valid=False)
+    assert seq == 20
+
+    _wait_for(lambda: log.applied_seq == 21)
+    db.session.expire_all()
+    rows = Detection.query.order_by(Detection.id).all()
+    assert len(rows) == 21
+    assert rows[0].timestamp == moment
+    assert rows[1].raw_postal_code == '2O35' and rows[1].region is not None
+    assert rows[20].is_valid is False and rows[20].confidence is None
+    assert SystemStats.query.one().total_detections == 21
+    assert {tally.postal_code: tally.count for tally in PostalCodeTally.query} == {'1000': 10, '2035': 10, '9999': 1}
+    assert log.backlog() == 0
+
+def test_recovery_drops_a_torn_tail_and_keeps_numbering(app, log):
+    for _ in range(5):
+        log.append(postal_code='2035')
+    log.append(wait=True, postal_code='2035')
+    _wait_for(lambda: log.applied_seq == 6)
+    log.stop()
+
+    # A crash mid-write: one whole record plus a torn one
+    (_, path), = log.segments()
+    with open(path, 'ab') as segment:
+        segment.write(pack_record(postal_code='1000'))
+        segment.write(pack_record(postal_code='1000')[:20])
+
+    reopened = DetectionLog(app)
+    reopened.open()
+    assert reopened.stats['recovered_bytes'] == 20
+    assert (reopened.applied_seq, reopened.next_seq) == (6, 7)
+    assert reopened.append(wait=True, postal_code='3000') == 7
+    _wait_for(lambda: reopened.applied_seq == 8)
+    reopened.stop()
+
+    db.session.expire_all()
+    assert [detection.postal_code for detection in Detection.query.order_by(Detection.id)] == ['2035'] * 6 + ['1000', '3000']
+
+def test_segment_torn_at_creation_continues_after_the_previous_one(app, log):
+    # A crash right after switching segments: records 0-2 unapplied, the next header half written
+    os.makedirs(log.log_dir)
+    with open(os.path.join(log.log_dir, segment_name(0)), 'wb') as segment:
+        segment.write(HEADER.pack(LOG_MAGIC, LOG_VERSION, RECORD.size, 0))
+        for code in ('1000', '2035', '3000'):
+            segment.write(pack_record(postal_code=code))
+    with open(os.path.join(log.log_dir, segment_name(3)), 'wb') as segment:
+        segment.write(HEADER.pack(LOG_MAGIC, LOG_VERSION, RECORD.size, 3)[:10])
+
+    log.open()
+    assert (log.segment_first, log.next_seq) == (3, 3)
+    assert log.append(wait=True, postal_code='4000') == 3
+    _wait_for(lambda: log.applied_seq == 4)
+    db.session.expire_all()
+    assert [detection.postal_code for detection in Detection.query.order_by(Detection.id)] == ['1000', '2035', '3000', '4000']
+
+def test_a_record_that_keeps_failing_is_quarantined(app, log, monkeypatch):
+    app.config['DETECTION_LOG_INDEX_RETRIES'] = 2
+    real_record_inserts = detection_log_module.record_inserts
+
+    def picky_record_inserts(facts, now=None):
+        if any(fact.postal_code == '6666' for fact in facts):
+            raise ValueError('poison')
+        return real_record_inserts(facts, now)
+
+    monkeypatch.setattr(detection_log_module, 'record_inserts', picky_record_inserts)
+    for index in range(10):
+        log.append(postal_code='6666' if index == 4 else '2035')
+    log.append(wait=True, postal_code='2035')
+
+    _wait_for(lambda: log.applied_seq == 11)
+    assert log.stats['quarantined'] == 1 and log.stats['index_failures'] >= 2
+    assert log.to_dict()['stalled_seq'] is None and log.backlog() == 0
+    with open(os.path.join(log.log_dir, QUARANTINE_NAME), 'rb') as quarantine:
+        data = quarantine.read()
+    assert len(data) == 8 + RECORD.size and struct.unpack_from('<Q', data)[0] == 4
+    db.session.expire_all()
+    assert Detection.query.count() == 10 and Detection.query.filter_by(postal_code='6666').count() == 0
+
+def test_failed_fsync_keeps_records_and_positions(log, monkeypatch):
+    log.append(wait=True, postal_code='1000')
+    real_fsync = os.fsync
+    failures = []
+
+    def flaky_fsync(fd):
+        if len(failures) < 2:
+            failures.append(fd)
+            raise OSError(5, 'Input/output error')
+        real_fsync(fd)
+
+    monkeypatch.setattr(detection_log_module.os, 'fsync', flaky_fsync)
+    seqs = [log.append(postal_code='2035') for _ in range(3)]
+    last = log.append(wait=True, timeout=10, postal_code='3000')
+
+    assert log.stats['write_failures'] >= 1
+    assert seqs + [last] == [1, 2, 3, 4]
+    assert log.durable_seq == log.next_seq == 5
+    assert _segment_records(log) == 5  # Nothing written twice
+    _wait_for(lambda: log.applied_seq == 5)
+    assert log.backlog() == 0
+    db.session.expire_all()
+    assert [detection.postal_code for detection in Detection.query.order_by(Detection.id)] == ['1000', '2035', '2035', '2035', '3000']
+
+def test_waiting_submit_returns_the_detection_id_on_the_log_path(app):
+    db.create_all()
+    writer = DetectionWriter(app)
+    assert app.config['DETECTION_INGEST'] == 'log'
+
+    detection_id = writer.submit(wait=True, postal_code='2035', timestamp=datetime.now())
+    writer.stop()
+
+    assert isinstance(detection_id, int)
+    assert db.session.get(Detection, detection_id).postal_code == '2035'
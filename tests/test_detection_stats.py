@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from models import db, Detection, SystemStats, PostalCodeTally, DetectionRollup
+from detection_stats import record_inserts, rebuild_stats, rebuild_rollups
+from detection_archive import detection_archiver
+
+def _snapshot():
+    db.session.expire_all()
+    stats = SystemStats.query.one()
+    return (stats.total_detections, stats.unique_codes_count,
+            {tally.postal_code: tally.count for tally in PostalCodeTally.query},
+            {(rollup.bucket_hour, rollup.user_id, rollup.region, rollup.is_valid): rollup.count
+             for rollup in DetectionRollup.query})
+
+def test_rebuilds_keep_counting_archived_months(app):
+    detection_archiver.init_app(app)
+    db.create_all()
+
+    old = datetime.now() - timedelta(days=500)
+    detections = [Detection(postal_code='9999' if index % 3 == 0 else '2035', timestamp=old + timedelta(hours=index),
+                            is_valid=index % 3 != 0, user_id=index % 2 or None) for index in range(12)]
+    detections += [Detection(postal_code='1000', timestamp=datetime.now(), is_valid=True)]
+    db.session.add_all(detections)
+    record_inserts(detections)
+    db.session.commit()
+
+    assert sum(moved for _, moved in detection_archiver.run_once()) == 12
+    assert Detection.query.count() == 1
+    expected = _snapshot()
+    assert expected[0] == 13
+
+    assert rebuild_stats(detection_archiver.archived_facts(db.session)) == (13, 3)
+    with db.engine.begin() as conn:
+        rebuild_rollups(conn, detection_archiver.archived_facts(conn))
+    assert _snapshot() == expected
@@ -0,0 +1,107 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Detection, SyncBatch, IngestLogPosition
+from edge_sync import EdgeSync, BatchTooLarge, apply_batch, register_sync_routes, _decompress
+from detection_archive import detection_archiver
+from epoch_time import to_epoch_ms
+
+MOMENT = datetime(2026, 3, 4, 5, 6, 7)
+
+@pytest.fixture
+def central(app):
+    app.config['SYNC_TOKEN'] = 'secret'
+    EdgeSync(app)
+    register_sync_routes(app)
+    db.create_all()
+    return app
+
+def _record(source_id, op='insert', code='2035', seq=None, moment=MOMENT):
+    record = {'seq': seq or source_id, 'op': op, 'source_id': source_id}
+    if op != 'delete':
+        record['detection'] = {'code': code, 'raw_code': None, 'timestamp_ms': to_epoch_ms(moment),
+                               'confidence': 91.0, 'is_valid': True}
+    return record
+
+def _batch(changes, epoch='a' * 32, first_seq=1, last_seq=10):
+    return {'node_id': 'edge-1', 'epoch': epoch, 'first_seq': first_seq, 'last_seq': last_seq, 'changes': changes}
+
+def _rows():
+    db.session.expire_all()
+    return {(row.source_epoch, row.source_id): row.postal_code
+            for row in Detection.query.filter(Detection.node_id == 'edge-1')}
+
+def test_replayed_batch_key_is_a_duplicate(central):
+    batch = _batch([_record(1), _record(2)])
+    assert apply_batch('edge-1:' + 'a' * 32 + ':1-10', batch)['inserted'] == 2
+    result = apply_batch('edge-1:' + 'a' * 32 + ':1-10', batch)
+    assert result['duplicate'] is True and result['inserted'] == 0
+    assert len(_rows()) == 2
+    assert SyncBatch.query.one().epoch == 'a' * 32
+
+def test_replayed_changes_upsert_and_deletes_apply(central):
+    apply_batch('k1', _batch([_record(1), _record(2)]))
+    # Same changes under another key (e.g. a re-sent range) update in place
+    result = apply_batch('k2', _batch([_record(1, 'update', code='1000'), _record(2, 'delete')]))
+    assert (result['inserted'], result['updated'], result['deleted']) == (0, 1, 1)
+    assert _rows() == {('a' * 32, 1): '1000'}
+
+def test_new_epoch_does_not_overwrite_rows_of_the_previous_one(central):
+    apply_batch('k1', _batch([_record(1, code='2035')]))
+    # The edge database was rebuilt: detection id 1 is a different detection now
+    result = apply_batch('k2', _batch([_record(1, code='1000')], epoch='b' * 32))
+    assert result['inserted'] == 1 and result['updated'] == 0
+    apply_batch('k3', _batch([_record(1, 'delete')], epoch='b' * 32))
+    assert _rows() == {('a' * 32, 1): '2035'}
+
+def test_changes_to_archived_rows_are_skipped(central):
+    detection_archiver.init_app(central)
+    old = datetime.now() - timedelta(days=500)
+    apply_batch('k1', _batch([_record(1, moment=old), _record(2, moment=old), _record(3, moment=old)]))
+    assert sum(moved for _, moved in detection_archiver.run_once()) == 3
+
+    # The archive keeps the attribution
+    archived = detection_archiver.page(db.session, {}, limit=10)
+    assert {(row.node_id, row.source_epoch, row.source_id) for row in archived} == {('edge-1', 'a' * 32, 1),
+                                                                                   ('edge-1', 'a' * 32, 2),
+                                                                                   ('edge-1', 'a' * 32, 3)}
+
+    result = apply_batch('k2', _batch([_record(1, 'update', code='1000', moment=old), _record(2, 'delete'),
+                                       _record(3, 'update', moment=old)], epoch='a' * 32))
+    assert (result['archived'], result['inserted'], result['updated'], result['deleted']) == (3, 0, 0, 0)
+    # Another epoch's row 1 is a different detection
+    assert apply_batch('k3', _batch([_record(1, 'update', moment=old)], epoch='b' * 32))['inserted'] == 1
+    assert _rows() == {('b' * 32, 1): '2035'}
+
+def test_ingest_route_checks_the_key_against_node_and_epoch(central):
+    client = central.test_client()
+    headers = {'Authorization': 'Bearer secret', 'Content-Encoding': 'gzip'}
+    body = gzip.compress(json.dumps(_batch([_record(1)])).encode('utf-8'))
+
+    response = client.post('/api/sync/batches', data=body, headers={**headers, 'Idempotency-Key': 'edge-1:1-10'})
+    assert response.status_code == 400
+    response = client.post('/api/sync/batches', data=body,
+                           headers={**headers, 'Idempotency-Key': 'edge-1:' + 'a' * 32 + ':1-10'})
+    assert response.status_code == 200 and response.get_json()['inserted'] == 1
+
+def test_sync_epoch_is_kept_until_the_position_is_cleared(app):
+    db.create_all()
+    sync = EdgeSync(app)
+    epoch = sync.sync_epoch()
+    assert len(epoch) == 32 and sync.sync_epoch() == epoch
+
+    # What a restored backup looks like: same cursor, no epoch
+    position = db.session.get(IngestLogPosition, 'edge_sync')
+    position.applied_seq, position.epoch = 7, None
+    db.session.commit()
+    assert sync.sync_epoch() != epoch
+    assert sync.pushed_cursor() == 7
+
+def test_decompress_stops_at_the_limit():
+    body = gzip.compress(b'x' * 1000)
+    assert _decompress(body, 1000) == b'x' * 1000
+    with pytest.raises(BatchTooLarge):
+        _decompress(body, 999)
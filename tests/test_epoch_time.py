@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from epoch_time import HOUR_MS, to_epoch_ms, from_epoch_ms, format_epoch_ms, parse_timestamp
+
+@pytest.fixture(params=['UTC', 'Africa/Tunis', 'Europe/Paris', 'Asia/Kolkata', 'Australia/Lord_Howe'])
+def local_zone(request, monkeypatch):
+    """Run under several local time zones, including DST changes and non-hour offsets"""
+    monkeypatch.setenv('TZ', request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+def _sample_ms():
+    values = []
+    # Every 7 minutes 13 seconds through a year covers both DST changes in each zone
+    start = to_epoch_ms(datetime(2026, 1, 1, tzinfo=timezone.utc))
+    step = (7 * 60 + 13) * 1000 + 17
+    values.extend(range(start, start + 366 * 24 * HOUR_MS, step))
+    # Dense around the European spring and autumn changes (01:00 UTC)
+    for change in (datetime(2026, 3, 29, 1, tzinfo=timezone.utc), datetime(2026, 10, 25, 1, tzinfo=timezone.utc)):
+        middle = to_epoch_ms(change)
+        values.extend(range(middle - 2 * HOUR_MS, middle + 2 * HOUR_MS, 59 * 1000 + 999))
+    return values
+
+def test_format_matches_per_row_strftime(local_zone):
+    values = _sample_ms()
+    expected = [from_epoch_ms(millis).strftime("%Y-%m-%d %H:%M:%S") for millis in values]
+    assert format_epoch_ms(values) == expected
+
+def test_format_keeps_none_and_honours_other_patterns(local_zone):
+    values = [None, to_epoch_ms(datetime(2026, 7, 14, 9, 5, 3, 250000)), None]
+    assert format_epoch_ms(values) == [None, '2026-07-14 09:05:03', None]
+    assert format_epoch_ms(values, pattern='%d/%m/%Y %H:%M') == [None, '14/07/2026 09:05', None]
+    assert format_epoch_ms([]) == []
+
+def test_epoch_ms_round_trip(local_zone):
+    moment = datetime(2026, 2, 3, 4, 5, 6, 789000)
+    assert from_epoch_ms(to_epoch_ms(moment)) == moment
+    assert to_epoch_ms(datetime(1970, 1, 1, tzinfo=timezone.utc)) == 0
+    assert to_epoch_ms(datetime(2026, 1, 1, 0, 0, 0, 999999, tzinfo=timezone.utc)) % 1000 == 999
+
+def test_parse_timestamp(local_zone):
+    millis = to_epoch_ms(datetime(2026, 5, 6, 7, 8, 9, tzinfo=timezone.utc))
+    expected = from_epoch_ms(millis)
+    assert parse_timestamp(millis) == expected
+    assert parse_timestamp(str(millis)) == expected
+    assert parse_timestamp('2026-05-06T07:08:09+00:00') == expected
+    assert parse_timestamp('2026-05-06T07:08:09') == datetime(2026, 5, 6, 7, 8, 9)
+    assert parse_timestamp('20260506') == datetime(2026, 5, 6)  # Compact ISO date, not epoch ms
+    with pytest.raises(ValueError):
+        parse_timestamp('yesterday')
+    with pytest.raises(TypeError):
+        parse_timestamp(None)
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, inspect, text
+
+from models import db, Detection, DetectionRollup, PostalCodeTally
+from migrations import MIGRATIONS, current_version, run_migrations, stamp_head
+from epoch_time import to_epoch_ms
+from query_plans import check_hot_queries
+
+# Schema as created by create_all before the first migration
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password VARCHAR(255) NOT NULL,
+        role VARCHAR(20) NOT NULL, is_approved BOOLEAN, full_name VARCHAR(100), email VARCHAR(120),
+        department VARCHAR(50), phone VARCHAR(20), address TEXT, bio TEXT, profile_updated_at DATETIME,
+        created_at DATETIME, last_login DATETIME, password_reset_at DATETIME,
+        PRIMARY KEY (id), UNIQUE (username))""",
+    """CREATE TABLE system_stats (
+        id INTEGER NOT NULL, start_time DATETIME, total_detections INTEGER,
+        unique_codes_count INTEGER, last_updated DATETIME, PRIMARY KEY (id))""",
+    """CREATE TABLE detections (
+        id INTEGER NOT NULL, postal_code VARCHAR(10) NOT NULL, timestamp DATETIME, confidence FLOAT,
+        user_id INTEGER, is_valid BOOLEAN, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id))""",
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+def _create_baseline(detections):
+    with db.engine.begin() as conn:
+        for ddl in BASELINE_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users (id, username, password, role) VALUES (1, 'user1', 'x', 'user')"))
+        if not detections:
+            return
+        conn.execute(
+            text('INSERT INTO detections (postal_code, timestamp, confidence, user_id, is_valid) '
+                 'VALUES (:postal_code, :timestamp, 80.0, 1, :is_valid)'),
+            [{'postal_code': code, 'timestamp': moment.strftime('%Y-%m-%d %H:%M:%S.%f'), 'is_valid': valid}
+             for code, moment, valid in detections]
+        )
+
+def _schema(conn):
+    inspector = inspect(conn)
+    return {
+        table: ({column['name'] for column in inspector.get_columns(table)},
+                {index['name'] for index in inspector.get_indexes(table)})
+        for table in inspector.get_table_names() if table != 'schema_migrations'
+    }
+
+def test_migrations_upgrade_a_baseline_database(app):
+    moment = datetime(2025, 3, 14, 9, 26, 53, 589000)
+    detections = [
+        ('1000', moment, True),
+        ('1000', moment + timedelta(minutes=5), True),
+        ('2035', moment + timedelta(hours=2), True),
+        ('0000', moment + timedelta(hours=2, minutes=1), False),
+    ]
+    _create_baseline(detections)
+
+    assert run_migrations() == [number for number, _, _ in MIGRATIONS]
+    with db.engine.connect() as conn:
+        assert current_version(conn) == HEAD
+        stored = conn.execute(text('SELECT typeof(timestamp), timestamp FROM detections ORDER BY id')).fetchall()
+        triggers = dict(conn.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).fetchall())
+
+    # Local text datetimes became UTC epoch ms, and read back as the same datetimes
+    assert [row[0] for row in stored] == ['integer'] * len(detections)
+    assert [row[1] for row in stored] == [to_epoch_ms(moment) for _, moment, _ in detections]
+    assert [detection.timestamp for detection in Detection.query.order_by(Detection.id)] == [
+        moment for _, moment, _ in detections]
+
+    # Backfills: regions, tallies, hourly rollups
+    assert db.session.get(Detection, 3).region is not None
+    assert db.session.get(Detection, 4).region is None
+    assert {tally.postal_code: tally.count for tally in PostalCodeTally.query} == {'1000': 2, '2035': 1, '0000': 1}
+    assert sum(rollup.count for rollup in DetectionRollup.query) == len(detections)
+    assert {'trg_detections_insert_change', 'trg_detections_update_change', 'trg_detections_delete_change'} <= set(triggers)
+    assert 'AFTER UPDATE OF' in triggers['trg_detections_update_change']
+
+    # A second run has nothing to do
+    assert run_migrations() == []
+
+def test_migrated_schema_matches_a_fresh_database(app, tmp_path):
+    _create_baseline([])
+    run_migrations()
+    with db.engine.connect() as conn:
+        migrated = _schema(conn)
+
+    fresh_engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    db.metadata.create_all(fresh_engine)
+    with fresh_engine.connect() as conn:
+        fresh = _schema(conn)
+    fresh_engine.dispose()
+
+    for table, (columns, indexes) in fresh.items():
+        assert table in migrated
+        assert migrated[table][0] == columns, table
+        assert indexes <= migrated[table][1], table
+
+def test_migrated_database_hot_queries_use_an_index(app):
+    _create_baseline([])
+    run_migrations()
+
+    assert [result['name'] for result in check_hot_queries() if result['full_scan']] == []
+
+def test_stamped_fresh_database_has_no_pending_migrations(app):
+    db.create_all()
+    stamp_head()
+
+    assert run_migrations() == []
+    with db.engine.connect() as conn:
+        assert current_version(conn) == HEAD
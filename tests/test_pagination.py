@@ -0,0 +1,59 @@
+import base64
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from models import db, Detection
+from detection_archive import detection_archiver
+from detection_rows import listing_query
+from epoch_time import HOUR_MS, to_epoch_ms, from_epoch_ms
+from pagination import keyset_paginate, decode_cursor
+
+@pytest.fixture
+def paris(app, monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/Paris')
+    time.tzset()
+    detection_archiver.init_app(app)
+    db.create_all()
+    yield app
+    monkeypatch.undo()
+    time.tzset()
+
+def _walk(query, per_page):
+    seen, cursor = [], None
+    while True:
+        page = keyset_paginate(query, cursor=cursor, per_page=per_page, archive_filters={})
+        seen.extend(row.id for row in page.items)
+        if not page.next_cursor:
+            return seen
+        cursor = page.next_cursor
+
+@pytest.mark.parametrize('listing', [False, True])
+def test_pages_cross_the_fall_back_hour_without_gaps(paris, listing):
+    # 00:00-03:00 UTC on the autumn change: local 02:00-03:00 happens twice
+    start = to_epoch_ms(datetime(2026, 10, 25, 0, tzinfo=timezone.utc))
+    db.session.add_all(Detection(postal_code='2035', timestamp=from_epoch_ms(start + index * 10 * 60 * 1000))
+                       for index in range(3 * HOUR_MS // (10 * 60 * 1000)))
+    db.session.commit()
+    expected = [row.id for row in Detection.query.order_by(Detection.timestamp.desc(), Detection.id.desc())]
+    assert len(expected) == 18
+
+    query = listing_query() if listing else Detection.query
+    assert _walk(query, per_page=4) == expected
+
+def test_cursor_holds_epoch_ms_and_accepts_the_old_format(paris):
+    detection = Detection(postal_code='2035', timestamp=datetime(2026, 10, 25, 2, 30, fold=1))
+    db.session.add(detection)
+    db.session.add(Detection(postal_code='2035', timestamp=datetime(2026, 10, 25, 2, 30)))
+    db.session.commit()
+
+    page = keyset_paginate(Detection.query, per_page=1)
+    assert page.items == [detection]
+    assert decode_cursor(page.next_cursor) == ('n', to_epoch_ms(detection.timestamp), detection.id)
+
+    legacy = base64.urlsafe_b64encode(json.dumps(['n', '2026-10-25T02:30:00', 5]).encode()).decode()
+    assert decode_cursor(legacy) == ('n', to_epoch_ms(datetime(2026, 10, 25, 2, 30)), 5)
+    with pytest.raises(ValueError):
+        decode_cursor(base64.urlsafe_b64encode(b'["n", null, 5]').decode())
@@ -0,0 +1,13 @@
+from models import db
+from migrations import stamp_head
+from query_plans import check_hot_queries
+
+def test_hot_queries_use_an_index(app):
+    db.create_all()
+    stamp_head()
+
+    results = check_hot_queries()
+
+    assert results
+    full_scans = {result['name']: result['plan'] for result in results if result['full_scan']}
+    assert full_scans == {}
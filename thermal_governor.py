@@ -0,0 +1,137 @@
+"""
+Thermal Governor Module
+Steps the detector down under CPU/thermal pressure (Raspberry Pi) and back up with headroom
+"""
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Degradation levels, applied in order: video feed first, then OCR effort, then scan rate
+# (jpeg_quality None = the encoder default, i.e. the stream as it was before the governor)
+GOVERNOR_LEVELS = [
+    {'name': 'normal', 'stream_fps': 30, 'jpeg_quality': None, 'ocr_strategies': None, 'scan_interval_factor': 1.0},
+    {'name': 'reduced_feed', 'stream_fps': 15, 'jpeg_quality': 70, 'ocr_strategies': None, 'scan_interval_factor': 1.0},
+    {'name': 'reduced_ocr', 'stream_fps': 10, 'jpeg_quality': 60, 'ocr_strategies': 8, 'scan_interval_factor': 1.0},
+    {'name': 'reduced_scan_rate', 'stream_fps': 10, 'jpeg_quality': 60, 'ocr_strategies': 4, 'scan_interval_factor': 2.0},
+    {'name': 'critical', 'stream_fps': 5, 'jpeg_quality': 50, 'ocr_strategies': 2, 'scan_interval_factor': 4.0},
+]
+
+THERMAL_ZONE_PATH = '/sys/class/thermal/thermal_zone0/temp'
+PROC_STAT_PATH = '/proc/stat'
+
+class ThermalGovernor:
+    """Samples CPU usage and SoC temperature and moves one level at a time with hysteresis"""
+
+    def __init__(self, sample_interval=2.0, hold_time=10.0,
+                 temp_high=75.0, temp_low=65.0, cpu_high=90.0, cpu_low=60.0):
+        self.sample_interval = sample_interval
+        self.hold_time = hold_time  # Minimum seconds between two level changes
+        self.temp_high = temp_high
+        self.temp_low = temp_low
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+
+        self.level = 0
+        self.last_change = 0.0
+        self.cpu_usage = None
+        self.temperature = None
+        self.level_changes = 0
+        self.running = False
+        self.thread = None
+        self._last_cpu_times = None
+
+    @property
+    def settings(self):
+        return GOVERNOR_LEVELS[self.level]
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='thermal-governor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def read_temperature(self):
+        """SoC temperature in °C, None where the sysfs thermal zone is missing"""
+        try:
+            with open(THERMAL_ZONE_PATH) as zone:
+                return int(zone.read().strip()) / 1000.0
+        except (OSError, ValueError):
+            return None
+
+    def read_cpu_usage(self):
+        """CPU busy percentage since the previous sample, from /proc/stat"""
+        try:
+            with open(PROC_STAT_PATH) as stat:
+                fields = [int(value) for value in stat.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+        total = sum(fields)
+        previous = self._last_cpu_times
+        self._last_cpu_times = (idle, total)
+        if previous is None or total == previous[1]:
+            return self.cpu_usage  # Not enough elapsed time; keep the last reading
+        return round(100.0 * (1.0 - (idle - previous[0]) / (total - previous[1])), 1)
+
+    def sample(self):
+        """Take one reading and adjust the level if needed"""
+        self.cpu_usage = self.read_cpu_usage()
+        self.temperature = self.read_temperature()
+
+        under_pressure = (
+            (self.temperature is not None and self.temperature >= self.temp_high) or
+            (self.cpu_usage is not None and self.cpu_usage >= self.cpu_high)
+        )
+        has_headroom = (
+            (self.temperature is None or self.temperature <= self.temp_low) and
+            (self.cpu_usage is None or self.cpu_usage <= self.cpu_low)
+        )
+
+        now = time.monotonic()
+        if now - self.last_change < self.hold_time:
+            return
+
+        if under_pressure and self.level < len(GOVERNOR_LEVELS) - 1:
+            self._set_level(self.level + 1, now)
+        elif has_headroom and self.level > 0:
+            self._set_level(self.level - 1, now)
+
+    def _set_level(self, level, now):
+        logger.info(f"Governor level {self.level} -> {level} ({GOVERNOR_LEVELS[level]['name']}), "
+                    f"cpu={self.cpu_usage}% temp={self.temperature}°C")
+        self.level = level
+        self.last_change = now
+        self.level_changes += 1
+
+    def _run(self):
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Governor sampling error: {e}")
+            time.sleep(self.sample_interval)
+
+    def to_dict(self):
+        return {
+            'level': self.level,
+            'max_level': len(GOVERNOR_LEVELS) - 1,
+            'name': self.settings['name'],
+            'settings': dict(self.settings),
+            'cpu_usage': self.cpu_usage,
+            'temperature': self.temperature,
+            'level_changes': self.level_changes,
+            'thresholds': {
+                'temp_high': self.temp_high,
+                'temp_low': self.temp_low,
+                'cpu_high': self.cpu_high,
+                'cpu_low': self.cpu_low
+            },
+            'running': self.running
+        }